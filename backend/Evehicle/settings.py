@@ -41,6 +41,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'webapp.middleware.MetricsMiddleware',
+    'webapp.middleware.RequestProfilingMiddleware',
+    'webapp.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,6 +83,24 @@ DATABASES = {
     }
 }
 
+# Read replicas: add each one to DATABASES with 'TEST': {'MIRROR': 'default'}
+# and list its alias here. Safe requests then read from a random replica,
+# see webapp/routers.py. For example:
+#
+# DATABASES['replica'] = {
+#     'ENGINE': 'django.db.backends.sqlite3',
+#     'NAME': BASE_DIR / 'db-replica.sqlite3',
+#     'TEST': {'MIRROR': 'default'},
+# }
+# DATABASE_REPLICAS = ['replica']
+DATABASE_REPLICAS = []
+
+DATABASE_ROUTERS = ['webapp.routers.ReplicaRouter']
+
+# Seconds a principal keeps reading from the primary after a write. Pins are
+# kept in the cache, which must be shared by all workers to hold across them.
+REPLICA_STICKY_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -99,6 +120,217 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+PASSWORD_HASHERS = [
+    'webapp.hashers.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# PBKDF2 cost. Stored hashes with a different count are re-hashed on login.
+PASSWORD_HASHER_ITERATIONS = 1_000_000
+
+
+# Django REST framework
+# The JSON renderer and parser use orjson when it is installed and behave
+# exactly like DRF's own classes when it is not.
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'webapp.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'webapp.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+
+# Password hashing pool
+# Login and registration hash passwords on a bounded worker pool. When all
+# workers are busy and the queue is full, requests fail fast with a 503.
+
+PASSWORD_HASHING_WORKERS = 4
+
+PASSWORD_HASHING_QUEUE_DEPTH = 16
+
+# Seconds to wait for a queued hash before giving up
+PASSWORD_HASHING_TIMEOUT = 5
+
+# Seconds sent back to clients in the Retry-After header
+PASSWORD_HASHING_RETRY_AFTER = 2
+
+
+# Profile caching
+# Serialized profiles are cached per principal and dropped on PUT.
+
+PROFILE_CACHE_TIMEOUT = 300
+
+
+# Trip location ingest and geofences
+# Fences are indexed in memory on a lat/lng grid, see webapp/geofencing.py.
+
+TRIP_LOCATION_MAX_BATCH = 5000
+
+# Grid cell size in degrees, about 1.1 km of latitude
+GEOFENCE_GRID_DEGREES = 0.01
+
+# Cells per owner index before the grid is coarsened
+GEOFENCE_MAX_CELLS = 200_000
+
+
+# Driving behaviour analytics
+# Thresholds used to summarise trips from their location fixes, see
+# webapp/analytics.py.
+
+# Slower than this counts as idle
+ANALYTICS_IDLE_SPEED_KMH = 3
+
+# Faster than this is a GPS jump and the segment is ignored
+ANALYTICS_MAX_SPEED_KMH = 250
+
+# Idle this long in one go is a stop
+ANALYTICS_STOP_MIN_SECONDS = 120
+
+# Fixes further apart than this are too coarse for acceleration estimates
+ANALYTICS_MAX_GAP_SECONDS = 10
+
+# m/s², about 0.3 g and 0.35 g
+ANALYTICS_HARSH_ACCELERATION = 3.0
+
+ANALYTICS_HARSH_BRAKING = 3.5
+
+
+# Vehicle dashboard
+# Composite vehicle screen payload, see webapp/dashboard.py.
+
+VEHICLE_DASHBOARD_TRIPS = 10
+
+VEHICLE_DASHBOARD_FUEL_LOGS = 10
+
+
+# Compliance
+# Insurance, inspection and license expiry across a fleet, see
+# webapp/compliance.py.
+
+# Days ahead counted as expiring soon in the summary, and the default window
+COMPLIANCE_WINDOW_DAYS = 30
+
+# Longest window a client may ask for
+COMPLIANCE_MAX_WINDOW_DAYS = 365
+
+# Summaries are also dropped whenever a document changes
+COMPLIANCE_SUMMARY_TIMEOUT = 3600
+
+
+# Driver scoring
+# Scores from trips and driving behaviour, and per owner leaderboards, see
+# webapp/scoring.py. The weights add up to 1.
+
+DRIVER_SCORE_SAFETY_WEIGHT = 0.5
+
+DRIVER_SCORE_RELIABILITY_WEIGHT = 0.3
+
+DRIVER_SCORE_EXPERIENCE_WEIGHT = 0.2
+
+# Harsh accelerations and brakings per 100 tracked km that bring safety to 0
+DRIVER_SCORE_MAX_EVENTS_PER_100_KM = 20
+
+# Distance at which experience is full
+DRIVER_SCORE_DISTANCE_TARGET_KM = 5000
+
+LEADERBOARD_DEFAULT_SIZE = 50
+
+LEADERBOARD_MAX_SIZE = 500
+
+# Rows changed this long before the newest one seen are read again on refresh
+LEADERBOARD_REFRESH_OVERLAP_SECONDS = 5
+
+
+# Driver assignment
+# Bulk rota changes, see webapp/assignments.py.
+
+# Drivers per UPDATE statement
+DRIVER_ASSIGNMENT_BATCH_SIZE = 500
+
+DRIVER_ASSIGNMENT_MAX = 10000
+
+
+# Mechanic dispatch
+# Nearest available mechanic for a breakdown, see webapp/dispatch.py.
+
+# Search rings, each tried in turn until enough candidates are found
+DISPATCH_SEARCH_RADII_KM = (5, 20, 50, 150)
+
+# Mechanics ranked per search, claimed in order until one succeeds
+DISPATCH_CANDIDATES = 5
+
+# Searches per request, each one past the mechanics already tried
+DISPATCH_MAX_ROUNDS = 3
+
+DISPATCH_BULK_MAX_INCIDENTS = 100
+
+
+# Cost of ownership
+# Monthly cost buckets per vehicle, see webapp/costs.py.
+
+# Longest range one report may cover
+COST_REPORT_MAX_MONTHS = 120
+
+
+# Mobile delta sync
+# Change tokens over updated_at and delete tombstones, see webapp/sync.py.
+
+# Records per collection in one response, the client calls again while has_more
+SYNC_PAGE_SIZE = 500
+
+# Rows written this recently wait for the next sync, longer than any write
+# transaction so none commits behind a cursor
+SYNC_SAFETY_SECONDS = 5
+
+# Tombstones are purged after this long, tokens older than that get a full sync
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+
+# Request profiling
+# Per-request timing, query counts and repeated query shapes (N+1 loops).
+# When disabled the middleware removes itself and costs nothing.
+
+REQUEST_PROFILING_ENABLED = DEBUG
+
+# Send X-Request-Time-Ms, X-DB-Time-Ms, X-DB-Queries and X-DB-Duplicate-Queries
+REQUEST_PROFILING_HEADERS = True
+
+# A query shape seen this many times in one request is reported
+REQUEST_PROFILING_DUPLICATE_THRESHOLD = 3
+
+REQUEST_PROFILING_SLOW_MS = 500
+
+# Fraction of requests run under cProfile, dumps are kept for slow ones only
+REQUEST_PROFILING_SAMPLE_RATE = 0.05
+
+REQUEST_PROFILING_DIR = BASE_DIR / 'profiles'
+
+
+# Metrics
+# Scraped from /metrics in Prometheus text format, see webapp/metrics.py.
+
+METRICS_ENABLED = True
+
+# Shared directory where each worker process snapshots its metrics. Needed
+# when running several worker processes, otherwise a scrape only sees the
+# process that answered it.
+METRICS_DIR = None
+
+# Seconds between snapshots
+METRICS_FLUSH_INTERVAL = 10
+
+# Addresses allowed to scrape, empty allows no one
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -117,6 +349,49 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (vehicle images, insurance, inspection and license documents)
+
+MEDIA_URL = 'media/'
+
+MEDIA_ROOT = BASE_DIR / 'media'
+
+
+# Vehicle image variants
+# Resized on first request and cached on disk, see webapp/thumbnails.py
+
+VEHICLE_IMAGE_VARIANTS = {
+    'list': (160, 120),
+    'detail': (800, 600),
+}
+
+VEHICLE_IMAGE_CACHE_DIR = MEDIA_ROOT / 'thumbnails'
+
+VEHICLE_IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Minimum seconds between cache size checks
+VEHICLE_IMAGE_EVICTION_INTERVAL = 300
+
+VEHICLE_IMAGE_WORKERS = 2
+
+# Seconds a request waits for a variant to be generated
+VEHICLE_IMAGE_TIMEOUT = 10
+
+
+# Vehicle import
+# Bulk onboarding from a CSV file, see webapp/onboarding.py.
+
+# Rows validated and written together
+VEHICLE_IMPORT_BATCH_SIZE = 500
+
+# Processes decoding photos, None for one per CPU
+VEHICLE_IMPORT_WORKERS = None
+
+# Imported photos are scaled down to fit and stored as JPEG
+VEHICLE_IMPORT_IMAGE_MAX_SIZE = (1600, 1600)
+
+VEHICLE_IMPORT_IMAGE_QUALITY = 85
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
+from webapp.views import metrics_view
 
 urlpatterns = [
-    #path('',include('webapp.urls')),
+    path('', include('webapp.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
 ]
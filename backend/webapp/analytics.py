@@ -0,0 +1,189 @@
+from math import asin, cos, radians, sin, sqrt
+
+from django.conf import settings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Driving behaviour derived from consecutive TripLocation fixes.
+#
+# Each pair of fixes is a segment with a distance, a duration and a speed.
+# Segments with no elapsed time or an implausible speed (GPS jumps) are
+# ignored. Valid segments slower than ANALYTICS_IDLE_SPEED_KMH count as idle,
+# and an unbroken idle run of ANALYTICS_STOP_MIN_SECONDS or more is a stop.
+# The change in speed between two adjacent valid segments, both shorter than
+# ANALYTICS_MAX_GAP_SECONDS, is an acceleration; a run of accelerations
+# beyond the harsh thresholds counts as one harsh event.
+#
+# TripStats applies this one fix at a time so ingest can keep per-trip
+# totals current. recompute() does the same over a whole trip at once and
+# uses numpy when it is installed.
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = radians(lat1), radians(lng1), radians(lat2), radians(lng2)
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+class TripStats:
+    # Running totals plus the little state needed to continue from the last fix
+
+    FIELDS = (
+        'point_count', 'tracked_distance_km', 'moving_seconds', 'idle_seconds', 'stop_count',
+        'max_speed_kmh', 'harsh_acceleration_count', 'harsh_braking_count',
+        'last_latitude', 'last_longitude', 'last_timestamp', 'last_speed', 'last_duration',
+        'idle_run_seconds', 'harsh_state',
+    )
+
+    def __init__(self, **values):
+        self.point_count = 0
+        self.tracked_distance_km = 0.0
+        self.moving_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.stop_count = 0
+        self.max_speed_kmh = 0.0
+        self.harsh_acceleration_count = 0
+        self.harsh_braking_count = 0
+        self.last_latitude = None
+        self.last_longitude = None
+        self.last_timestamp = None
+        # Speed in m/s and duration of the previous segment, None when it was invalid
+        self.last_speed = None
+        self.last_duration = None
+        self.idle_run_seconds = 0.0
+        self.harsh_state = ''
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def add(self, points):
+        # points: (latitude, longitude, timestamp) in timestamp order
+        idle_kmh = settings.ANALYTICS_IDLE_SPEED_KMH
+        max_kmh = settings.ANALYTICS_MAX_SPEED_KMH
+        stop_seconds = settings.ANALYTICS_STOP_MIN_SECONDS
+        max_gap = settings.ANALYTICS_MAX_GAP_SECONDS
+        harsh_accel = settings.ANALYTICS_HARSH_ACCELERATION
+        harsh_brake = settings.ANALYTICS_HARSH_BRAKING
+
+        for lat, lng, timestamp in points:
+            self.point_count += 1
+            previous = self.last_timestamp
+            if previous is None:
+                self.last_latitude, self.last_longitude, self.last_timestamp = lat, lng, timestamp
+                continue
+
+            duration = (timestamp - previous).total_seconds()
+            distance = haversine_km(self.last_latitude, self.last_longitude, lat, lng)
+            self.last_latitude, self.last_longitude, self.last_timestamp = lat, lng, timestamp
+
+            speed_kmh = distance / duration * 3600 if duration > 0 else None
+            if speed_kmh is None or speed_kmh > max_kmh:
+                self.last_speed = self.last_duration = None
+                self.harsh_state = ''
+                continue
+
+            self.tracked_distance_km += distance
+            self.max_speed_kmh = max(self.max_speed_kmh, speed_kmh)
+            if speed_kmh < idle_kmh:
+                self.idle_seconds += duration
+                self.idle_run_seconds += duration
+            else:
+                self.moving_seconds += duration
+                if self.idle_run_seconds >= stop_seconds:
+                    self.stop_count += 1
+                self.idle_run_seconds = 0.0
+
+            speed = speed_kmh / 3.6
+            state = ''
+            if self.last_speed is not None and duration <= max_gap and self.last_duration <= max_gap:
+                acceleration = (speed - self.last_speed) / ((duration + self.last_duration) / 2)
+                if acceleration >= harsh_accel:
+                    state = 'accelerating'
+                elif acceleration <= -harsh_brake:
+                    state = 'braking'
+                if state == 'accelerating' and self.harsh_state != state:
+                    self.harsh_acceleration_count += 1
+                elif state == 'braking' and self.harsh_state != state:
+                    self.harsh_braking_count += 1
+            self.harsh_state = state
+            self.last_speed, self.last_duration = speed, duration
+
+    def finalize(self):
+        # A trip that ends while standing still ends in a stop
+        if self.idle_run_seconds >= settings.ANALYTICS_STOP_MIN_SECONDS:
+            self.stop_count += 1
+        self.idle_run_seconds = 0.0
+
+
+def _recompute_numpy(latitudes, longitudes, timestamps):
+    stats = TripStats(point_count=len(timestamps))
+    if len(timestamps) < 2:
+        if timestamps:
+            stats.last_latitude, stats.last_longitude, stats.last_timestamp = latitudes[0], longitudes[0], timestamps[0]
+        return stats
+
+    lat = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    lng = numpy.radians(numpy.asarray(longitudes, dtype=float))
+    seconds = numpy.array([(t - timestamps[0]).total_seconds() for t in timestamps])
+
+    a = (numpy.sin(numpy.diff(lat) / 2) ** 2
+         + numpy.cos(lat[:-1]) * numpy.cos(lat[1:]) * numpy.sin(numpy.diff(lng) / 2) ** 2)
+    distance = 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(a))
+    duration = numpy.diff(seconds)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        speed_kmh = numpy.where(duration > 0, distance / duration * 3600, numpy.inf)
+    valid = speed_kmh <= settings.ANALYTICS_MAX_SPEED_KMH
+
+    idle = valid & (speed_kmh < settings.ANALYTICS_IDLE_SPEED_KMH)
+    moving = valid & ~idle
+    stats.tracked_distance_km = float(distance[valid].sum())
+    stats.idle_seconds = float(duration[idle].sum())
+    stats.moving_seconds = float(duration[moving].sum())
+    stats.max_speed_kmh = float(speed_kmh[valid].max()) if valid.any() else 0.0
+
+    # Idle runs over valid segments only, a run ends at the next moving segment
+    valid_idle = idle[valid]
+    valid_duration = duration[valid]
+    if valid_idle.size:
+        run_id = numpy.cumsum(~valid_idle)
+        run_seconds = numpy.bincount(run_id[valid_idle], weights=valid_duration[valid_idle],
+                                     minlength=run_id[-1] + 1)
+        closed = run_seconds[:run_id[-1] + (0 if valid_idle[-1] else 1)]
+        stats.stop_count = int((closed >= settings.ANALYTICS_STOP_MIN_SECONDS).sum())
+        stats.idle_run_seconds = float(run_seconds[run_id[-1]]) if valid_idle[-1] else 0.0
+
+    max_gap = settings.ANALYTICS_MAX_GAP_SECONDS
+    speed = speed_kmh / 3.6
+    paired = valid[1:] & valid[:-1] & (duration[1:] <= max_gap) & (duration[:-1] <= max_gap)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        acceleration = (speed[1:] - speed[:-1]) / ((duration[1:] + duration[:-1]) / 2)
+    # Segment i + 1 carries the state of the pair that ends with it
+    accelerating = numpy.zeros(len(duration), dtype=bool)
+    braking = numpy.zeros(len(duration), dtype=bool)
+    accelerating[1:] = paired & (acceleration >= settings.ANALYTICS_HARSH_ACCELERATION)
+    braking[1:] = paired & (acceleration <= -settings.ANALYTICS_HARSH_BRAKING)
+    stats.harsh_acceleration_count = int((accelerating[1:] & ~accelerating[:-1]).sum())
+    stats.harsh_braking_count = int((braking[1:] & ~braking[:-1]).sum())
+
+    stats.last_latitude, stats.last_longitude, stats.last_timestamp = latitudes[-1], longitudes[-1], timestamps[-1]
+    if valid[-1]:
+        stats.last_speed, stats.last_duration = float(speed[-1]), float(duration[-1])
+    stats.harsh_state = 'accelerating' if accelerating[-1] else 'braking' if braking[-1] else ''
+    return stats
+
+
+def recompute(points):
+    # Totals for a whole trip from its fixes in timestamp order
+    if numpy is None:
+        stats = TripStats()
+        stats.add(points)
+        return stats
+    latitudes, longitudes, timestamps = zip(*points) if points else ((), (), ())
+    return _recompute_numpy(latitudes, longitudes, list(timestamps))
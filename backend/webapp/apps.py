@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class WebappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'webapp'
+
+    def ready(self):
+        # Connect the document reference counting signals
+        from . import documents  # noqa: F401
+        # Sync tombstones for deleted records
+        from . import sync  # noqa: F401
+        # Compliance expiry index for insurances, inspections and licenses
+        from . import compliance  # noqa: F401
+        # Monthly cost buckets for fuel, maintenance and parts
+        from . import costs  # noqa: F401
+        # Driver scores, updated as trips finish
+        from . import scoring  # noqa: F401
@@ -0,0 +1,89 @@
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+# Compact, lossless encoding of one trip's TripLocation rows for the cold
+# archive. Columns are stored one after another: ids and timestamps as
+# deltas, latitudes and longitudes as raw doubles with their bytes grouped
+# by position. Neighbouring fixes share most of their high bytes, so zlib
+# does far better on the grouped form than on rows.
+
+MAGIC = b'TLA1'
+HEADER = struct.Struct('<4sI')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def _deltas(values):
+    previous = 0
+    out = array('q')
+    for value in values:
+        out.append(value - previous)
+        previous = value
+    return out
+
+
+def _undelta(deltas):
+    total = 0
+    out = []
+    for delta in deltas:
+        total += delta
+        out.append(total)
+    return out
+
+
+def _little_endian(column):
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+def _shuffle(raw, width):
+    return b''.join(raw[i::width] for i in range(width))
+
+
+def _unshuffle(raw, width):
+    count = len(raw) // width
+    planes = [raw[i * count:(i + 1) * count] for i in range(width)]
+    out = bytearray(len(raw))
+    for i, plane in enumerate(planes):
+        out[i::width] = plane
+    return bytes(out)
+
+
+def pack_locations(rows):
+    # rows: (id, latitude, longitude, timestamp) in the order they should come back
+    count = len(rows)
+    ids = _little_endian(_deltas(row[0] for row in rows))
+    times = _little_endian(_deltas((row[3] - EPOCH) // MICROSECOND for row in rows))
+    lats = _little_endian(array('d', (row[1] for row in rows)))
+    lngs = _little_endian(array('d', (row[2] for row in rows)))
+    body = ids.tobytes() + times.tobytes() + _shuffle(lats.tobytes(), 8) + _shuffle(lngs.tobytes(), 8)
+    return HEADER.pack(MAGIC, count) + zlib.compress(body, 9)
+
+
+def unpack_columns(blob):
+    # (id deltas, microsecond deltas, latitudes, longitudes) as arrays in
+    # native byte order, for callers that work on whole columns
+    magic, count = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError('Not a trip location archive')
+    body = zlib.decompress(blob[HEADER.size:])
+    size = count * 8
+
+    def column(index, typecode, shuffled=False):
+        raw = body[index * size:(index + 1) * size]
+        values = array(typecode, _unshuffle(raw, 8) if shuffled else raw)
+        return _little_endian(values)
+
+    return column(0, 'q'), column(1, 'q'), column(2, 'd', True), column(3, 'd', True)
+
+
+def unpack_locations(blob):
+    id_deltas, time_deltas, lats, lngs = unpack_columns(blob)
+    ids = _undelta(id_deltas)
+    times = [EPOCH + micros * MICROSECOND for micros in _undelta(time_deltas)]
+    return list(zip(ids, lats, lngs, times))
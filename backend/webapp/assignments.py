@@ -0,0 +1,75 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import profile_cache_key
+from .models import Driver, Vehicle
+
+# Rota changes: many drivers moved between an owner's vehicles at once.
+#
+# The unique_driver_per_vehicle constraint is checked row by row, so a swap
+# or a rotation cannot be written in place. Every driver that moves, and
+# every driver left on a vehicle someone else takes, is first cleared, then
+# the new vehicles are written with bulk_update, a batch of CASE updates,
+# all in one transaction. Queries grow with the number of batches, not
+# drivers. Queryset updates skip the Driver signals, so the vehicles and
+# cached profiles they would have refreshed are handled here.
+
+
+def _batches(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def reassign(owner, changes):
+    # changes: {driver_id: vehicle_id or None}. Drivers on a vehicle that
+    # changes gives to someone else are unassigned. Raises ValueError when a
+    # driver or vehicle is unknown or not the owner's, or a vehicle is given twice.
+    given = Counter(vehicle_id for vehicle_id in changes.values() if vehicle_id is not None)
+    twice = sorted(vehicle_id for vehicle_id, count in given.items() if count > 1)
+    if twice:
+        raise ValueError(f'Vehicles assigned to more than one driver: {", ".join(map(str, twice))}')
+
+    batch_size = settings.DRIVER_ASSIGNMENT_BATCH_SIZE
+    with transaction.atomic():
+        current = dict(Driver.objects.select_for_update().filter(pk__in=list(changes)).values_list('pk', 'vehicle_id'))
+        unknown = sorted(set(changes) - set(current))
+        if unknown:
+            raise ValueError(f'Drivers not found: {", ".join(map(str, unknown))}')
+
+        involved = set(given) | {vehicle_id for vehicle_id in current.values() if vehicle_id is not None}
+        owned = set(Vehicle.objects.filter(owner=owner, pk__in=list(involved)).values_list('pk', flat=True))
+        foreign = sorted(involved - owned)
+        if foreign:
+            # A driver on another owner's vehicle is not this owner's to move
+            raise ValueError(f'Vehicles not found: {", ".join(map(str, foreign))}')
+
+        moving = {pk: vehicle_id for pk, vehicle_id in changes.items() if current[pk] != vehicle_id}
+        displaced = dict(Driver.objects.select_for_update()
+                         .filter(vehicle_id__in=[vehicle_id for vehicle_id in moving.values() if vehicle_id is not None])
+                         .exclude(pk__in=list(changes)).values_list('pk', 'vehicle_id'))
+
+        # updated_at is stamped while clearing, so the CASE only carries the vehicle
+        now = timezone.now()
+        for batch in _batches([*moving, *displaced], batch_size):
+            Driver.objects.filter(pk__in=batch).update(vehicle=None, updated_at=now)
+        Driver.objects.bulk_update(
+            [Driver(pk=pk, vehicle_id=vehicle_id) for pk, vehicle_id in moving.items() if vehicle_id is not None],
+            ['vehicle'], batch_size=batch_size,
+        )
+
+        # Vehicle payloads name their driver, see sync.touch_assigned_vehicles
+        touched = ({current[pk] for pk in moving} | set(moving.values()) | set(displaced.values())) - {None}
+        for batch in _batches(touched, batch_size):
+            Vehicle.objects.filter(pk__in=batch).update(updated_at=now)
+
+    cache.delete_many([profile_cache_key('driver', pk) for pk in [*moving, *displaced]])
+    return {
+        'changed': len(moving),
+        'unchanged': len(changes) - len(moving),
+        'unassigned': sorted(displaced),
+    }
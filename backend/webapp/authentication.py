@@ -1,9 +1,14 @@
 
+import logging
+
 from rest_framework import permissions
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
+from .metrics import AUTH_TOKEN_LOOKUPS
 from .models import DriverToken, CarOwnerToken, MechanicToken
 
+logger = logging.getLogger('webapp.auth')
+
 
 class IsAuthenticated(permissions.BasePermission):
     
@@ -27,10 +32,16 @@ class DriverTokenAuthentication(BaseAuthentication):
             print(f" Looking for driver token: '{token_key}'")
 
             # Find the driver token
-            driver_token = DriverToken.objects.get(key=token_key)
+            driver_token = DriverToken.objects.select_related('driver').get(key=token_key)
             driver = driver_token.driver
 
+            if driver_token.is_expired():
+                logger.debug('Driver token expired for %s (ID: %s)', driver.username, driver.id)
+                AUTH_TOKEN_LOOKUPS.labels('driver', 'expired').inc()
+                raise AuthenticationFailed('Token has expired')
+
             print(f"  SUCCESS: Authenticated driver {driver.username} (ID: {driver.id})")
+            AUTH_TOKEN_LOOKUPS.labels('driver', 'found').inc()
 
             # Add required attributes for DRF
             driver.is_authenticated = True
@@ -40,7 +51,10 @@ class DriverTokenAuthentication(BaseAuthentication):
 
         except DriverToken.DoesNotExist:
             print(f"  Driver token not found: {token_key}")
+            AUTH_TOKEN_LOOKUPS.labels('driver', 'not_found').inc()
             raise AuthenticationFailed('Invalid token')
+        except AuthenticationFailed:
+            raise
         except Exception as e:
             print(f"  Driver authentication error: {e}")
             raise AuthenticationFailed('Authentication failed')
@@ -65,10 +79,16 @@ class CarOwnerTokenAuthentication(BaseAuthentication):
             print(f" Looking for car owner token: '{token_key}'")
 
             # Find the car owner token
-            car_owner_token = CarOwnerToken.objects.get(key=token_key)
+            car_owner_token = CarOwnerToken.objects.select_related('car_owner').get(key=token_key)
             car_owner = car_owner_token.car_owner
 
+            if car_owner_token.is_expired():
+                logger.debug('Car owner token expired for %s (ID: %s)', car_owner.username, car_owner.id)
+                AUTH_TOKEN_LOOKUPS.labels('car_owner', 'expired').inc()
+                raise AuthenticationFailed('Token has expired')
+
             print(f"  SUCCESS: Authenticated car owner {car_owner.username} (ID: {car_owner.id})")
+            AUTH_TOKEN_LOOKUPS.labels('car_owner', 'found').inc()
 
             # Add required attributes for DRF
             car_owner.is_authenticated = True
@@ -78,7 +98,10 @@ class CarOwnerTokenAuthentication(BaseAuthentication):
 
         except CarOwnerToken.DoesNotExist:
             print(f"  Car owner token not found: {token_key}")
+            AUTH_TOKEN_LOOKUPS.labels('car_owner', 'not_found').inc()
             raise AuthenticationFailed('Invalid token')
+        except AuthenticationFailed:
+            raise
         except Exception as e:
             print(f"  Car owner authentication error: {e}")
             raise AuthenticationFailed('Authentication failed')
@@ -103,10 +126,16 @@ class MechanicTokenAuthentication(BaseAuthentication):
             print(f" Looking for mechanic token: '{token_key}'")
 
             # Find the mechanic token
-            mechanic_token = MechanicToken.objects.get(key=token_key)
+            mechanic_token = MechanicToken.objects.select_related('mechanic').get(key=token_key)
             mechanic = mechanic_token.mechanic
 
+            if mechanic_token.is_expired():
+                logger.debug('Mechanic token expired for %s (ID: %s)', mechanic.username, mechanic.id)
+                AUTH_TOKEN_LOOKUPS.labels('mechanic', 'expired').inc()
+                raise AuthenticationFailed('Token has expired')
+
             print(f"  SUCCESS: Authenticated mechanic {mechanic.username} (ID: {mechanic.id})")
+            AUTH_TOKEN_LOOKUPS.labels('mechanic', 'found').inc()
 
             # Add required attributes for DRF
             mechanic.is_authenticated = True
@@ -116,7 +145,10 @@ class MechanicTokenAuthentication(BaseAuthentication):
 
         except MechanicToken.DoesNotExist:
             print(f"  Mechanic token not found: {token_key}")
+            AUTH_TOKEN_LOOKUPS.labels('mechanic', 'not_found').inc()
             raise AuthenticationFailed('Invalid token')
+        except AuthenticationFailed:
+            raise
         except Exception as e:
             print(f"  Mechanic authentication error: {e}")
             raise AuthenticationFailed('Authentication failed')
@@ -141,9 +173,13 @@ class MultiUserTokenAuthentication(BaseAuthentication):
 
         # Try Driver token first
         try:
-            driver_token = DriverToken.objects.get(key=token_key)
+            driver_token = DriverToken.objects.select_related('driver').get(key=token_key)
             driver = driver_token.driver
+            if driver_token.is_expired():
+                AUTH_TOKEN_LOOKUPS.labels('driver', 'expired').inc()
+                raise AuthenticationFailed('Token has expired')
             print(f"  SUCCESS: Authenticated driver {driver.username} (ID: {driver.id})")
+            AUTH_TOKEN_LOOKUPS.labels('driver', 'found').inc()
             driver.is_authenticated = True
             driver.is_anonymous = False
             return (driver, driver_token)
@@ -152,9 +188,13 @@ class MultiUserTokenAuthentication(BaseAuthentication):
 
         # Try CarOwner token
         try:
-            car_owner_token = CarOwnerToken.objects.get(key=token_key)
+            car_owner_token = CarOwnerToken.objects.select_related('car_owner').get(key=token_key)
             car_owner = car_owner_token.car_owner
+            if car_owner_token.is_expired():
+                AUTH_TOKEN_LOOKUPS.labels('car_owner', 'expired').inc()
+                raise AuthenticationFailed('Token has expired')
             print(f"  SUCCESS: Authenticated car owner {car_owner.username} (ID: {car_owner.id})")
+            AUTH_TOKEN_LOOKUPS.labels('car_owner', 'found').inc()
             car_owner.is_authenticated = True
             car_owner.is_anonymous = False
             return (car_owner, car_owner_token)
@@ -163,9 +203,13 @@ class MultiUserTokenAuthentication(BaseAuthentication):
 
         # Try Mechanic token
         try:
-            mechanic_token = MechanicToken.objects.get(key=token_key)
+            mechanic_token = MechanicToken.objects.select_related('mechanic').get(key=token_key)
             mechanic = mechanic_token.mechanic
+            if mechanic_token.is_expired():
+                AUTH_TOKEN_LOOKUPS.labels('mechanic', 'expired').inc()
+                raise AuthenticationFailed('Token has expired')
             print(f"  SUCCESS: Authenticated mechanic {mechanic.username} (ID: {mechanic.id})")
+            AUTH_TOKEN_LOOKUPS.labels('mechanic', 'found').inc()
             mechanic.is_authenticated = True
             mechanic.is_anonymous = False
             return (mechanic, mechanic_token)
@@ -173,6 +217,7 @@ class MultiUserTokenAuthentication(BaseAuthentication):
             print(" Token not found in Mechanic tokens")
 
         print(f"  Token not found in any user type: {token_key}")
+        AUTH_TOKEN_LOOKUPS.labels('any', 'not_found').inc()
         raise AuthenticationFailed('Invalid token')
 
     def authenticate_header(self, request):
@@ -0,0 +1,186 @@
+# bench.py
+#
+# Shared plumbing for the bench_* management commands: a throwaway database
+# and a synthetic fleet to run against.
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+
+from .models import CarOwner, Driver, FuelLog, Mechanic, Reminder, Trip, Vehicle
+
+
+def create_tables():
+    # Apps without committed migrations get their tables straight from the
+    # models. Also used by tests.py, outside any transaction.
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as editor:
+        for model in apps.get_app_config('webapp').get_models():
+            if model._meta.db_table not in existing:
+                editor.create_model(model)
+
+
+@contextmanager
+def temporary_database(verbosity=0):
+    # Benchmarks never touch the configured database. SQLite gets a file
+    # rather than shared memory so concurrent writers wait instead of failing.
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    original_test_name = test_settings.get('NAME')
+    scratch_dir = None
+    if connection.vendor == 'sqlite' and not original_test_name:
+        scratch_dir = tempfile.mkdtemp(prefix='bench-')
+        test_settings['NAME'] = os.path.join(scratch_dir, 'bench.sqlite3')
+
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        create_tables()
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        test_settings['NAME'] = original_test_name
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _users(prefix, count, encoded_password):
+    if encoded_password is None:
+        return [None] * count
+    return User.objects.bulk_create([
+        User(username=f'{prefix}{i}', email=f'{prefix}{i}@fleet.test', password=encoded_password)
+        for i in range(count)
+    ])
+
+
+def seed_fleet(owners=1, vehicles_per_owner=10, trips_per_vehicle=50,
+               fuel_logs_per_vehicle=50, reminders_per_vehicle=10, mechanics=0,
+               password=None, seed=0):
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    # One hash shared by every seeded account, hashing each would dominate seeding
+    encoded_password = make_password(password) if password else None
+
+    owner_users = _users('owner', owners, encoded_password)
+    car_owners = CarOwner.objects.bulk_create([
+        CarOwner(user=user, username=f'owner{o}', email=f'owner{o}@fleet.test',
+                 phone_number=f'+1000{o:06d}', address=f'{o} Depot Road')
+        for o, user in enumerate(owner_users)
+    ])
+
+    mechanic_users = _users('mechanic', mechanics, encoded_password)
+    seeded_mechanics = Mechanic.objects.bulk_create([
+        Mechanic(user=user, username=f'mechanic{m}', email=f'mechanic{m}@fleet.test',
+                 phone_number=f'+3000{m:06d}', speciality='engine', location='Nairobi')
+        for m, user in enumerate(mechanic_users)
+    ])
+
+    vehicles = Vehicle.objects.bulk_create([
+        Vehicle(owner=owner, vehicle_number=f'KB{o:03d}{v:04d}', model='Model',
+                manufacturer='Maker', year_of_manufacture=2015 + v % 10,
+                current_odometer=1000 * v)
+        for o, owner in enumerate(car_owners)
+        for v in range(vehicles_per_owner)
+    ])
+
+    driver_users = _users('driver', len(vehicles), encoded_password)
+    drivers = Driver.objects.bulk_create([
+        Driver(user=user, username=f'driver{i}', email=f'driver{i}@fleet.test',
+               phone_number=f'+2000{i:06d}', licence_number=f'DL{i:08d}', vehicle=vehicle)
+        for i, (user, vehicle) in enumerate(zip(driver_users, vehicles))
+    ])
+
+    trips = []
+    fuel_logs = []
+    reminders = []
+    for driver, vehicle in zip(drivers, vehicles):
+        for t in range(trips_per_vehicle):
+            started_at = now - timedelta(hours=t * 5 + rng.randint(0, 4))
+            completed = rng.random() < 0.9
+            trips.append(Trip(
+                driver=driver, vehicle=vehicle,
+                start_lat=-1.28 + rng.uniform(-0.1, 0.1), start_lng=36.82 + rng.uniform(-0.1, 0.1),
+                end_lat=-1.28 + rng.uniform(-0.1, 0.1) if completed else None,
+                end_lng=36.82 + rng.uniform(-0.1, 0.1) if completed else None,
+                distance_km=round(rng.uniform(1, 80), 2) if completed else 0.0,
+                started_at=started_at,
+                ended_at=started_at + timedelta(minutes=rng.randint(5, 180)) if completed else None,
+                status='completed' if completed else 'ongoing',
+            ))
+        for f in range(fuel_logs_per_vehicle):
+            quantity = round(rng.uniform(10, 60), 2)
+            price = round(rng.uniform(1.2, 2.0), 2)
+            fuel_logs.append(FuelLog(
+                vehicle=vehicle, date=(now - timedelta(days=f * 3)).date(),
+                fuel_type='petrol', quantity_liters=quantity, price_per_liter=price,
+                total_cost=quantity * price, odometer_reading=vehicle.current_odometer + f * 300,
+            ))
+        for r in range(reminders_per_vehicle):
+            reminders.append(Reminder(
+                vehicle=vehicle, reminder_type='MAINTENANCE', related_id=r,
+                message=f'Service due for {vehicle.vehicle_number}',
+                reminder_date=now + timedelta(days=r * 7 - 14),
+            ))
+
+    Trip.objects.bulk_create(trips, batch_size=500)
+    FuelLog.objects.bulk_create(fuel_logs, batch_size=500)
+    Reminder.objects.bulk_create(reminders, batch_size=500)
+
+    return {'owners': car_owners, 'vehicles': vehicles, 'drivers': drivers, 'mechanics': seeded_mechanics}
+
+
+def synthetic_trip(rng, count):
+    # 1 Hz fixes with cruising, traffic light stops, hard braking and the odd GPS jump
+    lat, lng = -1.28, 36.82
+    timestamp = timezone.now() - timedelta(days=1)
+    speed = 0.0
+    heading = rng.uniform(0, 2 * math.pi)
+    stopped_for = 0
+    points = []
+    for _ in range(count):
+        if stopped_for:
+            stopped_for -= 1
+            speed = 0.0
+        elif rng.random() < 0.003:
+            stopped_for = rng.randint(30, 300)
+        else:
+            speed = min(max(speed + rng.gauss(0.1, 0.8), 0.0), 30.0)
+        heading += rng.gauss(0, 0.05)
+        lat += speed * math.sin(heading) / 111_000
+        lng += speed * math.cos(heading) / 111_000
+        timestamp += timedelta(seconds=rng.choice((1, 1, 1, 1, 2, 0)))
+        if rng.random() < 0.001:
+            points.append((lat + 0.05, lng, timestamp))
+        else:
+            points.append((lat, lng, timestamp))
+    return points
+
+
+def best_of(func, repeat=5):
+    # Best wall time of several runs, the least noisy estimate on a shared box
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
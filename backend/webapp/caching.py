@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import PROFILE_CACHE
+
+
+def profile_cache_key(kind, pk):
+    return f'profile:{kind}:{pk}'
+
+
+def profile_etag(kind, obj):
+    return quote_etag(f'{kind}-{obj.pk}-{obj.updated_at.timestamp()}')
+
+
+def invalidate_profile(kind, pk):
+    cache.delete(profile_cache_key(kind, pk))
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Per-principal data, clients must revalidate and proxies must not share it
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def profile_response(request, kind, serializer_class):
+    obj = request.user
+    etag = profile_etag(kind, obj)
+    last_modified = int(obj.updated_at.timestamp())
+
+    # Answer If-None-Match / If-Modified-Since before doing any serialization
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        PROFILE_CACHE.labels(kind, 'not_modified').inc()
+        return _set_validators(not_modified, etag, last_modified)
+
+    key = profile_cache_key(kind, obj.pk)
+    cached = cache.get(key)
+    if cached and cached[0] == etag:
+        PROFILE_CACHE.labels(kind, 'hit').inc()
+        data = cached[1]
+    else:
+        PROFILE_CACHE.labels(kind, 'miss').inc()
+        data = serializer_class(obj).data
+        cache.set(key, (etag, data), settings.PROFILE_CACHE_TIMEOUT)
+
+    return _set_validators(Response(data, status=status.HTTP_200_OK), etag, last_modified)
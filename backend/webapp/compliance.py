@@ -0,0 +1,132 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Min, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ComplianceItem, Inspection, Insurance, License, Vehicle
+
+# Expiry tracking across insurances, inspections and licenses.
+#
+# Every document has a ComplianceItem row carrying its owner and expiry
+# date, written by the receivers below, so "what expires in the next N
+# days across my fleet" is one indexed range read. rebuild_compliance_index
+# restores the rows after bulk writes that skip signals.
+
+# model: (kind, reference field)
+SOURCES = {
+    Insurance: ('insurance', 'policy_number'),
+    Inspection: ('inspection', 'certificate_number'),
+    License: ('license', 'license_number'),
+}
+
+
+def summary_key(owner_id):
+    return f'compliance:summary:{owner_id}'
+
+
+def invalidate_summaries(*owner_ids):
+    cache.delete_many([summary_key(owner_id) for owner_id in owner_ids if owner_id is not None])
+
+
+def expiring(owner, days, include_expired=True):
+    today = timezone.now().date()
+    items = ComplianceItem.objects.filter(owner=owner, expiry_date__lte=today + timedelta(days=days))
+    if not include_expired:
+        items = items.filter(expiry_date__gte=today)
+    return items.order_by('expiry_date', 'id')
+
+
+def _counts(today, window_end):
+    return {
+        'total': Count('pk'),
+        'expired': Count('pk', filter=Q(expiry_date__lt=today)),
+        'expiring_7_days': Count('pk', filter=Q(expiry_date__gte=today, expiry_date__lte=today + timedelta(days=7))),
+        'expiring_in_window': Count('pk', filter=Q(expiry_date__gte=today, expiry_date__lte=window_end)),
+    }
+
+
+def summary(owner_id):
+    # Cached until a document changes or the day turns over, expiry is by date
+    today = timezone.now().date()
+    cached = cache.get(summary_key(owner_id))
+    if cached and cached['as_of'] == today.isoformat():
+        return cached
+
+    window_end = today + timedelta(days=settings.COMPLIANCE_WINDOW_DAYS)
+    items = ComplianceItem.objects.filter(owner_id=owner_id)
+    counts = _counts(today, window_end)
+    by_kind = {kind: dict.fromkeys(counts, 0) for kind, _label in ComplianceItem.KINDS}
+    for row in items.order_by().values('kind').annotate(**counts):
+        by_kind[row.pop('kind')] = row
+
+    fleet = items.aggregate(
+        vehicles_needing_attention=Count('vehicle', distinct=True, filter=Q(expiry_date__lte=window_end)),
+        next_expiry=Min('expiry_date', filter=Q(expiry_date__gte=today)),
+    )
+    data = {
+        'as_of': today.isoformat(),
+        'window_days': settings.COMPLIANCE_WINDOW_DAYS,
+        **{name: sum(row[name] for row in by_kind.values()) for name in counts},
+        'vehicles_needing_attention': fleet['vehicles_needing_attention'],
+        'next_expiry': fleet['next_expiry'].isoformat() if fleet['next_expiry'] else None,
+        'by_kind': by_kind,
+    }
+    cache.set(summary_key(owner_id), data, settings.COMPLIANCE_SUMMARY_TIMEOUT)
+    return data
+
+
+@receiver(post_save, sender=Insurance)
+@receiver(post_save, sender=Inspection)
+@receiver(post_save, sender=License)
+def index_document(sender, instance, update_fields=None, **kwargs):
+    kind, reference = SOURCES[sender]
+    # Document uploads save the file field only
+    if update_fields is not None and not {'vehicle', 'expiry_date', reference} & set(update_fields):
+        return
+    owner_id = instance.vehicle.owner_id
+    items = ComplianceItem.objects.filter(kind=kind, object_id=instance.pk)
+    previous_owner = items.values_list('owner_id', flat=True).first()
+    values = {
+        'vehicle_id': instance.vehicle_id,
+        'owner_id': owner_id,
+        'reference': getattr(instance, reference),
+        'expiry_date': instance.expiry_date,
+    }
+    if previous_owner is not None:
+        items.update(updated_at=timezone.now(), **values)
+    else:
+        try:
+            with transaction.atomic():
+                ComplianceItem.objects.create(kind=kind, object_id=instance.pk, **values)
+        except IntegrityError:
+            # A concurrent save of the same new document indexed it first
+            items.update(updated_at=timezone.now(), **values)
+    invalidate_summaries(owner_id, previous_owner)
+
+
+@receiver(post_delete, sender=Insurance)
+@receiver(post_delete, sender=Inspection)
+@receiver(post_delete, sender=License)
+def unindex_document(sender, instance, **kwargs):
+    kind, _reference = SOURCES[sender]
+    owner_ids = set(ComplianceItem.objects.filter(kind=kind, object_id=instance.pk).values_list('owner_id', flat=True))
+    ComplianceItem.objects.filter(kind=kind, object_id=instance.pk).delete()
+    invalidate_summaries(*owner_ids)
+
+
+@receiver(post_save, sender=Vehicle)
+def follow_vehicle_owner(sender, instance, created, update_fields=None, **kwargs):
+    # A vehicle handed to another owner takes its documents along, saves
+    # that leave the owner alone, odometer updates and the like, skip the query
+    if created or (update_fields is not None and 'owner' not in update_fields):
+        return
+    moved = ComplianceItem.objects.filter(vehicle=instance).exclude(owner_id=instance.owner_id)
+    previous = set(moved.values_list('owner_id', flat=True))
+    if previous:
+        moved.update(owner_id=instance.owner_id, updated_at=timezone.now())
+        invalidate_summaries(instance.owner_id, *previous)
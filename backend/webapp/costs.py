@@ -0,0 +1,245 @@
+from datetime import date, datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import FuelLog, MaintenanceLog, PartReplacement, Vehicle, VehicleMonthlyCost, deleted_with_vehicle
+
+# Cost of ownership in monthly buckets.
+#
+# Each fuel log, maintenance log and replaced part adds its cost to the
+# VehicleMonthlyCost row for its vehicle and month. The receivers below
+# apply every write as a delta with F() expressions: the old contribution
+# is read before a save and taken out of its bucket, the new one is added.
+# Reports then sum at most twelve rows per vehicle and year, however many
+# logs there are. rebuild_cost_buckets recomputes buckets from the raw
+# rows, for data written by bulk operations that skip signals.
+
+COST_FIELDS = ('fuel_cost', 'fuel_log_count', 'maintenance_cost', 'maintenance_count', 'parts_cost')
+
+
+def month_of(value):
+    if isinstance(value, datetime):
+        value = timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value.replace(day=1)
+
+
+def _contribution(model, vehicle_id, when, cost):
+    # ((vehicle_id, month), {field: delta}) for one row
+    key = (vehicle_id, month_of(when))
+    if model is FuelLog:
+        return key, {'fuel_cost': cost, 'fuel_log_count': 1}
+    if model is MaintenanceLog:
+        return key, {'maintenance_cost': cost, 'maintenance_count': 1}
+    return key, {'parts_cost': cost}
+
+
+# model: columns giving (vehicle_id, date, cost) for a row
+SOURCES = {
+    FuelLog: ('vehicle_id', 'date', 'total_cost'),
+    MaintenanceLog: ('vehicle_id', 'date', 'total_cost'),
+    PartReplacement: ('maintenance_log__vehicle_id', 'maintenance_log__date', 'cost'),
+}
+
+
+def _stored(model, pk):
+    row = model.objects.filter(pk=pk).values_list(*SOURCES[model]).first()
+    if row is None or row[0] is None:
+        return None
+    return _contribution(model, *row)
+
+
+def _value(instance, name):
+    # As the database stores it, create(date='2024-01-01') leaves a string on the instance
+    return instance._meta.get_field(name).to_python(getattr(instance, name))
+
+
+def _current(instance):
+    model = type(instance)
+    if model is PartReplacement:
+        log = instance.maintenance_log
+        return _contribution(model, log.vehicle_id, _value(log, 'date'), _value(instance, 'cost'))
+    return _contribution(model, instance.vehicle_id, _value(instance, 'date'), _value(instance, 'total_cost'))
+
+
+def apply(vehicle_id, month, deltas, sign=1):
+    deltas = {name: value * sign for name, value in deltas.items() if value}
+    if not deltas:
+        return
+    bucket = VehicleMonthlyCost.objects.filter(vehicle_id=vehicle_id, month=month)
+    updates = {name: F(name) + value for name, value in deltas.items()}
+    if bucket.update(**updates) or sign < 0:
+        # Nothing to take away from a missing bucket, it went with its vehicle
+        return
+    owner_id = Vehicle.objects.filter(pk=vehicle_id).values_list('owner_id', flat=True).first()
+    if owner_id is None:
+        return
+    try:
+        with transaction.atomic():
+            VehicleMonthlyCost.objects.create(vehicle_id=vehicle_id, owner_id=owner_id, month=month, **deltas)
+    except IntegrityError:
+        # Created by a concurrent write in the meantime
+        bucket.update(**updates)
+
+
+def _move(before, after):
+    if before is not None and after is not None and before[0] == after[0]:
+        deltas = {name: after[1].get(name, 0) - before[1].get(name, 0) for name in after[1]}
+        # The row count has not changed, only the amount
+        deltas = {name: value for name, value in deltas.items() if not name.endswith('_count')}
+        apply(*after[0], deltas)
+        return
+    if before is not None:
+        apply(*before[0], before[1], sign=-1)
+    if after is not None:
+        apply(*after[0], after[1])
+
+
+def buckets(vehicle_ids):
+    # {(vehicle_id, month): {field: total}} computed from the raw rows
+    totals = {}
+
+    def add(rows, fields):
+        for row in rows:
+            bucket = totals.setdefault((row['vehicle'], month_of(row['month'])), dict.fromkeys(COST_FIELDS, 0))
+            for name in fields:
+                bucket[name] += row[name] or 0
+
+    add(FuelLog.objects.filter(vehicle_id__in=vehicle_ids)
+        .annotate(month=TruncMonth('date')).values('vehicle', 'month').order_by()
+        .annotate(fuel_cost=Sum('total_cost'), fuel_log_count=Count('pk')),
+        ('fuel_cost', 'fuel_log_count'))
+    add(MaintenanceLog.objects.filter(vehicle_id__in=vehicle_ids)
+        .annotate(month=TruncMonth('date')).values('vehicle', 'month').order_by()
+        .annotate(maintenance_cost=Sum('total_cost'), maintenance_count=Count('pk')),
+        ('maintenance_cost', 'maintenance_count'))
+    add(PartReplacement.objects.filter(maintenance_log__vehicle_id__in=vehicle_ids)
+        .annotate(vehicle=F('maintenance_log__vehicle'), month=TruncMonth('maintenance_log__date'))
+        .values('vehicle', 'month').order_by()
+        .annotate(parts_cost=Sum('cost')),
+        ('parts_cost',))
+    return totals
+
+
+def parse_month(value):
+    # 'YYYY-MM' to the first of that month, None when malformed
+    try:
+        return datetime.strptime(value, '%Y-%m').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def default_range():
+    today = timezone.localdate()
+    return date(today.year - 1, today.month, 1), today.replace(day=1)
+
+
+def _amounts(row):
+    # Decimal sums as floats, rounded to cents, plus their total
+    amounts = {name: row.get(name) or 0 for name in COST_FIELDS}
+    for name in ('fuel_cost', 'maintenance_cost', 'parts_cost'):
+        amounts[name] = round(float(amounts[name]), 2)
+    amounts['total_cost'] = round(amounts['fuel_cost'] + amounts['maintenance_cost'] + amounts['parts_cost'], 2)
+    return amounts
+
+
+def stale_buckets(vehicle_ids):
+    # [(vehicle_id, month, kept, expected)] for the buckets that disagree
+    # with buckets() or have the wrong owner, compared to the cent. A bucket
+    # of zeros is the same as no bucket, deletes leave those behind.
+    owners = dict(Vehicle.objects.filter(pk__in=vehicle_ids).values_list('pk', 'owner_id'))
+    expected = {key: {'owner': owners[key[0]], **_amounts(totals)} for key, totals in buckets(vehicle_ids).items()}
+    kept = {
+        (row.pop('vehicle'), row.pop('month')): {'owner': row.pop('owner'), **_amounts(row)}
+        for row in VehicleMonthlyCost.objects.filter(vehicle_id__in=vehicle_ids).values(
+            'vehicle', 'owner', 'month', *COST_FIELDS)
+    }
+    empty = _amounts({})
+    stale = []
+    for key in sorted(expected.keys() | kept.keys()):
+        have, want = kept.get(key), expected.get(key)
+        if want is None and have is not None and have == {**empty, 'owner': have['owner']}:
+            continue
+        if have != want:
+            stale.append((*key, have, want))
+    return stale
+
+
+def report(owner, start, end, vehicle_id=None):
+    # Bucket sums for the months start..end inclusive, two grouped queries
+    # whatever the range
+    rows = VehicleMonthlyCost.objects.filter(owner=owner, month__gte=month_of(start), month__lte=month_of(end))
+    if vehicle_id is not None:
+        rows = rows.filter(vehicle_id=vehicle_id)
+    sums = {name: Sum(name) for name in COST_FIELDS}
+
+    months = [
+        {'month': row['month'].strftime('%Y-%m'), **_amounts(row)}
+        for row in rows.values('month').order_by('month').annotate(**sums)
+    ]
+    vehicles = [
+        {'vehicle': row['vehicle'], 'vehicle_number': row['vehicle__vehicle_number'], **_amounts(row)}
+        for row in rows.values('vehicle', 'vehicle__vehicle_number').order_by('vehicle').annotate(**sums)
+    ]
+    totals = {name: sum(row[name] for row in months) for name in COST_FIELDS}
+    return {
+        'from': month_of(start).strftime('%Y-%m'),
+        'to': month_of(end).strftime('%Y-%m'),
+        'totals': _amounts(totals),
+        'months': months,
+        'vehicles': vehicles,
+    }
+
+
+@receiver(pre_save, sender=FuelLog)
+@receiver(pre_save, sender=MaintenanceLog)
+@receiver(pre_save, sender=PartReplacement)
+def remember_cost(sender, instance, **kwargs):
+    instance._cost_before = _stored(sender, instance.pk) if instance.pk is not None else None
+
+
+@receiver(post_save, sender=FuelLog)
+@receiver(post_save, sender=MaintenanceLog)
+@receiver(post_save, sender=PartReplacement)
+def record_cost(sender, instance, **kwargs):
+    before = getattr(instance, '_cost_before', None)
+    after = _current(instance)
+    _move(before, after)
+    if sender is MaintenanceLog and before is not None and before[0] != after[0]:
+        # The log's parts follow it to its new vehicle or month
+        parts = instance.replaced_parts.aggregate(total=Sum('cost'))['total']
+        if parts:
+            apply(*before[0], {'parts_cost': parts}, sign=-1)
+            apply(*after[0], {'parts_cost': parts})
+
+
+@receiver(pre_delete, sender=FuelLog)
+@receiver(pre_delete, sender=MaintenanceLog)
+@receiver(pre_delete, sender=PartReplacement)
+def remember_deleted_cost(sender, instance, origin=None, **kwargs):
+    if deleted_with_vehicle(origin):
+        # The vehicle's buckets go with it, nothing to take out of them
+        instance._cost_before = None
+        return
+    # Read while a part's maintenance log still exists
+    instance._cost_before = _stored(sender, instance.pk)
+
+
+@receiver(post_delete, sender=FuelLog)
+@receiver(post_delete, sender=MaintenanceLog)
+@receiver(post_delete, sender=PartReplacement)
+def remove_cost(sender, instance, **kwargs):
+    _move(getattr(instance, '_cost_before', None), None)
+
+
+@receiver(post_save, sender=Vehicle)
+def follow_vehicle_owner(sender, instance, created, update_fields=None, **kwargs):
+    # Saves that leave the owner alone, odometer updates and the like, skip the update
+    if created or (update_fields is not None and 'owner' not in update_fields):
+        return
+    VehicleMonthlyCost.objects.filter(vehicle=instance).exclude(owner_id=instance.owner_id).update(
+        owner_id=instance.owner_id)
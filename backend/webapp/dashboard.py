@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+
+from .fast_serializers import (
+    fuel_log_fast, inspection_fast, insurance_fast, license_fast,
+    reminder_fast, trip_list_fast
+)
+from .models import Driver, FuelLog, Inspection, Insurance, License, MaintenanceLog, Reminder, Trip, Vehicle
+from .serializers import VehicleDetailSerializer
+
+# Everything the vehicle screen shows, in one response.
+#
+# The query plan is fixed: one query for the vehicle row (with its owner and
+# counts when the vehicle section is wanted), one for its assigned driver and
+# one per list section. Nothing depends on how many rows a section holds, so
+# query_budget() is a hard upper bound, checked by bench_dashboard.
+
+
+def _count(queryset, field):
+    rows = queryset.order_by().values(field).annotate(n=Count('pk')).values('n')[:1]
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def _insurances(vehicle_id):
+    return Insurance.objects.filter(vehicle_id=vehicle_id).order_by('-expiry_date', '-id')
+
+
+def _inspections(vehicle_id):
+    return Inspection.objects.filter(vehicle_id=vehicle_id).order_by('-expiry_date', '-id')
+
+
+def _licenses(vehicle_id):
+    return License.objects.filter(vehicle_id=vehicle_id).order_by('-expiry_date', '-id')
+
+
+def _trips(vehicle_id):
+    return Trip.objects.filter(vehicle_id=vehicle_id).order_by('-id')[:settings.VEHICLE_DASHBOARD_TRIPS]
+
+
+def _fuel_logs(vehicle_id):
+    return (FuelLog.objects.filter(vehicle_id=vehicle_id)
+            .order_by('-date', '-id')[:settings.VEHICLE_DASHBOARD_FUEL_LOGS])
+
+
+def _reminders(vehicle_id):
+    return Reminder.objects.filter(vehicle_id=vehicle_id, acknowledged=False)
+
+
+# name: (queryset for a vehicle id, compiled serializer), one query each
+LIST_SECTIONS = {
+    'insurances': (_insurances, insurance_fast),
+    'inspections': (_inspections, inspection_fast),
+    'licenses': (_licenses, license_fast),
+    'trips': (_trips, trip_list_fast),
+    'fuel_logs': (_fuel_logs, fuel_log_fast),
+    'reminders': (_reminders, reminder_fast),
+}
+
+SECTIONS = ('vehicle',) + tuple(LIST_SECTIONS)
+
+
+def parse_sections(value):
+    # ?sections=vehicle,trips, everything when absent. Raises ValueError on unknown names.
+    if not value:
+        return SECTIONS
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in SECTIONS]
+    if unknown:
+        raise ValueError(f'Unknown sections: {", ".join(unknown)}')
+    return tuple(name for name in SECTIONS if name in requested)
+
+
+def query_budget(sections=SECTIONS):
+    # The vehicle row is read either way, it is also the ownership check
+    return 1 + len(sections)
+
+
+def owned_vehicle(vehicle_id, owner, sections=SECTIONS):
+    vehicles = Vehicle.objects.filter(pk=vehicle_id, owner=owner)
+    if 'vehicle' not in sections:
+        return vehicles.only('pk').first()
+    return (
+        vehicles.select_related('owner__user')
+        .annotate(
+            maintenance_logs_total=_count(MaintenanceLog.objects.filter(vehicle=OuterRef('pk')), 'vehicle'),
+            fuel_logs_total=_count(FuelLog.objects.filter(vehicle=OuterRef('pk')), 'vehicle'),
+            owner_vehicles_total=_count(Vehicle.objects.filter(owner=OuterRef('owner')), 'owner'),
+        )
+        .prefetch_related(Prefetch('assigned_driver', queryset=Driver.objects.select_related('user')))
+        .first()
+    )
+
+
+def build(vehicle, sections=SECTIONS, request=None):
+    data = {}
+    if 'vehicle' in sections:
+        vehicle.owner.vehicles_total = vehicle.owner_vehicles_total
+        data['vehicle'] = VehicleDetailSerializer(vehicle, context={'request': request}).data
+    for name in sections:
+        if name in LIST_SECTIONS:
+            queryset, serializer = LIST_SECTIONS[name]
+            data[name] = serializer.serialize(queryset(vehicle.pk), request)
+    return data
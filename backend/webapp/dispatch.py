@@ -0,0 +1,146 @@
+import heapq
+from math import cos, radians
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .analytics import haversine_km
+from .models import Dispatch, Mechanic
+
+# Breakdown dispatch.
+#
+# The nearest available mechanics with the right speciality are found with
+# a bounding box query widened ring by ring until there are enough, ranked
+# by great circle distance. One is then claimed by a conditional UPDATE that
+# only succeeds while is_available is still true, so of two concurrent
+# requests for the same mechanic exactly one wins and the other moves on
+# to its next candidate. The unique constraint on assigned dispatches backs
+# this up against mechanics marking themselves available mid-job.
+
+KM_PER_DEGREE = 111.32
+
+
+def _box(latitude, longitude, radius_km):
+    dlat = radius_km / KM_PER_DEGREE
+    dlng = radius_km / (KM_PER_DEGREE * max(cos(radians(latitude)), 0.01))
+    return {
+        'latitude__gte': latitude - dlat, 'latitude__lte': latitude + dlat,
+        'longitude__gte': longitude - dlng, 'longitude__lte': longitude + dlng,
+    }
+
+
+def _available(speciality=''):
+    mechanics = Mechanic.objects.filter(is_available=True, latitude__isnull=False, longitude__isnull=False)
+    if speciality:
+        mechanics = mechanics.filter(speciality__iexact=speciality)
+    return mechanics
+
+
+def candidates(latitude, longitude, speciality='', limit=None, exclude=()):
+    # [(distance_km, mechanic), ...] nearest first, at most limit of them
+    limit = limit or settings.DISPATCH_CANDIDATES
+    radii = settings.DISPATCH_SEARCH_RADII_KM
+    mechanics = _available(speciality).exclude(pk__in=exclude)
+    ranked = []
+    for radius in radii:
+        found = mechanics.filter(**_box(latitude, longitude, radius)).only(
+            'id', 'username', 'speciality', 'location', 'latitude', 'longitude')
+        ranked = sorted(
+            ((round(haversine_km(latitude, longitude, mechanic.latitude, mechanic.longitude), 2), mechanic)
+             for mechanic in found),
+            key=lambda pair: (pair[0], pair[1].pk),
+        )
+        # Corners of the box lie outside the ring
+        ranked = [pair for pair in ranked if pair[0] <= radius]
+        if len(ranked) >= limit:
+            break
+    return ranked[:limit]
+
+
+def claim(mechanic_id, distance_km, **fields):
+    # The Dispatch, or None when someone else got the mechanic first
+    try:
+        with transaction.atomic():
+            claimed = Mechanic.objects.filter(pk=mechanic_id, is_available=True).update(
+                is_available=False, updated_at=timezone.now())
+            if not claimed:
+                return None
+            return Dispatch.objects.create(mechanic_id=mechanic_id, distance_km=distance_km, **fields)
+    except IntegrityError:
+        # Still on another job, the rollback leaves is_available as it was
+        return None
+
+
+def dispatch(vehicle, latitude, longitude, speciality='', description=''):
+    # Claims the nearest mechanic that can be claimed, None when none is left in range
+    fields = {'vehicle': vehicle, 'latitude': latitude, 'longitude': longitude,
+              'speciality': speciality, 'description': description}
+    tried = set()
+    for _round in range(settings.DISPATCH_MAX_ROUNDS):
+        ranked = candidates(latitude, longitude, speciality, exclude=tried)
+        if not ranked:
+            return None
+        for distance, mechanic in ranked:
+            tried.add(mechanic.pk)
+            assigned = claim(mechanic.pk, distance, **fields)
+            if assigned is not None:
+                return assigned
+    return None
+
+
+def dispatch_many(incidents):
+    # incidents: dicts of dispatch() keyword arguments. One query loads every
+    # available mechanic around the burst, pairs are assigned greedily,
+    # nearest first, and each incident whose pick was taken meanwhile falls
+    # back to dispatch(). Returns a Dispatch or None per incident, in order.
+    if not incidents:
+        return []
+    radius = settings.DISPATCH_SEARCH_RADII_KM[-1]
+    boxes = [_box(incident['latitude'], incident['longitude'], radius) for incident in incidents]
+    pool = list(_available().filter(
+        latitude__gte=min(box['latitude__gte'] for box in boxes),
+        latitude__lte=max(box['latitude__lte'] for box in boxes),
+        longitude__gte=min(box['longitude__gte'] for box in boxes),
+        longitude__lte=max(box['longitude__lte'] for box in boxes),
+    ).values_list('pk', 'speciality', 'latitude', 'longitude'))
+
+    pairs = []
+    for index, incident in enumerate(incidents):
+        wanted = incident.get('speciality', '').lower()
+        distances = (
+            (haversine_km(incident['latitude'], incident['longitude'], lat, lng), pk)
+            for pk, speciality, lat, lng in pool if not wanted or speciality.lower() == wanted
+        )
+        nearest = heapq.nsmallest(settings.DISPATCH_CANDIDATES, (pair for pair in distances if pair[0] <= radius))
+        pairs.extend((round(distance, 2), pk, index) for distance, pk in nearest)
+
+    picks = {}
+    taken = set()
+    for distance, pk, index in sorted(pairs):
+        if index not in picks and pk not in taken:
+            picks[index] = (pk, distance)
+            taken.add(pk)
+
+    results = []
+    for index, incident in enumerate(incidents):
+        assigned = None
+        if index in picks:
+            pk, distance = picks[index]
+            assigned = claim(pk, distance, **{'speciality': '', 'description': '', **incident})
+        if assigned is None:
+            assigned = dispatch(**incident)
+        results.append(assigned)
+    return results
+
+
+def release(dispatch_id, status, **filters):
+    # Closes an assigned dispatch and frees its mechanic, False when it was not open
+    with transaction.atomic():
+        closing = Dispatch.objects.select_for_update().filter(pk=dispatch_id, status='assigned', **filters).first()
+        if closing is None:
+            return False
+        closing.status = status
+        closing.save(update_fields=['status', 'updated_at'])
+        Mechanic.objects.filter(pk=closing.mechanic_id).update(is_available=True, updated_at=timezone.now())
+    return True
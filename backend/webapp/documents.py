@@ -0,0 +1,137 @@
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Inspection, Insurance, License, StoredDocument
+
+DOCUMENT_EXTENSIONS = ['.pdf', '.jpg', '.jpeg', '.png', '.doc', '.docx']
+MAX_DOCUMENT_SIZE = 10 * 1024 * 1024
+
+DOCUMENT_MODELS = {
+    'insurance': Insurance,
+    'inspection': Inspection,
+    'license': License,
+}
+
+
+def document_extension(name):
+    return os.path.splitext(name or '')[1].lower()
+
+
+class DocumentUploadHandler(TemporaryFileUploadHandler):
+    # Streams each uploaded file straight to a temporary file in chunks and
+    # hashes it on the way through, so memory per upload stays constant.
+    # Files with a bad extension or over the size limit stop being written,
+    # but the byte count is kept so DocumentUploadSerializer still reports them.
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.accepting = document_extension(self.file_name) in DOCUMENT_EXTENSIONS
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.accepting and start + len(raw_data) > MAX_DOCUMENT_SIZE:
+            self.accepting = False
+            self.file.seek(0)
+            self.file.truncate()
+
+        if self.accepting:
+            self.hasher.update(raw_data)
+            self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.content_hash = self.hasher.hexdigest() if self.accepting else None
+        return uploaded
+
+
+def content_hash(uploaded):
+    digest = getattr(uploaded, 'content_hash', None)
+    if digest:
+        return digest
+
+    # Uploaded without DocumentUploadHandler, hash it chunk by chunk
+    hasher = hashlib.sha256()
+    for chunk in uploaded.chunks():
+        hasher.update(chunk)
+    uploaded.seek(0)
+    return hasher.hexdigest()
+
+
+def _add_reference(digest):
+    # Takes a reference on already stored content. The row is locked so a
+    # concurrent release_document cannot drop it to zero and delete it in
+    # between, a row released first is a miss.
+    with transaction.atomic():
+        stored = StoredDocument.objects.select_for_update().filter(sha256=digest).first()
+        if stored is None:
+            return None
+        if not StoredDocument.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') + 1):
+            return None
+    stored.ref_count += 1
+    return stored
+
+
+def store_document(uploaded):
+    digest = content_hash(uploaded)
+
+    stored = _add_reference(digest)
+    if stored is not None:
+        return stored, False
+
+    name = f'{digest[:2]}/{digest}{document_extension(uploaded.name)}'
+    # Created holding its first reference, never visible with a count of zero
+    stored = StoredDocument(sha256=digest, size=uploaded.size, ref_count=1)
+    # Moves the temporary file into place rather than copying it
+    stored.file.save(name, uploaded, save=False)
+    try:
+        with transaction.atomic():
+            stored.save()
+    except IntegrityError:
+        # Someone stored the same content first, use theirs
+        stored.file.delete(save=False)
+        stored = _add_reference(digest)
+        if stored is None:
+            raise
+        return stored, False
+    return stored, True
+
+
+def release_document(name):
+    if not name:
+        return
+
+    with transaction.atomic():
+        StoredDocument.objects.filter(file=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        orphan = StoredDocument.objects.select_for_update().filter(file=name, ref_count__lte=0).first()
+        if orphan:
+            orphan.delete()
+            transaction.on_commit(lambda: default_storage.delete(name))
+
+
+def attach_document(instance, uploaded):
+    old_name = instance.document.name
+    stored, created = store_document(uploaded)
+
+    instance.document.name = stored.file.name
+    instance.save(update_fields=['document', 'updated_at'])
+
+    if old_name != stored.file.name:
+        release_document(old_name)
+    else:
+        # Same content uploaded again for the same record
+        release_document(stored.file.name)
+    return stored, created
+
+
+@receiver(post_delete, sender=Insurance)
+@receiver(post_delete, sender=Inspection)
+@receiver(post_delete, sender=License)
+def release_deleted_document(sender, instance, **kwargs):
+    release_document(instance.document.name)
@@ -0,0 +1,181 @@
+# fast_serializers.py
+#
+# Read-only list serialization without per-row field objects. A compiled
+# serializer reads the field layout of an existing ModelSerializer once,
+# fetches rows as .values_list() tuples and maps each column with the same
+# to_representation the DRF field would use, so the rendered JSON is
+# byte-identical to the regular serializer output.
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import thumbnails
+from .serializers import (
+    ComplianceItemSerializer, FuelLogSerializer, InspectionSerializer, InsuranceSerializer,
+    LicenseSerializer, MaintenanceLogListSerializer, ReminderSerializer,
+    TripListSerializer, VehicleListSerializer
+)
+
+
+# Computed field mappers, called as mapper(context, *column_values)
+def duration(context, started_at, ended_at):
+    if started_at and ended_at:
+        return str(ended_at - started_at)
+    return None
+
+
+def is_expired(context, expiry_date):
+    return expiry_date < context['today']
+
+
+def days_until_expiry(context, expiry_date):
+    today = context['today']
+    if expiry_date > today:
+        return (expiry_date - today).days
+    return 0
+
+
+def is_overdue(context, reminder_date):
+    return reminder_date < context['now']
+
+
+def assigned_driver(context, driver_id, username, phone_number):
+    # Joined through the reverse foreign key, a vehicle has at most one driver
+    if driver_id is None:
+        return None
+    return {'id': driver_id, 'username': username, 'phone_number': phone_number}
+
+
+def image_variants(context, pk, image_name):
+    return thumbnails.variant_urls_for(pk, image_name, context['request'])
+
+
+class CompiledSerializer:
+
+    def __init__(self, serializer_class, computed=None):
+        self.serializer_class = serializer_class
+        self.computed = computed or {}
+        self._compiled = None
+
+    def _column(self, lookups, lookup):
+        if lookup not in lookups:
+            lookups[lookup] = len(lookups)
+        return lookups[lookup]
+
+    def _field_mapper(self, field, index):
+        model = self.serializer_class.Meta.model
+
+        if isinstance(field, serializers.RelatedField):
+            # values_list() already yields the primary key
+            return lambda row, context: row[index]
+
+        if isinstance(field, serializers.FileField):
+            storage = model._meta.get_field(field.source).storage
+
+            def file_url(row, context):
+                name = row[index]
+                if not name:
+                    return None
+                url = storage.url(name)
+                request = context.get('request')
+                if request is not None:
+                    return request.build_absolute_uri(url)
+                return url
+            return file_url
+
+        to_representation = field.to_representation
+
+        def plain(row, context):
+            value = row[index]
+            if value is None:
+                return None
+            return to_representation(value)
+        return plain
+
+    def compile(self):
+        if self._compiled is not None:
+            return self._compiled
+
+        lookups = {}
+        mappers = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+
+            if name in self.computed:
+                columns, func = self.computed[name]
+                indexes = [self._column(lookups, column) for column in columns]
+                mappers.append((name, lambda row, context, func=func, indexes=indexes:
+                                func(context, *[row[i] for i in indexes])))
+                continue
+
+            if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+                raise ImproperlyConfigured(
+                    f'{self.serializer_class.__name__}.{name} needs a computed mapper'
+                )
+
+            index = self._column(lookups, field.source.replace('.', '__'))
+            mappers.append((name, self._field_mapper(field, index)))
+
+        self._compiled = (list(lookups), mappers)
+        return self._compiled
+
+    def _context(self, request):
+        now = timezone.now()
+        return {'now': now, 'today': now.date(), 'request': request}
+
+    def serialize(self, queryset, request=None):
+        lookups, mappers = self.compile()
+        context = self._context(request)
+        return [
+            {name: mapper(row, context) for name, mapper in mappers}
+            for row in queryset.values_list(*lookups)
+        ]
+
+    def serialize_with(self, queryset, extra, request=None):
+        # Same as serialize(), paired with the values of the extra lookups
+        # (e.g. a pagination cursor) fetched in the same query
+        lookups, mappers = self.compile()
+        context = self._context(request)
+        width = len(lookups)
+        return [
+            ({name: mapper(row, context) for name, mapper in mappers}, row[width:])
+            for row in queryset.values_list(*lookups, *extra)
+        ]
+
+
+trip_list_fast = CompiledSerializer(TripListSerializer, computed={
+    'duration': (('started_at', 'ended_at'), duration),
+})
+
+fuel_log_fast = CompiledSerializer(FuelLogSerializer)
+
+vehicle_list_fast = CompiledSerializer(VehicleListSerializer, computed={
+    'assigned_driver': (('assigned_driver__id', 'assigned_driver__username', 'assigned_driver__phone_number'),
+                        assigned_driver),
+    'image_variants': (('id', 'image'), image_variants),
+})
+
+maintenance_log_fast = CompiledSerializer(MaintenanceLogListSerializer)
+
+reminder_fast = CompiledSerializer(ReminderSerializer, computed={
+    'is_overdue': (('reminder_date',), is_overdue),
+})
+
+insurance_fast = CompiledSerializer(InsuranceSerializer, computed={
+    'is_expired': (('expiry_date',), is_expired),
+    'days_until_expiry': (('expiry_date',), days_until_expiry),
+})
+
+inspection_fast = CompiledSerializer(InspectionSerializer, computed={
+    'is_expired': (('expiry_date',), is_expired),
+})
+
+license_fast = CompiledSerializer(LicenseSerializer, computed={
+    'is_expired': (('expiry_date',), is_expired),
+})
+
+compliance_item_fast = CompiledSerializer(ComplianceItemSerializer, computed={
+    'is_expired': (('expiry_date',), is_expired),
+    'days_until_expiry': (('expiry_date',), days_until_expiry),
+})
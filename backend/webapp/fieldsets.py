@@ -0,0 +1,170 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+# Sparse fieldsets and expansion for detail serializers.
+#
+#   ?fields=id,status,driver_details.username   keep only these, dotted paths reach into nested objects
+#   ?expand=vehicle_details                      embed only these nested objects, the rest are dropped
+#
+# Without either parameter the output is unchanged. Pruning happens in
+# get_fields(), before anything is read, and optimize() turns the pruned
+# tree into select_related(), prefetch_related() and only() so the query
+# loads just the columns and joins the response needs.
+
+
+def _tree(value):
+    # 'a,b.c,b.d' -> {'a': {}, 'b': {'c': {}, 'd': {}}}
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for part in path.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+class Fieldset:
+
+    def __init__(self, fields=None, expand=None):
+        # None means everything at this level, {} under a name means the whole field
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request):
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        if fields is None and expand is None:
+            return None
+        return cls(_tree(fields) if fields is not None else None,
+                   _tree(expand) if expand is not None else None)
+
+    def keeps(self, name, nested):
+        if self.fields is not None and name not in self.fields:
+            return False
+        if nested and self.expand is not None and name not in self.expand:
+            # Asking for a nested field by path expands it too
+            return bool(self.fields and self.fields.get(name))
+        return True
+
+    def child(self, name):
+        fields = self.fields.get(name) or None if self.fields is not None else None
+        expand = self.expand.get(name, {}) if self.expand is not None else None
+        if fields is None and expand is None:
+            return None
+        return Fieldset(fields, expand)
+
+
+def _nested(field):
+    if isinstance(field, serializers.ListSerializer):
+        return field.child if isinstance(field.child, serializers.BaseSerializer) else None
+    if isinstance(field, serializers.BaseSerializer):
+        return field
+    return None
+
+
+class SparseFieldsMixin:
+    # Serializer fields are pruned by the fieldset= keyword. Method fields,
+    # and lists read through a model method, name the model paths they read
+    # in method_field_sources so optimize() can load them; an unlisted method
+    # field loads every column of its model.
+
+    method_field_sources = {}
+
+    def __init__(self, *args, fieldset=None, **kwargs):
+        self.fieldset = fieldset
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.fieldset is None:
+            return fields
+
+        pruned = {}
+        for name, field in fields.items():
+            nested = _nested(field)
+            if not self.fieldset.keeps(name, nested is not None):
+                continue
+            if isinstance(nested, SparseFieldsMixin):
+                nested.fieldset = self.fieldset.child(name)
+            pruned[name] = field
+        return pruned
+
+
+class _Plan:
+
+    def __init__(self):
+        self.only = set()
+        self.select = set()
+        self.prefetch = set()
+
+    def _all_columns(self, model, prefix):
+        self.only.update(prefix + field.name for field in model._meta.concrete_fields)
+
+    def add_path(self, model, prefix, path):
+        # path is 'column', 'relation__column' or a relation to prefetch
+        parts = path.split('__')
+        for index, part in enumerate(parts):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                # A property or method, it may read anything on this model
+                self._all_columns(model, prefix)
+                return
+            last = index == len(parts) - 1
+            if field.many_to_many or field.one_to_many:
+                self.prefetch.add(prefix + '__'.join(parts[index:]) if last else prefix + part)
+                return
+            if field.is_relation:
+                if field.concrete:
+                    self.only.add(prefix + part)
+                self.select.add(prefix + part)
+                model = field.related_model
+                prefix = f'{prefix}{part}__'
+                if last:
+                    self._all_columns(model, prefix)
+                continue
+            self.only.add(prefix + part)
+
+    def add_serializer(self, serializer, model, prefix=''):
+        self.only.add(prefix + model._meta.pk.name)
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            nested = _nested(field)
+            if isinstance(field, serializers.RelatedField) and len(field.source_attrs) == 1:
+                # Primary key only, no join
+                self.only.add(prefix + field.source)
+            elif isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+                sources = getattr(serializer, 'method_field_sources', {}).get(name)
+                if sources is None:
+                    self.prefetch.add(prefix + field.source.replace('.', '__'))
+                for path in sources or ():
+                    self.add_path(model, prefix, path)
+            elif nested is not None:
+                related = model._meta.get_field(field.source)
+                if related.concrete:
+                    self.only.add(prefix + field.source)
+                self.select.add(prefix + field.source)
+                self.add_serializer(nested, related.related_model, f'{prefix}{field.source}__')
+            elif isinstance(field, serializers.SerializerMethodField):
+                sources = getattr(serializer, 'method_field_sources', {}).get(name)
+                if sources is None:
+                    self._all_columns(model, prefix)
+                for path in sources or ():
+                    self.add_path(model, prefix, path)
+            elif field.source == '*':
+                self._all_columns(model, prefix)
+            else:
+                self.add_path(model, prefix, '__'.join(field.source_attrs))
+
+
+def optimize(queryset, serializer_class, fieldset=None):
+    # Joins and columns for what serializer_class(fieldset=fieldset) will read
+    plan = _Plan()
+    plan.add_serializer(serializer_class(fieldset=fieldset), queryset.model)
+    # Columns of a prefetched relation are loaded by the prefetch itself
+    only = [path for path in plan.only if not any(path.startswith(p + '__') for p in plan.prefetch)]
+    return (queryset.select_related(*sorted(plan.select))
+            .prefetch_related(*sorted(plan.prefetch))
+            .only(*sorted(only)))
@@ -0,0 +1,174 @@
+import threading
+from math import floor
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import Geofence, Reminder, TripLocation
+
+# Geofence enter/exit detection for ingested trip points.
+#
+# Each owner's active fences are loaded into a uniform lat/lng grid. A cell
+# lists the fences that cover it completely and the fences whose boundary
+# crosses it, so most points cost one dict lookup and only points in
+# boundary cells run a point-in-polygon test. Consecutive points in the same
+# cell without boundaries are skipped outright.
+
+EMPTY = frozenset()
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def point_in_polygon(lat, lng, polygon):
+    # Ray casting along the latitude axis
+    inside = False
+    lat_j, lng_j = polygon[-1]
+    for lat_i, lng_i in polygon:
+        if (lat_i > lat) != (lat_j > lat):
+            if lng < (lng_j - lng_i) * (lat - lat_i) / (lat_j - lat_i) + lng_i:
+                inside = not inside
+        lat_j, lng_j = lat_i, lng_i
+    return inside
+
+
+def _edge_cells(start, end, scale):
+    # Every grid cell the segment passes through, one column at a time
+    (lat1, lng1), (lat2, lng2) = start, end
+    if lng1 > lng2:
+        lat1, lng1, lat2, lng2 = lat2, lng2, lat1, lng1
+    for col in range(floor(lng1 * scale), floor(lng2 * scale) + 1):
+        if lng1 == lng2:
+            lo, hi = sorted((lat1, lat2))
+        else:
+            x0 = max(lng1, col / scale)
+            x1 = min(lng2, (col + 1) / scale)
+            slope = (lat2 - lat1) / (lng2 - lng1)
+            lo, hi = sorted((lat1 + (x0 - lng1) * slope, lat1 + (x1 - lng1) * slope))
+        for row in range(floor(lo * scale), floor(hi * scale) + 1):
+            yield row, col
+
+
+class GeofenceIndex:
+
+    def __init__(self, fences, cell_degrees):
+        self.fences = {fence.pk: fence for fence in fences}
+
+        # Coarsen the grid rather than let very large fences exhaust memory
+        area = sum((f.max_lat - f.min_lat) * (f.max_lng - f.min_lng) for f in fences)
+        while area / cell_degrees ** 2 > settings.GEOFENCE_MAX_CELLS:
+            cell_degrees *= 2
+        self.scale = scale = 1.0 / cell_degrees
+
+        inside = {}
+        boundary = {}
+        for fence in fences:
+            polygon = [tuple(vertex) for vertex in fence.polygon]
+            crossed = set()
+            for start, end in zip(polygon, polygon[1:] + polygon[:1]):
+                crossed.update(_edge_cells(start, end, scale))
+            for cell in crossed:
+                boundary.setdefault(cell, []).append((fence.pk, polygon))
+
+            for row in range(floor(fence.min_lat * scale), floor(fence.max_lat * scale) + 1):
+                for col in range(floor(fence.min_lng * scale), floor(fence.max_lng * scale) + 1):
+                    if (row, col) in crossed:
+                        continue
+                    # No edge crosses the cell, so its centre decides for all of it
+                    if point_in_polygon((row + 0.5) / scale, (col + 0.5) / scale, polygon):
+                        inside.setdefault((row, col), set()).add(fence.pk)
+
+        self.grid = {
+            cell: (frozenset(inside.get(cell, ())), tuple(boundary.get(cell, ())))
+            for cell in inside.keys() | boundary.keys()
+        }
+
+    def containing(self, lat, lng):
+        entry = self.grid.get((floor(lat * self.scale), floor(lng * self.scale)))
+        if entry is None:
+            return EMPTY
+        covered, crossing = entry
+        if not crossing:
+            return covered
+        hits = set(covered)
+        for pk, polygon in crossing:
+            if point_in_polygon(lat, lng, polygon):
+                hits.add(pk)
+        return frozenset(hits)
+
+    def transitions(self, points, previous=None):
+        # Yields (index, fence pk, 'enter' or 'exit') for each change of
+        # membership along points, a sequence of (lat, lng). Without a
+        # previous position the first point only sets the starting state.
+        grid = self.grid
+        scale = self.scale
+        state = self.containing(*previous) if previous else None
+        last_cell = None
+        for index, (lat, lng) in enumerate(points):
+            cell = (floor(lat * scale), floor(lng * scale))
+            if cell == last_cell:
+                continue
+            entry = grid.get(cell)
+            if entry is None:
+                current = EMPTY
+                last_cell = cell
+            elif not entry[1]:
+                current = entry[0]
+                last_cell = cell
+            else:
+                current = self.containing(lat, lng)
+                last_cell = None
+
+            if state is not None and current is not state and current != state:
+                for pk in current - state:
+                    yield index, pk, 'enter'
+                for pk in state - current:
+                    yield index, pk, 'exit'
+            state = current
+
+
+def get_index(owner_id):
+    # One aggregate query per call tells whether the cached index is stale,
+    # which also catches edits made by other processes
+    version = tuple(Geofence.objects.filter(owner_id=owner_id, is_active=True).aggregate(
+        Max('updated_at'), Count('id')).values())
+
+    cached = _indexes.get(owner_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    fences = list(Geofence.objects.filter(owner_id=owner_id, is_active=True))
+    index = GeofenceIndex(fences, settings.GEOFENCE_GRID_DEGREES) if fences else None
+    with _lock:
+        _indexes[owner_id] = (version, index)
+    return index
+
+
+def process_locations(trip, locations):
+    # Checks a freshly ingested batch of TripLocation rows against the trip
+    # owner's fences and records a GEOFENCE reminder for each alerting event
+    vehicle = trip.vehicle
+    index = get_index(vehicle.owner_id)
+    if index is None or not locations:
+        return []
+
+    locations = sorted(locations, key=lambda location: location.timestamp)
+    previous = (TripLocation.objects
+                .filter(trip__vehicle_id=vehicle.pk, timestamp__lt=locations[0].timestamp)
+                .order_by('-timestamp')
+                .values_list('latitude', 'longitude')
+                .first())
+
+    points = [(location.latitude, location.longitude) for location in locations]
+    reminders = []
+    for position, pk, event in index.transitions(points, previous):
+        fence = index.fences[pk]
+        if not (fence.alert_on_enter if event == 'enter' else fence.alert_on_exit):
+            continue
+        verb = 'entered' if event == 'enter' else 'left'
+        reminders.append(Reminder(
+            vehicle=vehicle, reminder_type='GEOFENCE', related_id=pk,
+            message=f'{vehicle.vehicle_number} {verb} {fence.name}'[:255],
+            reminder_date=locations[position].timestamp,
+        ))
+    return Reminder.objects.bulk_create(reminders)
@@ -0,0 +1,87 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Server is busy, please try again shortly.'
+    default_code = 'hashing_busy'
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        # Picked up by DRF's exception handler as a Retry-After header
+        self.wait = settings.PASSWORD_HASHING_RETRY_AFTER
+
+
+# PBKDF2 runs inside OpenSSL with the GIL released, so a thread pool gives
+# real parallelism without the pickling cost of a process pool.
+_lock = threading.Lock()
+_pool = None
+_slots = None
+_pool_pid = None
+
+
+def _get_pool():
+    global _pool, _slots, _pool_pid
+
+    with _lock:
+        # Rebuild after a fork, worker threads are not inherited by the child
+        if _pool is None or _pool_pid != os.getpid():
+            workers = settings.PASSWORD_HASHING_WORKERS
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+            _slots = threading.BoundedSemaphore(workers + settings.PASSWORD_HASHING_QUEUE_DEPTH)
+            _pool_pid = os.getpid()
+        return _pool, _slots
+
+
+def run_in_pool(func, *args):
+    pool, slots = _get_pool()
+
+    # Fail fast instead of queueing behind a burst we cannot serve in time
+    if not slots.acquire(blocking=False):
+        raise PasswordHashingBusy()
+
+    try:
+        future = pool.submit(func, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda f: slots.release())
+
+    try:
+        return future.result(timeout=settings.PASSWORD_HASHING_TIMEOUT)
+    except FutureTimeoutError:
+        raise PasswordHashingBusy()
+
+
+def make_password(raw_password):
+    return run_in_pool(hashers.make_password, raw_password)
+
+
+def set_password(user, raw_password):
+    user.password = make_password(raw_password)
+    user.save(update_fields=['password'])
+
+
+def check_password(user, raw_password):
+    if user is None or not user.has_usable_password():
+        return False
+
+    is_correct, must_update = run_in_pool(hashers.verify_password, raw_password, user.password)
+
+    # Transparent rehash when the preferred hasher or its cost has changed
+    if is_correct and must_update:
+        try:
+            user.password = make_password(raw_password)
+        except PasswordHashingBusy:
+            # The login itself succeeded, upgrade on a later one
+            return True
+        user.save(update_fields=['password'])
+
+    return is_correct
@@ -0,0 +1,25 @@
+import io
+import os
+
+from PIL import Image, ImageOps
+
+# Photo decoding for work done in other processes, see onboarding.py.
+#
+# This module imports neither Django nor webapp's models, so a worker
+# started with spawn or forkserver can load it without settings or an app
+# registry. Keep it that way.
+
+
+def normalize_image(path, max_size, quality):
+    # Returns (JPEG bytes, None) or (None, reason)
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(max_size, Image.Resampling.LANCZOS)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            out = io.BytesIO()
+            image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return out.getvalue(), None
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return None, f'image {os.path.basename(path)}: {e}'
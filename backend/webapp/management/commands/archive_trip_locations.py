@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from webapp.archive import pack_locations
+from webapp.models import Trip, TripLocation, TripLocationArchive
+
+
+class Command(BaseCommand):
+    help = 'Move locations of long completed trips into compressed TripLocationArchive rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=180,
+                            help='Archive trips that ended at least this many days ago')
+        parser.add_argument('--batch-size', type=int, default=100, help='Trips selected per batch')
+        parser.add_argument('--delete-chunk', type=int, default=2000,
+                            help='Live rows deleted per statement')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many trips')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between trips to let other writers through')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        delete_chunk = options['delete_chunk']
+        limit = options['limit']
+
+        # Progress lives in Trip.locations_archived, so an interrupted run
+        # simply picks up where it stopped
+        candidates = (Trip.objects.filter(status='completed', ended_at__lt=cutoff, locations_archived=False)
+                      .order_by('pk'))
+
+        archived = points = stored = 0
+        last_pk = 0
+        while limit is None or archived < limit:
+            batch = list(candidates.filter(pk__gt=last_pk).values_list('pk', 'ended_at')[:options['batch_size']])
+            if not batch:
+                break
+            for trip_id, ended_at in batch:
+                if limit is not None and archived >= limit:
+                    break
+                # One trip per transaction keeps locks short while the app is live
+                with transaction.atomic():
+                    rows = list(TripLocation.objects.filter(trip_id=trip_id)
+                                .order_by('timestamp', 'id')
+                                .values_list('id', 'latitude', 'longitude', 'timestamp'))
+                    # A trip without points is only marked, an empty blob would be all header
+                    data = b''
+                    if rows:
+                        data = pack_locations(rows)
+                        TripLocationArchive.objects.update_or_create(trip_id=trip_id, defaults={
+                            'month': ended_at.date().replace(day=1),
+                            'point_count': len(rows),
+                            'data': data,
+                        })
+                        ids = [row[0] for row in rows]
+                        for start in range(0, len(ids), delete_chunk):
+                            TripLocation.objects.filter(pk__in=ids[start:start + delete_chunk]).delete()
+                    Trip.objects.filter(pk=trip_id).update(locations_archived=True)
+                archived += 1
+                points += len(rows)
+                stored += len(data)
+                if options['pause']:
+                    time.sleep(options['pause'])
+            last_pk = batch[-1][0]
+
+        ratio = f', {points * 32 / stored:.1f}x smaller than raw columns' if stored else ''
+        self.stdout.write(f'Archived {archived} trips, {points} locations into {stored} bytes{ratio}')
@@ -0,0 +1,54 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp import analytics
+from webapp.bench import synthetic_trip
+
+
+def streamed(points, batch_size):
+    stats = analytics.TripStats()
+    for start in range(0, len(points), batch_size):
+        stats.add(points[start:start + batch_size])
+    return stats
+
+
+def assert_close(label, expected, actual):
+    for name in analytics.TripStats.FIELDS:
+        a, b = getattr(expected, name), getattr(actual, name)
+        if isinstance(a, float) and b is not None:
+            if not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9):
+                raise CommandError(f'{label}: {name} is {b}, expected {a}')
+        elif a != b:
+            raise CommandError(f'{label}: {name} is {b}, expected {a}')
+
+
+class Command(BaseCommand):
+    help = 'Check streaming and batch trip analytics agree and measure their throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=200_000)
+        parser.add_argument('--batch-size', type=int, default=50)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        points = synthetic_trip(rng, options['points'])
+
+        started = time.perf_counter()
+        stream = streamed(points, options['batch_size'])
+        stream_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        batch = analytics.recompute(points)
+        batch_time = time.perf_counter() - started
+        assert_close('recompute', stream, batch)
+
+        stream.finalize()
+        self.stdout.write(
+            f'{len(points)} points: {stream.tracked_distance_km:.1f} km, {stream.stop_count} stops, '
+            f'{stream.harsh_acceleration_count} harsh accelerations, {stream.harsh_braking_count} harsh brakings')
+        self.stdout.write(f'streaming ({options["batch_size"]}-point batches): {len(points) / stream_time:,.0f} points/s')
+        self.stdout.write(f'recompute ({"numpy" if analytics.numpy else "streaming fallback"}): '
+                          f'{len(points) / batch_time:,.0f} points/s')
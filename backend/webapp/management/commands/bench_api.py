@@ -0,0 +1,224 @@
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from webapp.bench import percentile, seed_fleet, temporary_database
+from webapp.models import CarOwnerToken, DriverToken, MechanicToken
+
+PASSWORD = 'bench-password'
+
+
+def bearer(token):
+    return {'HTTP_AUTHORIZATION': f'Bearer {token.key}'}
+
+
+def build_scenarios(fleet):
+    drivers, owners, mechanics, vehicles = fleet['drivers'], fleet['owners'], fleet['mechanics'], fleet['vehicles']
+    driver_tokens = [DriverToken.objects.create(driver=d) for d in drivers]
+    owner_tokens = [CarOwnerToken.objects.create(car_owner=o) for o in owners]
+    mechanic_tokens = [MechanicToken.objects.create(mechanic=m) for m in mechanics]
+    registrations = itertools.count()
+
+    def pick(items, i):
+        return items[i % len(items)]
+
+    def driver_register(i):
+        n = next(registrations)
+        return 'POST', '/driver/register/', {
+            'user': {'username': f'newdriver{n}', 'email': f'newdriver{n}@fleet.test'},
+            'password': PASSWORD, 'username': f'newdriver{n}', 'email': f'newdriver{n}@fleet.test',
+            'phone_number': f'+4000{n:06d}', 'licence_number': f'NDL{n:08d}',
+        }, {}
+
+    def driver_logout(i):
+        # Token creation is setup, only the logout itself is timed
+        return 'POST', '/driver/logout/', None, bearer(DriverToken.objects.create(driver=pick(drivers, i)))
+
+    def owner_vehicle(i):
+        token = pick(owner_tokens, i)
+        owned = [v for v in vehicles if v.owner_id == token.car_owner_id]
+        return token, pick(owned, i)
+
+    def vehicle_list(suffix):
+        def build(i):
+            token, vehicle = owner_vehicle(i)
+            return 'GET', f'/vehicles/{vehicle.pk}/{suffix}/', None, bearer(token)
+        return build
+
+    same_password = {'current_password': PASSWORD, 'new_password': PASSWORD, 'confirm_password': PASSWORD}
+
+    return {
+        'driver register': driver_register,
+        'driver login': lambda i: ('POST', '/driver/login/',
+                                   {'username': pick(drivers, i).username, 'password': PASSWORD}, {}),
+        'car owner login': lambda i: ('POST', '/car-owner/login/',
+                                      {'username': pick(owners, i).email, 'password': PASSWORD}, {}),
+        'mechanic login': lambda i: ('POST', '/mechanic/login/',
+                                     {'email': pick(mechanics, i).email, 'password': PASSWORD}, {}),
+        'driver logout': driver_logout,
+        'driver change password': lambda i: ('POST', '/driver/change-password/', same_password,
+                                             bearer(pick(driver_tokens, i))),
+        'driver profile': lambda i: ('GET', '/driver/profile/', None, bearer(pick(driver_tokens, i))),
+        'driver profile update': lambda i: ('PUT', '/driver/profile/', {'is_available': True},
+                                            bearer(pick(driver_tokens, i))),
+        'car owner profile': lambda i: ('GET', '/car-owner/profile/', None, bearer(pick(owner_tokens, i))),
+        'mechanic profile': lambda i: ('GET', '/mechanic/profile/', None, bearer(pick(mechanic_tokens, i))),
+        'driver trips': lambda i: ('GET', '/driver/trips/', None, bearer(pick(driver_tokens, i))),
+        'vehicle trips': vehicle_list('trips'),
+        'vehicle fuel logs': vehicle_list('fuel-logs'),
+        'vehicle reminders': vehicle_list('reminders'),
+        'vehicle dashboard': vehicle_list('dashboard'),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Load-test the API against a synthetic fleet and compare with a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--owners', type=int, default=5)
+        parser.add_argument('--vehicles-per-owner', type=int, default=10)
+        parser.add_argument('--rows-per-vehicle', type=int, default=50)
+        parser.add_argument('--hasher-iterations', type=int, default=None,
+                            help='PBKDF2 iterations, defaults to PASSWORD_HASHER_ITERATIONS')
+        parser.add_argument('--scenario', action='append', default=None,
+                            help='Only run the named endpoint scenario, may be repeated')
+        parser.add_argument('--baseline', help='JSON results to compare against')
+        parser.add_argument('--save-baseline', help='Write the results as a new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative slowdown before flagging a regression')
+
+    def handle(self, *args, **options):
+        iterations = options['hasher_iterations'] or settings.PASSWORD_HASHER_ITERATIONS
+
+        setup_test_environment()
+        try:
+            with override_settings(PASSWORD_HASHER_ITERATIONS=iterations), temporary_database():
+                results = self.run(options)
+        finally:
+            teardown_test_environment()
+
+        self.report(results, options)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump({'options': {k: options[k] for k in (
+                    'requests', 'concurrency', 'owners', 'vehicles_per_owner', 'rows_per_vehicle')},
+                    'hasher_iterations': iterations, 'results': results}, f, indent=2, sort_keys=True)
+            self.stdout.write(f'Baseline written to {options["save_baseline"]}')
+
+    def run(self, options):
+        rows = options['rows_per_vehicle']
+        fleet = seed_fleet(owners=options['owners'], vehicles_per_owner=options['vehicles_per_owner'],
+                           trips_per_vehicle=rows, fuel_logs_per_vehicle=rows, reminders_per_vehicle=rows,
+                           mechanics=options['owners'], password=PASSWORD)
+        scenarios = build_scenarios(fleet)
+
+        selected = options['scenario'] or list(scenarios)
+        unknown = set(selected) - set(scenarios)
+        if unknown:
+            raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+
+        results = {}
+        # The token authentication classes print on every request
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            for name in selected:
+                results[name] = self.run_scenario(scenarios[name], options['requests'], options['concurrency'])
+        return results
+
+    def run_scenario(self, build, requests, concurrency):
+        counter = itertools.count()
+        lock = threading.Lock()
+        latencies, query_counts, statuses = [], [], {}
+
+        def worker():
+            client = Client()
+            queries = [0]
+
+            def count_query(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+
+            try:
+                with connection.execute_wrapper(count_query):
+                    while True:
+                        i = next(counter)
+                        if i >= requests:
+                            break
+                        method, path, data, headers = build(i)
+                        body = json.dumps(data) if data is not None else ''
+
+                        queries[0] = 0
+                        started = time.perf_counter()
+                        response = client.generic(method, path, body, content_type='application/json', **headers)
+                        elapsed = time.perf_counter() - started
+
+                        with lock:
+                            latencies.append(elapsed)
+                            query_counts.append(queries[0])
+                            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': sum(count for code, count in statuses.items() if code >= 400),
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'throughput_rps': round(len(latencies) / wall, 1) if wall else 0.0,
+            'queries_per_request': round(sum(query_counts) / len(query_counts), 2) if query_counts else 0.0,
+        }
+
+    def report(self, results, options):
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['results']
+
+        tolerance = options['tolerance']
+        self.stdout.write(f'{"endpoint":<24}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>9}'
+                          f'{"queries":>9}{"errors":>8}')
+
+        regressions = []
+        for name, r in results.items():
+            flags = []
+            base = baseline.get(name)
+            if base:
+                if r['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                    flags.append(f'p95 {base["p95_ms"]} -> {r["p95_ms"]} ms')
+                if r['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+                    flags.append(f'throughput {base["throughput_rps"]} -> {r["throughput_rps"]} req/s')
+                # Query counts are deterministic, any increase is a regression
+                if r['queries_per_request'] > base['queries_per_request']:
+                    flags.append(f'queries {base["queries_per_request"]} -> {r["queries_per_request"]}')
+                if r['errors'] > base['errors']:
+                    flags.append(f'errors {base["errors"]} -> {r["errors"]}')
+
+            self.stdout.write(f'{name:<24}{r["p50_ms"]:>9}{r["p95_ms"]:>9}{r["p99_ms"]:>9}'
+                              f'{r["throughput_rps"]:>9}{r["queries_per_request"]:>9}{r["errors"]:>8}'
+                              + (f'  REGRESSION: {"; ".join(flags)}' if flags else ''))
+            if flags:
+                regressions.append(name)
+
+        if regressions:
+            raise CommandError(f'Regressions against baseline: {", ".join(regressions)}')
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from webapp import assignments
+from webapp.bench import seed_fleet, temporary_database
+from webapp.models import Driver
+
+
+def _rotation(drivers, vehicles, shift):
+    # Every driver to the vehicle `shift` places along, the worst case for a
+    # one driver per vehicle constraint checked row by row
+    return {driver.pk: vehicles[(i + shift) % len(vehicles)].pk for i, driver in enumerate(drivers)}
+
+
+class Command(BaseCommand):
+    help = 'Time a fleet-wide rota change through reassign() against saving drivers one by one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            fleet = seed_fleet(vehicles_per_owner=options['drivers'], trips_per_vehicle=0,
+                               fuel_logs_per_vehicle=0, reminders_per_vehicle=0)
+            owner = fleet['owners'][0]
+            drivers = sorted(fleet['drivers'], key=lambda driver: driver.pk)
+            vehicles = sorted(fleet['vehicles'], key=lambda vehicle: vehicle.pk)
+
+            changes = _rotation(drivers, vehicles, 1)
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                result = assignments.reassign(owner, changes)
+                bulk = time.perf_counter() - started
+            self.check_state(changes)
+            self.stdout.write(f'reassign(): {result["changed"]} drivers moved in {bulk:.2f}s, {len(queries)} queries')
+
+            # The same rotation one save() at a time, cleared first so the
+            # constraint allows it, with the signals a profile edit runs
+            changes = _rotation(drivers, vehicles, 2)
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                with transaction.atomic():
+                    for driver in Driver.objects.filter(pk__in=list(changes)):
+                        driver.vehicle = None
+                        driver.save()
+                    for driver in Driver.objects.filter(pk__in=list(changes)):
+                        driver.vehicle_id = changes[driver.pk]
+                        driver.full_clean()
+                        driver.save()
+                single = time.perf_counter() - started
+            self.check_state(changes)
+            self.stdout.write(f'save() per driver: {len(changes)} drivers moved in {single:.2f}s, '
+                              f'{len(queries)} queries ({single / bulk:.0f}x slower)')
+
+    def check_state(self, changes):
+        actual = dict(Driver.objects.filter(pk__in=list(changes)).values_list('pk', 'vehicle_id'))
+        if actual != changes:
+            raise CommandError('drivers are not on the vehicles they were given')
+        if Driver.objects.exclude(vehicle=None).values('vehicle').annotate(n=Count('pk')).filter(n__gt=1).exists():
+            raise CommandError('a vehicle has more than one driver')
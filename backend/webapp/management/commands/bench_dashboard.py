@@ -0,0 +1,84 @@
+import itertools
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from webapp import dashboard
+from webapp.bench import best_of, seed_fleet, temporary_database
+from webapp.models import Inspection, Insurance, License, Vehicle
+from webapp.serializers import VehicleDetailSerializer
+
+
+def seed_documents(vehicles, per_vehicle):
+    today = timezone.now().date()
+    Insurance.objects.bulk_create([
+        Insurance(vehicle=v, provider='Bench Mutual', policy_number=f'POL-{v.pk}-{n}',
+                  start_date=today - timedelta(days=365 * (n + 1)), expiry_date=today + timedelta(days=30 - 365 * n))
+        for v in vehicles for n in range(per_vehicle)
+    ])
+    Inspection.objects.bulk_create([
+        Inspection(vehicle=v, certificate_number=f'INS-{v.pk}-{n}',
+                   inspection_date=today - timedelta(days=365 * (n + 1)), expiry_date=today - timedelta(days=365 * n))
+        for v in vehicles for n in range(per_vehicle)
+    ])
+    License.objects.bulk_create([
+        License(vehicle=v, license_type='VEHICLE', license_number=f'LIC-{v.pk}-{n}',
+                issue_date=today - timedelta(days=365 * (n + 1)), expiry_date=today + timedelta(days=10))
+        for v in vehicles for n in range(per_vehicle)
+    ])
+
+
+class Command(BaseCommand):
+    help = 'Check the vehicle dashboard stays within its query budget and time it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows-per-vehicle', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            rows = options['rows_per_vehicle']
+            fleet = seed_fleet(vehicles_per_owner=4, trips_per_vehicle=rows,
+                               fuel_logs_per_vehicle=rows, reminders_per_vehicle=rows)
+            owner = fleet['owners'][0]
+            vehicles = list(Vehicle.objects.filter(owner=owner).order_by('pk'))
+            # The last vehicle stays empty, budgets must hold for both
+            seed_documents(vehicles[:-1], 3)
+            Vehicle.objects.create(owner=owner, vehicle_number='EMPTY-1', model='Bare', manufacturer='Bench',
+                                   year_of_manufacture=2020)
+            vehicles = list(Vehicle.objects.filter(owner=owner).order_by('pk'))
+
+            combinations = [dashboard.SECTIONS] + [
+                combo for size in (1, 2) for combo in itertools.combinations(dashboard.SECTIONS, size)
+            ]
+            checked = 0
+            for vehicle, sections in itertools.product(vehicles, combinations):
+                with CaptureQueriesContext(connection) as queries:
+                    found = dashboard.owned_vehicle(vehicle.pk, owner, sections)
+                    data = dashboard.build(found, sections)
+                budget = dashboard.query_budget(sections)
+                if len(queries) > budget:
+                    raise CommandError(f'vehicle {vehicle.pk}, sections {",".join(sections)}: '
+                                       f'{len(queries)} queries, budget {budget}')
+                if set(data) != set(sections):
+                    raise CommandError(f'sections {",".join(sections)} returned {",".join(data)}')
+                checked += 1
+
+            # The vehicle section matches the standalone serializer
+            for vehicle in vehicles:
+                expected = JSONRenderer().render(VehicleDetailSerializer(Vehicle.objects.get(pk=vehicle.pk)).data)
+                actual = JSONRenderer().render(dashboard.build(dashboard.owned_vehicle(vehicle.pk, owner))['vehicle'])
+                if expected != actual:
+                    raise CommandError(f'vehicle {vehicle.pk}: dashboard vehicle section differs from VehicleDetailSerializer')
+
+            self.stdout.write(f'{checked} section combinations within budget '
+                              f'(all sections: {dashboard.query_budget()} queries)')
+
+            vehicle = vehicles[0]
+            elapsed, _data = best_of(lambda: dashboard.build(dashboard.owned_vehicle(vehicle.pk, owner)),
+                                     options['repeat'])
+            self.stdout.write(f'full dashboard with {rows} rows per list: {elapsed * 1000:.1f} ms')
@@ -0,0 +1,98 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from webapp import dispatch
+from webapp.bench import seed_fleet, temporary_database
+from webapp.models import Dispatch, Mechanic, Vehicle
+
+
+class Command(BaseCommand):
+    help = 'Dispatch a burst of breakdowns from concurrent callers and check no mechanic is booked twice'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mechanics', type=int, default=200)
+        parser.add_argument('--incidents', type=int, default=300,
+                            help='More than --mechanics, so callers run out and fight over the last ones')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--bulk-size', type=int, default=20, help='Incidents per dispatch_many() call')
+
+    def handle(self, *args, **options):
+        for mode in ('single', 'bulk'):
+            with temporary_database():
+                self.run(mode, options)
+
+    def run(self, mode, options):
+        rng = random.Random(0)
+        fleet = seed_fleet(vehicles_per_owner=10, trips_per_vehicle=0, fuel_logs_per_vehicle=0,
+                           reminders_per_vehicle=0, mechanics=options['mechanics'])
+        mechanics = fleet['mechanics']
+        for mechanic in mechanics:
+            mechanic.latitude = -1.28 + rng.uniform(-0.2, 0.2)
+            mechanic.longitude = 36.82 + rng.uniform(-0.2, 0.2)
+        Mechanic.objects.bulk_update(mechanics, ['latitude', 'longitude'])
+
+        # Everyone breaks down in the same few streets, so the nearest
+        # mechanics are contended by every caller
+        vehicles = list(Vehicle.objects.all())
+        incidents = [
+            {'vehicle': vehicles[i % len(vehicles)], 'latitude': -1.28 + rng.uniform(-0.01, 0.01),
+             'longitude': 36.82 + rng.uniform(-0.01, 0.01)}
+            for i in range(options['incidents'])
+        ]
+        if mode == 'bulk':
+            size = options['bulk_size']
+            jobs = [(dispatch.dispatch_many, incidents[i:i + size]) for i in range(0, len(incidents), size)]
+        else:
+            jobs = [(lambda incident: [dispatch.dispatch(**incident)], incident) for incident in incidents]
+
+        conflicts = [0]
+        lock = threading.Lock()
+        claim = dispatch.claim
+
+        def counting_claim(*args, **kwargs):
+            result = claim(*args, **kwargs)
+            if result is None:
+                with lock:
+                    conflicts[0] += 1
+            return result
+
+        def work(job):
+            func, argument = job
+            try:
+                return func(argument)
+            finally:
+                connection.close()
+
+        dispatch.claim = counting_claim
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                results = [item for batch in pool.map(work, jobs) for item in batch]
+            elapsed = time.perf_counter() - started
+        finally:
+            dispatch.claim = claim
+
+        assigned = [item for item in results if item is not None]
+        doubled = (Dispatch.objects.filter(status='assigned').values('mechanic')
+                   .annotate(n=Count('pk')).filter(n__gt=1).count())
+        busy = Mechanic.objects.filter(is_available=False).count()
+        open_dispatches = Dispatch.objects.filter(status='assigned').count()
+        expected = min(len(incidents), len(mechanics))
+
+        self.stdout.write(f'{mode}: {len(incidents)} incidents, {len(mechanics)} mechanics, '
+                          f'{options["concurrency"]} callers')
+        self.stdout.write(f'  assigned {len(assigned)} in {elapsed:.2f}s, {conflicts[0]} claims lost to another caller')
+        if doubled:
+            raise CommandError(f'{doubled} mechanics hold more than one dispatch')
+        if busy != open_dispatches or len(assigned) != open_dispatches:
+            raise CommandError(f'{busy} busy mechanics, {open_dispatches} open dispatches, '
+                               f'{len(assigned)} reported assigned')
+        if len(assigned) != expected:
+            raise CommandError(f'{len(assigned)} assigned, {expected} mechanics could have been')
+        self.stdout.write('  no mechanic booked twice')
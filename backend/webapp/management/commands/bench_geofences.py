@@ -0,0 +1,90 @@
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.geofencing import GeofenceIndex, point_in_polygon
+from webapp.models import Geofence
+
+
+def random_fence(rng, pk, center_lat, center_lng, spread):
+    # Star-shaped polygon, so it is simple but not convex
+    lat = center_lat + rng.uniform(-spread, spread)
+    lng = center_lng + rng.uniform(-spread, spread)
+    radius = rng.uniform(0.005, 0.05)
+    vertices = rng.randint(5, 16)
+    polygon = []
+    for v in range(vertices):
+        angle = 2 * math.pi * v / vertices
+        r = radius * rng.uniform(0.5, 1.0)
+        polygon.append([lat + r * math.sin(angle), lng + r * math.cos(angle)])
+    fence = Geofence(pk=pk, name=f'fence{pk}', polygon=polygon)
+    fence.update_bounds()
+    return fence
+
+
+def random_track(rng, count, center_lat, center_lng, spread):
+    # Random walk at roughly 30 m per point, the spacing of a 1 Hz GPS feed at city speeds
+    lat, lng = center_lat, center_lng
+    heading = rng.uniform(0, 2 * math.pi)
+    points = []
+    for _ in range(count):
+        heading += rng.gauss(0, 0.3)
+        lat += 0.0003 * math.sin(heading)
+        lng += 0.0003 * math.cos(heading)
+        if abs(lat - center_lat) > spread or abs(lng - center_lng) > spread:
+            heading += math.pi
+        points.append((lat, lng))
+    return points
+
+
+def brute_force(fences, points):
+    events = []
+    state = None
+    for index, (lat, lng) in enumerate(points):
+        current = {f.pk for f in fences if point_in_polygon(lat, lng, f.polygon)}
+        if state is not None:
+            events.extend((index, pk, 'enter') for pk in current - state)
+            events.extend((index, pk, 'exit') for pk in state - current)
+        state = current
+    return sorted(events)
+
+
+class Command(BaseCommand):
+    help = 'Measure geofence evaluation throughput of the grid index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fences', type=int, default=50)
+        parser.add_argument('--points', type=int, default=500_000)
+        parser.add_argument('--spread', type=float, default=0.2, help='Degrees around the centre')
+        parser.add_argument('--check', type=int, default=20_000,
+                            help='Points compared against brute force point-in-polygon')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        center_lat, center_lng, spread = -1.28, 36.82, options['spread']
+        fences = [random_fence(rng, pk, center_lat, center_lng, spread) for pk in range(1, options['fences'] + 1)]
+        points = random_track(rng, options['points'], center_lat, center_lng, spread)
+
+        started = time.perf_counter()
+        index = GeofenceIndex(fences, settings.GEOFENCE_GRID_DEGREES)
+        build = time.perf_counter() - started
+
+        sample = points[:options['check']]
+        if sorted(index.transitions(sample)) != brute_force(fences, sample):
+            raise CommandError('Grid index disagrees with brute force point-in-polygon')
+
+        started = time.perf_counter()
+        events = sum(1 for _ in index.transitions(points))
+        elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        brute_force(fences, sample)
+        brute = time.perf_counter() - started
+
+        self.stdout.write(f'{len(fences)} fences, {len(index.grid)} grid cells, built in {build * 1000:.1f} ms')
+        self.stdout.write(f'{len(points)} points, {events} events in {elapsed * 1000:.0f} ms: '
+                          f'{len(points) / elapsed:,.0f} points/s')
+        self.stdout.write(f'brute force: {len(sample) / brute:,.0f} points/s')
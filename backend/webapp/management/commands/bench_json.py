@@ -0,0 +1,83 @@
+import io
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from webapp.bench import best_of
+from webapp.parsers import FastJSONParser
+from webapp.renderers import FastJSONRenderer, orjson
+
+
+def trip_payload(rng, count):
+    now = timezone.now()
+    trips = []
+    for i in range(count):
+        started_at = now - timedelta(minutes=rng.randint(60, 100000))
+        ended_at = started_at + timedelta(minutes=rng.randint(5, 240))
+        trips.append({
+            'id': i, 'driver': rng.randint(1, 500), 'driver_name': f'driver{i % 500}',
+            'vehicle': rng.randint(1, 300), 'vehicle_number': f'KBX {i:04d}',
+            'status': 'completed', 'distance_km': round(rng.uniform(1, 120), 2),
+            'started_at': started_at, 'ended_at': ended_at,
+            'duration': str(ended_at - started_at),
+            'locations': [
+                {'id': i * 100 + p, 'latitude': -1.28 + rng.uniform(-0.2, 0.2),
+                 'longitude': 36.82 + rng.uniform(-0.2, 0.2),
+                 'timestamp': started_at + timedelta(seconds=p * 30)}
+                for p in range(20)
+            ],
+        })
+    return trips
+
+
+def maintenance_payload(rng, count):
+    now = timezone.now()
+    return [{
+        'id': i, 'vehicle': rng.randint(1, 300), 'vehicle_number': f'KBX {i:04d}',
+        'service_type_name': rng.choice(['Oil change', 'Brakes', 'Tyres']),
+        'odometer_reading': rng.randint(1000, 300000),
+        'description': 'Routine service – parts replaced',
+        'date': now - timedelta(days=rng.randint(0, 2000)),
+        'total_cost': Decimal(rng.randint(1000, 9999999)) / 100,
+        'replaced_parts': [
+            {'part_name': 'Filter', 'brand': 'Bosch', 'cost': Decimal(rng.randint(100, 99999)) / 100,
+             'next_replacement_date': (now + timedelta(days=180)).date()}
+            for _ in range(3)
+        ],
+    } for i in range(count)]
+
+
+class Command(BaseCommand):
+    help = 'Compare JSON encode/decode throughput of the fast renderer and parser against DRF'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        rows, repeat = options['rows'], options['repeat']
+        self.stdout.write(f'orjson: {orjson.__version__ if orjson else "not installed, fast path falls back"}')
+
+        for label, payload in (('trips', trip_payload(rng, rows)), ('maintenance', maintenance_payload(rng, rows))):
+            drf_time, drf_json = best_of(lambda: JSONRenderer().render(payload), repeat)
+            fast_time, fast_json = best_of(lambda: FastJSONRenderer().render(payload), repeat)
+            if drf_json != fast_json:
+                raise CommandError(f'{label}: fast renderer output differs from JSONRenderer')
+
+            drf_parse, drf_data = best_of(lambda: JSONParser().parse(io.BytesIO(drf_json)), repeat)
+            fast_parse, fast_data = best_of(lambda: FastJSONParser().parse(io.BytesIO(drf_json)), repeat)
+            if drf_data != fast_data:
+                raise CommandError(f'{label}: fast parser result differs from JSONParser')
+
+            size = len(drf_json) / 1e6
+            self.stdout.write(
+                f'{label:<12} {size:6.2f} MB  '
+                f'encode drf {size / drf_time:7.1f} MB/s fast {size / fast_time:7.1f} MB/s (x{drf_time / fast_time:.1f})  '
+                f'decode drf {size / drf_parse:7.1f} MB/s fast {size / fast_parse:7.1f} MB/s (x{drf_parse / fast_parse:.1f})'
+            )
@@ -0,0 +1,55 @@
+import random
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp import scoring
+from webapp.bench import best_of, seed_fleet, temporary_database
+from webapp.models import DriverScore, Trip
+
+
+def _from_database(owner_id, offset, limit):
+    rows = DriverScore.objects.filter(owner_id=owner_id).order_by('-score', 'driver_id')[offset:offset + limit]
+    return scoring._rows(rows)
+
+
+class Command(BaseCommand):
+    help = 'Compare leaderboard pages from the in-process ranking with sorted database queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=2000)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            fleet = seed_fleet(vehicles_per_owner=options['drivers'], trips_per_vehicle=5,
+                               fuel_logs_per_vehicle=0, reminders_per_vehicle=0)
+            owner_id = fleet['owners'][0].pk
+            # Seeded trips skip signals
+            call_command('rebuild_driver_scores', stdout=self.stdout)
+
+            limit = options['page_size']
+            middle = options['drivers'] // 2
+            for offset in (0, middle):
+                count, page = scoring.ranking(owner_id, offset, limit)
+                expected = _from_database(owner_id, offset, limit)
+                if [{k: v for k, v in row.items() if k != 'rank'} for row in page] != expected:
+                    raise CommandError(f'page at {offset} differs from the database order')
+
+                database, _rows = best_of(lambda: _from_database(owner_id, offset, limit), options['repeat'])
+                ranked, _rows = best_of(lambda: scoring.ranking(owner_id, offset, limit), options['repeat'])
+                self.stdout.write(f'{count} drivers, page at {offset}: '
+                                  f'sorted query {database * 1000:.2f} ms, ranking {ranked * 1000:.2f} ms')
+
+            # Trips finishing move drivers through the ranking incrementally
+            rng = random.Random(0)
+            trips = list(Trip.objects.filter(vehicle__owner_id=owner_id).exclude(
+                status__in=scoring.TERMINAL_STATUSES)[:200])
+            for trip in trips:
+                trip.status = rng.choice(scoring.TERMINAL_STATUSES)
+                trip.save()
+            count, page = scoring.ranking(owner_id, 0, count)
+            if [{k: v for k, v in row.items() if k != 'rank'} for row in page] != _from_database(owner_id, 0, count):
+                raise CommandError('ranking differs from the database after incremental updates')
+            self.stdout.write(f'ranking matches the database after {len(trips)} trips finished')
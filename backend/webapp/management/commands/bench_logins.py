@@ -0,0 +1,59 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from webapp import hashing
+
+
+class Command(BaseCommand):
+    help = 'Measure password checks per second through the hashing pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Concurrent callers, defaults to twice the pool size')
+        parser.add_argument('--iterations', type=int, default=None,
+                            help='PBKDF2 iterations to benchmark, defaults to the configured value')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations'] or settings.PASSWORD_HASHER_ITERATIONS
+        with override_settings(PASSWORD_HASHER_ITERATIONS=iterations):
+            self.run(options['logins'], options['concurrency'], iterations)
+
+    def run(self, logins, concurrency, iterations):
+        workers = settings.PASSWORD_HASHING_WORKERS
+        concurrency = concurrency or workers * 2
+        cores = min(workers, os.cpu_count() or 1)
+
+        # Unsaved user with an up-to-date hash, so no rehash or DB write happens
+        raw_password = 'bench-password'
+        user = User(username='bench')
+        user.password = hashers.make_password(raw_password)
+
+        def login(_):
+            try:
+                return hashing.check_password(user, raw_password)
+            except hashing.PasswordHashingBusy:
+                return None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as callers:
+            results = list(callers.map(login, range(logins)))
+        elapsed = time.perf_counter() - started
+
+        ok = results.count(True)
+        rejected = results.count(None)
+        rate = ok / elapsed if elapsed else 0.0
+
+        self.stdout.write(f'iterations:        {iterations}')
+        self.stdout.write(f'pool workers:      {workers} (queue depth {settings.PASSWORD_HASHING_QUEUE_DEPTH})')
+        self.stdout.write(f'callers:           {concurrency}')
+        self.stdout.write(f'logins:            {ok} ok, {rejected} rejected busy in {elapsed:.2f}s')
+        self.stdout.write(f'logins/sec:        {rate:.1f}')
+        self.stdout.write(f'logins/sec/core:   {rate / cores:.1f} ({cores} cores used)')
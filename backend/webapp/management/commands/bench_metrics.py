@@ -0,0 +1,74 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from webapp.metrics import Counter, Histogram
+from webapp.middleware import MetricsMiddleware
+
+
+def per_call_ns(func, calls):
+    started = time.perf_counter_ns()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter_ns() - started) / calls
+
+
+class Command(BaseCommand):
+    help = 'Measure the cost of recording metrics on the request path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200_000)
+        parser.add_argument('--threads', type=int, default=4)
+
+    def handle(self, *args, **options):
+        calls, threads = options['calls'], options['threads']
+
+        counter = Counter('bench_counter_total', 'Benchmark counter', ('method', 'view', 'status'))
+        histogram = Histogram('bench_latency_seconds', 'Benchmark histogram', ('method', 'view'))
+        inc = counter.labels('GET', 'driver_profile', '200').inc
+        observe = histogram.labels('GET', 'driver_profile').observe
+
+        baseline = per_call_ns(lambda: None, calls)
+        rows = [
+            ('counter inc', per_call_ns(inc, calls)),
+            ('counter labels().inc', per_call_ns(lambda: counter.labels('GET', 'driver_profile', '200').inc(), calls)),
+            ('histogram observe', per_call_ns(lambda: observe(0.042), calls)),
+            ('histogram labels().observe', per_call_ns(
+                lambda: histogram.labels('GET', 'driver_profile').observe(0.042), calls)),
+        ]
+
+        # Contended: every thread hits the same label set
+        def work():
+            for _ in range(calls // threads):
+                counter.labels('POST', 'driver_login', '200').inc()
+                histogram.labels('POST', 'driver_login').observe(0.042)
+
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        started = time.perf_counter_ns()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter_ns() - started
+        expected = calls // threads * threads
+        rows.append((f'inc + observe, {threads} threads', elapsed / expected))
+
+        if counter.labels('POST', 'driver_login', '200').value != expected:
+            raise CommandError('Counter lost increments under contention')
+        if sum(histogram.labels('POST', 'driver_login').counts) != expected:
+            raise CommandError('Histogram lost observations under contention')
+
+        # Whole middleware around a view that does nothing
+        request = RequestFactory().get('/driver/profile/')
+        request.resolver_match = resolve('/driver/profile/')
+        middleware = MetricsMiddleware(lambda request: HttpResponse())
+        bare = per_call_ns(lambda: HttpResponse(), calls // 10)
+        rows.append(('middleware per request', per_call_ns(lambda: middleware(request), calls // 10) - bare))
+
+        self.stdout.write(f'{"operation":<34} {"ns/call":>9}')
+        for label, ns in rows:
+            self.stdout.write(f'{label:<34} {ns - baseline:9.0f}')
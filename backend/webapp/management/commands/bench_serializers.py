@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from webapp.bench import best_of, seed_fleet, temporary_database
+from webapp.fast_serializers import fuel_log_fast, reminder_fast, trip_list_fast
+from webapp.models import FuelLog, Reminder, Trip
+from webapp.serializers import FuelLogSerializer, ReminderSerializer, TripListSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare compiled list serializers against the DRF serializers on a synthetic fleet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicles', type=int, default=20)
+        parser.add_argument('--rows-per-vehicle', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            rows = options['rows_per_vehicle']
+            seed_fleet(vehicles_per_owner=options['vehicles'], trips_per_vehicle=rows,
+                       fuel_logs_per_vehicle=rows, reminders_per_vehicle=rows)
+
+            cases = [
+                ('trips', Trip.objects.order_by('-id'), TripListSerializer, ('driver', 'vehicle'), trip_list_fast),
+                ('fuel logs', FuelLog.objects.order_by('-date', '-id'), FuelLogSerializer, ('vehicle',), fuel_log_fast),
+                ('reminders', Reminder.objects.all(), ReminderSerializer, ('vehicle',), reminder_fast),
+            ]
+            for label, queryset, serializer_class, related, compiled in cases:
+                self.compare(label, queryset, serializer_class, related, compiled, options['repeat'])
+
+    def compare(self, label, queryset, serializer_class, related, compiled, repeat):
+        renderer = JSONRenderer()
+
+        # Give the DRF path its best shot with the joins it needs
+        drf_time, drf_json = best_of(lambda: renderer.render(
+            serializer_class(queryset.select_related(*related), many=True).data), repeat)
+        fast_time, fast_json = best_of(lambda: renderer.render(
+            compiled.serialize(queryset)), repeat)
+
+        if drf_json != fast_json:
+            raise CommandError(f'{label}: compiled output differs from {serializer_class.__name__}')
+
+        count = queryset.count()
+        self.stdout.write(
+            f'{label:<10} {count:>7} rows  '
+            f'drf {count / drf_time:>10.0f} rows/s  '
+            f'compiled {count / fast_time:>10.0f} rows/s  '
+            f'x{drf_time / fast_time:.1f}  (identical JSON, {len(fast_json)} bytes)'
+        )
@@ -0,0 +1,59 @@
+import itertools
+import json
+import random
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from webapp import archive, tracks
+from webapp.bench import best_of, synthetic_trip
+
+
+class Command(BaseCommand):
+    help = 'Check the compact trip track encodings round-trip and compare their size and speed with JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=20_000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        rows = synthetic_trip(rng, options['points'])
+        repeat = options['repeat']
+
+        # What TripLocationSerializer sends today, ids included
+        json_body = JSONRenderer().render([
+            {'id': 1_000_000 + i, 'latitude': lat, 'longitude': lng, 'timestamp': at}
+            for i, (lat, lng, at) in enumerate(rows)
+        ])
+
+        # What track_data starts from: rows as values_list returns them for
+        # live trips, the archive blob for archived ones
+        blob = archive.pack_locations([(i, lat, lng, at) for i, (lat, lng, at) in enumerate(rows)])
+        sources = [('rows', lambda: tracks.point_columns(rows)), ('archive', lambda: tracks.archive_columns(blob))]
+        encodings = [
+            ('polyline', tracks.POLYLINE_PRECISION,
+             lambda columns: JSONRenderer().render(tracks.encode_polyline(columns)),
+             lambda body: tracks.decode_polyline(json.loads(body))),
+            ('binary', tracks.BINARY_PRECISION, tracks.pack_track, tracks.unpack_track),
+        ]
+        self.stdout.write(f'json                 {len(json_body):>10} bytes')
+        for (label, precision, encode, decode), (source, columns) in itertools.product(encodings, sources):
+            elapsed, body = best_of(lambda: encode(columns()), repeat)
+            if tracks.numpy is not None:
+                with mock.patch.object(tracks, 'numpy', None):
+                    python_elapsed, python_body = best_of(lambda: encode(columns()), repeat)
+                if python_body != body:
+                    raise CommandError(f'{label} from {source}: numpy and pure Python encodings differ')
+                speedup = f', {python_elapsed / elapsed:.1f}x the pure Python path'
+            else:
+                speedup = ' (pure Python, numpy not installed)'
+
+            tolerance = 0.5 / 10 ** precision + 1e-12
+            for (lat, lng, at), (dlat, dlng, dat) in zip(rows, decode(body)):
+                if abs(lat - dlat) > tolerance or abs(lng - dlng) > tolerance or abs((at - dat).total_seconds()) >= 0.001:
+                    raise CommandError(f'{label}: decoded point {dlat}, {dlng}, {dat} too far from {lat}, {lng}, {at}')
+
+            self.stdout.write(f'{label:<8} {source:<12}{len(body):>10} bytes  {len(json_body) / len(body):5.1f}x smaller  '
+                              f'{len(rows) / elapsed:,.0f} points/s{speedup}')
@@ -0,0 +1,69 @@
+import csv
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from webapp.models import CarOwner
+from webapp.onboarding import import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Create vehicles for one owner from a CSV file with columns vehicle_number, model, manufacturer, '
+            'year_of_manufacture and optionally vehicle_type, current_odometer and image')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--owner', required=True, help='Car owner id or username')
+        parser.add_argument('--images-dir', default=None,
+                            help='Directory the image column is relative to, defaults to the CSV file\'s')
+        parser.add_argument('--workers', type=int, default=None, help='Image processes, defaults to one per CPU')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows validated and written together')
+        parser.add_argument('--rejects', default=None,
+                            help='Where to write rejected rows, defaults to <csv>.rejects.csv')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and decode photos, write nothing')
+
+    def handle(self, *args, **options):
+        owner_ref = options['owner']
+        lookup = Q(username=owner_ref) | (Q(pk=owner_ref) if owner_ref.isdigit() else Q())
+        owner = CarOwner.objects.filter(lookup).first()
+        if owner is None:
+            raise CommandError(f'No car owner {owner_ref}')
+
+        csv_path = options['csv_path']
+        try:
+            rows = read_rows(csv_path)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'{csv_path}: {e}')
+
+        # Progress lives in the database, rows already imported for this
+        # owner are skipped, so an interrupted run is resumed by running again
+        total = len(rows)
+        started = time.perf_counter()
+
+        def progress(report):
+            elapsed = time.perf_counter() - started
+            rate = report['rows'] / elapsed if elapsed else 0.0
+            self.stdout.write(f'{report["rows"]}/{total} rows: {report["created"]} created, '
+                              f'{report["skipped"]} already imported, {report["rejected"]} rejected '
+                              f'({rate:.0f} rows/s)')
+
+        report, rejects = import_rows(
+            owner, rows,
+            images_dir=options['images_dir'] or os.path.dirname(os.path.abspath(csv_path)),
+            workers=options['workers'], batch_size=options['batch_size'],
+            dry_run=options['dry_run'], progress=progress,
+        )
+
+        if rejects:
+            rejects_path = options['rejects'] or f'{os.path.splitext(csv_path)[0]}.rejects.csv'
+            with open(rejects_path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=['line', 'vehicle_number', 'reason'])
+                writer.writeheader()
+                writer.writerows(rejects)
+            self.stdout.write(f'{len(rejects)} rejected rows written to {rejects_path}')
+
+        verb = 'would be created' if options['dry_run'] else 'created'
+        self.stdout.write(f'{report["created"]} vehicles {verb} for {owner.username} '
+                          f'in {time.perf_counter() - started:.1f}s')
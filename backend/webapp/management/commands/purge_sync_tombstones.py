@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from webapp.models import SyncTombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete sync tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Tombstones deleted per statement')
+
+    def handle(self, *args, **options):
+        # Tokens past the retention are refused by sync.read_token, so
+        # nothing can still need these
+        cutoff = timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        expired = SyncTombstone.objects.filter(deleted_at__lt=cutoff)
+
+        deleted = 0
+        while True:
+            ids = list(expired.order_by('deleted_at').values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            SyncTombstone.objects.filter(pk__in=ids).delete()
+            deleted += len(ids)
+
+        self.stdout.write(f'Deleted {deleted} tombstones older than {cutoff:%Y-%m-%d}')
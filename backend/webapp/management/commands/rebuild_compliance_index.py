@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from webapp.compliance import SOURCES, invalidate_summaries
+from webapp.models import CarOwner, ComplianceItem
+
+
+class Command(BaseCommand):
+    help = 'Rebuild ComplianceItem rows from insurances, inspections and licenses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, (kind, reference) in SOURCES.items():
+            written = 0
+            last_pk = 0
+            while True:
+                rows = list(
+                    model.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', 'vehicle_id', 'vehicle__owner_id', reference, 'expiry_date')[:batch_size]
+                )
+                if not rows:
+                    break
+                # Insert or refresh in one statement per batch
+                ComplianceItem.objects.bulk_create([
+                    ComplianceItem(kind=kind, object_id=pk, vehicle_id=vehicle_id, owner_id=owner_id,
+                                   reference=value, expiry_date=expiry_date)
+                    for pk, vehicle_id, owner_id, value, expiry_date in rows
+                ], update_conflicts=True, unique_fields=['kind', 'object_id'],
+                    update_fields=['vehicle', 'owner', 'reference', 'expiry_date', 'updated_at'])
+                written += len(rows)
+                last_pk = rows[-1][0]
+
+            orphans, _detail = (ComplianceItem.objects.filter(kind=kind)
+                                .exclude(object_id__in=model.objects.values('pk')).delete())
+            self.stdout.write(f'{kind}: indexed {written}, removed {orphans} stale rows')
+
+        invalidate_summaries(*CarOwner.objects.values_list('pk', flat=True))
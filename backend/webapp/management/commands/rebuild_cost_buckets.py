@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from webapp.costs import buckets, stale_buckets
+from webapp.models import Vehicle, VehicleMonthlyCost
+
+
+class Command(BaseCommand):
+    help = 'Rebuild VehicleMonthlyCost rows from fuel logs, maintenance logs and replaced parts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Vehicles per transaction')
+        parser.add_argument('--check', action='store_true',
+                            help='Compare the kept buckets with the raw rows and write nothing')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        vehicles = 0
+        written = 0
+        stale = 0
+        last_pk = 0
+        while True:
+            owners = dict(
+                Vehicle.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'owner_id')[:batch_size]
+            )
+            if not owners:
+                break
+            if options['check']:
+                for vehicle_id, month, kept, expected in stale_buckets(list(owners)):
+                    self.stdout.write(f'vehicle {vehicle_id} {month:%Y-%m}: kept {kept}, expected {expected}')
+                    stale += 1
+            else:
+                rows = [
+                    VehicleMonthlyCost(vehicle_id=vehicle_id, owner_id=owners[vehicle_id], month=month, **totals)
+                    for (vehicle_id, month), totals in sorted(buckets(list(owners)).items())
+                ]
+                # Replaced whole per batch, so a report never sees half a vehicle
+                with transaction.atomic():
+                    VehicleMonthlyCost.objects.filter(vehicle_id__in=list(owners)).delete()
+                    VehicleMonthlyCost.objects.bulk_create(rows, batch_size=1000)
+                written += len(rows)
+            vehicles += len(owners)
+            last_pk = max(owners)
+
+        if options['check']:
+            if stale:
+                raise CommandError(f'{stale} monthly buckets disagree with the raw rows, run rebuild_cost_buckets')
+            self.stdout.write(f'Monthly buckets for {vehicles} vehicles match the raw rows')
+            return
+        self.stdout.write(f'Rebuilt {written} monthly buckets for {vehicles} vehicles')
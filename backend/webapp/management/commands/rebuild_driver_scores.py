@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from webapp.models import Driver, DriverScore
+from webapp.scoring import compute_score, totals
+
+
+class Command(BaseCommand):
+    help = 'Rebuild DriverScore rows from completed and cancelled trips and finalized trip summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Drivers per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        drivers = 0
+        written = 0
+        last_pk = 0
+        while True:
+            driver_ids = list(Driver.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not driver_ids:
+                break
+            rows = [
+                DriverScore(driver_id=driver_id, owner_id=owner_id, score=compute_score(values), **values)
+                for (driver_id, owner_id), values in sorted(totals(drivers=driver_ids).items())
+            ]
+            with transaction.atomic():
+                DriverScore.objects.filter(driver_id__in=driver_ids).delete()
+                DriverScore.objects.bulk_create(rows, batch_size=1000)
+            drivers += len(driver_ids)
+            written += len(rows)
+            last_pk = driver_ids[-1]
+
+        self.stdout.write(f'Rebuilt {written} scores for {drivers} drivers')
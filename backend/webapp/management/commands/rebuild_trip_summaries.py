@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from webapp.analytics import numpy
+from webapp.models import Trip, TripSummary
+
+
+class Command(BaseCommand):
+    help = 'Recompute driving behaviour summaries from stored trip locations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild every trip, not just trips without a summary')
+        parser.add_argument('--trip', type=int, action='append', default=[],
+                            help='Rebuild only this trip, may be repeated')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.order_by('pk')
+        if options['trip']:
+            trips = trips.filter(pk__in=options['trip'])
+        elif not options['all']:
+            trips = trips.filter(summary__isnull=True)
+
+        self.stdout.write(f'Recomputing with {"numpy" if numpy else "the streaming pass, numpy is not installed"}')
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            # Keyset pagination, rebuilt trips drop out of the summary__isnull filter
+            batch = list(trips.filter(pk__gt=last_pk).only('pk', 'status')[:options['batch_size']])
+            if not batch:
+                break
+            for trip in batch:
+                summary, _ = TripSummary.objects.get_or_create(trip=trip)
+                summary.finalized = trip.status == 'completed'
+                summary.rebuild()
+            rebuilt += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(f'Rebuilt {rebuilt} trip summaries')
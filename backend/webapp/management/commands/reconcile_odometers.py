@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from webapp.models import FuelLog, MaintenanceLog, Trip, Vehicle
+
+
+class Command(BaseCommand):
+    help = 'Recompute every vehicle odometer from its highest recorded reading plus completed trips since'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        # Highest reading first, the most recent one when readings tie
+        fuel = FuelLog.objects.filter(vehicle=OuterRef('pk')).order_by('-odometer_reading', '-created_at')
+        maintenance = MaintenanceLog.objects.filter(vehicle=OuterRef('pk')).order_by('-odometer_reading', '-date')
+
+        checked = changed = drift = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                vehicles = list(
+                    Vehicle.objects.select_for_update()
+                    .filter(pk__gt=last_pk).order_by('pk')
+                    .annotate(
+                        fuel_reading=Subquery(fuel.values('odometer_reading')[:1]),
+                        fuel_at=Subquery(fuel.values('created_at')[:1]),
+                        maintenance_reading=Subquery(maintenance.values('odometer_reading')[:1]),
+                        maintenance_at=Subquery(maintenance.values('date')[:1]),
+                    )
+                    .only('pk', 'current_odometer', 'odometer_carry_km', 'confirmed_odometer', 'odometer_confirmed_at', 'updated_at')
+                    [:batch_size]
+                )
+                if not vehicles:
+                    break
+
+                anchors = {}
+                for vehicle in vehicles:
+                    readings = [(r, at) for r, at in ((vehicle.fuel_reading, vehicle.fuel_at),
+                                                      (vehicle.maintenance_reading, vehicle.maintenance_at))
+                                if r is not None]
+                    anchors[vehicle.pk] = max(readings, key=lambda reading: (reading[0], reading[1])) if readings else (0, None)
+
+                # Trip distance after each vehicle's anchor, one grouped query per batch
+                since_anchor = Q()
+                for pk, (_reading, at) in anchors.items():
+                    since_anchor |= Q(vehicle_id=pk, ended_at__gt=at) if at else Q(vehicle_id=pk)
+                trip_km = dict(
+                    Trip.objects.filter(since_anchor, status='completed')
+                    .values('vehicle_id').annotate(km=Sum('distance_km'))
+                    .values_list('vehicle_id', 'km')
+                )
+
+                updated = []
+                for vehicle in vehicles:
+                    reading, at = anchors[vehicle.pk]
+                    km = trip_km.get(vehicle.pk) or 0.0
+                    odometer = reading + int(km)
+                    carry = km - int(km)
+                    if (vehicle.current_odometer, vehicle.confirmed_odometer, vehicle.odometer_confirmed_at) == (odometer, reading, at):
+                        continue
+                    drift += abs(vehicle.current_odometer - odometer)
+                    vehicle.current_odometer = odometer
+                    vehicle.odometer_carry_km = carry
+                    vehicle.confirmed_odometer = reading
+                    vehicle.odometer_confirmed_at = at
+                    vehicle.updated_at = timezone.now()
+                    updated.append(vehicle)
+
+                if updated and not dry_run:
+                    Vehicle.objects.bulk_update(updated, ['current_odometer', 'odometer_carry_km', 'confirmed_odometer',
+                                                          'odometer_confirmed_at', 'updated_at'])
+                checked += len(vehicles)
+                changed += len(updated)
+                last_pk = vehicles[-1].pk
+
+        verb = 'would change' if dry_run else 'changed'
+        self.stdout.write(f'Checked {checked} vehicles, {verb} {changed}, total drift {drift} km')
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webapp.models import CarOwnerToken, DriverToken, MechanicToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired driver, car owner and mechanic tokens in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches to let other writers through')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pause = options['pause']
+
+        for model in (DriverToken, CarOwnerToken, MechanicToken):
+            deleted = 0
+            while True:
+                # Select a bounded set of keys through the expires index, then
+                # delete by primary key so each statement holds its lock briefly
+                keys = list(model.objects.expired().values_list('pk', flat=True)[:batch_size])
+                if not keys:
+                    break
+                model.objects.filter(pk__in=keys).delete()
+                deleted += len(keys)
+                if pause:
+                    time.sleep(pause)
+
+            self.stdout.write(f'{model.__name__}: deleted {deleted} expired tokens')
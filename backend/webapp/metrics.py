@@ -0,0 +1,298 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Reminder
+
+# Minimal in-process metrics with Prometheus text exposition.
+#
+# Every worker process keeps its own values in memory. With METRICS_DIR set,
+# each process also snapshots them to its own file every
+# METRICS_FLUSH_INTERVAL seconds, and a scrape sums the live values of the
+# answering process with the snapshots of all the others.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _CounterChild:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+
+class _HistogramChild:
+    __slots__ = ('_lock', '_bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        # One slot per bucket plus +Inf, cumulated only when rendering
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return {'counts': list(self.counts), 'sum': self.sum}
+
+    @staticmethod
+    def merge(a, b):
+        return {'counts': [x + y for x, y in zip(a['counts'], b['counts'])], 'sum': a['sum'] + b['sum']}
+
+
+class _Metric:
+    child_class = None
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _new_child(self):
+        return self.child_class()
+
+    def labels(self, *values):
+        # Lock-free read for label sets that already exist, the common case
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        return {values: child.snapshot() for values, child in list(self._children.items())}
+
+    def snapshot(self):
+        return {json.dumps(values): sample for values, sample in self.samples().items()}
+
+
+class Counter(_Metric):
+    child_class = _CounterChild
+    type_name = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self, samples):
+        for values, value in sorted(samples.items()):
+            yield f'{self.name}{_label_text(self.labelnames, values)} {_format(value)}'
+
+
+class Histogram(_Metric):
+    child_class = _HistogramChild
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self, samples):
+        for values, sample in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), sample['counts']):
+                cumulative += count
+                labels = _label_text(self.labelnames, values, f'le="{_format(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _label_text(self.labelnames, values)
+            yield f'{self.name}_sum{labels} {_format(sample["sum"])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Gauge:
+    # Computed at scrape time by the answering process, never aggregated
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = ()
+        self.collect = collect
+        REGISTRY.register(self)
+
+    def samples(self):
+        return {}
+
+    def snapshot(self):
+        return {}
+
+    def render(self, samples):
+        yield f'{self.name} {_format(self.collect())}'
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self._file_token = None
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _snapshot_path(self):
+        return os.path.join(settings.METRICS_DIR, f'metrics-{os.getpid()}-{self._file_token}.json')
+
+    def flush(self):
+        if not settings.METRICS_DIR or self._file_token is None:
+            return
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = self._snapshot_path()
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+
+    def ensure_flusher(self):
+        # Called on the request path, so the common case is one comparison.
+        # Started per process because threads do not survive a fork.
+        if self._flusher_pid == os.getpid() or not settings.METRICS_DIR:
+            return
+        with self._flusher_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            # Unique per process start so a reused pid never overwrites old totals
+            self._file_token = uuid.uuid4().hex[:8]
+            threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def collect(self):
+        merged = {name: metric.samples() for name, metric in self.metrics.items()}
+
+        if settings.METRICS_DIR and os.path.isdir(settings.METRICS_DIR):
+            own = os.path.basename(self._snapshot_path()) if self._file_token else None
+            for entry in os.listdir(settings.METRICS_DIR):
+                if not entry.endswith('.json') or entry == own:
+                    continue
+                try:
+                    with open(os.path.join(settings.METRICS_DIR, entry)) as f:
+                        other = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                for name, samples in other.items():
+                    metric = self.metrics.get(name)
+                    if metric is None or isinstance(metric, Gauge):
+                        continue
+                    target = merged.setdefault(name, {})
+                    for key, value in samples.items():
+                        values = tuple(json.loads(key))
+                        target[values] = metric.child_class.merge(target[values], value) if values in target else value
+        return merged
+
+    def render(self):
+        samples = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type_name}')
+            lines.extend(metric.render(samples.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+# Application metrics
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by view',
+    ('method', 'view'),
+)
+
+REQUESTS = Counter(
+    'http_requests_total', 'Requests by view and status code',
+    ('method', 'view', 'status'),
+)
+
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL queries per request by view',
+    ('view',), buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+
+AUTH_TOKEN_LOOKUPS = Counter(
+    'auth_token_lookups_total', 'Bearer token lookups by user type and result',
+    ('user_type', 'result'),
+)
+
+PROFILE_CACHE = Counter(
+    'profile_cache_requests_total', 'Profile GETs by how they were answered',
+    ('kind', 'result'),
+)
+
+INGEST_BATCH_SIZE = Histogram(
+    'trip_location_ingest_batch_size', 'TripLocation points per ingested batch',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+
+
+def _reminder_backlog():
+    return Reminder.objects.filter(sent=False, reminder_date__lte=timezone.now()).count()
+
+
+REMINDER_BACKLOG = Gauge(
+    'reminder_backlog', 'Reminders that are due but not yet sent', _reminder_backlog,
+)
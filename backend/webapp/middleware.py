@@ -0,0 +1,159 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics, routers
+
+logger = logging.getLogger('webapp.profiling')
+
+# IN (%s, %s, %s) with any number of placeholders is one query shape
+IN_LIST = re.compile(r'\((?:%s|\?)(?:,\s*(?:%s|\?))*\)')
+
+# cProfile cannot run on two threads at once on newer Pythons
+_profile_lock = threading.Lock()
+
+
+def query_shape(sql):
+    return IN_LIST.sub('(...)', sql)
+
+
+class RequestProfilingMiddleware:
+    # Records total time, DB time, query count and repeated query shapes for
+    # each request. Repeated shapes are how N+1 loops show up. When
+    # REQUEST_PROFILING_ENABLED is off Django drops the middleware entirely.
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.headers = settings.REQUEST_PROFILING_HEADERS
+        self.duplicate_threshold = settings.REQUEST_PROFILING_DUPLICATE_THRESHOLD
+        self.slow_ms = settings.REQUEST_PROFILING_SLOW_MS
+        self.sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        self.profile_dir = settings.REQUEST_PROFILING_DIR
+
+    def __call__(self, request):
+        shapes = Counter()
+        db_time = [0.0]
+
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db_time[0] += time.perf_counter() - started
+                shapes[query_shape(sql)] += 1
+
+        profiler = None
+        if self.sample_rate and random.random() < self.sample_rate and _profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(record))
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+            total_ms = (time.perf_counter() - started) * 1000
+
+            if profiler and total_ms >= self.slow_ms:
+                self.dump_profile(profiler, request, total_ms)
+        finally:
+            if profiler:
+                _profile_lock.release()
+
+        queries = sum(shapes.values())
+        duplicates = {shape: count for shape, count in shapes.items() if count >= self.duplicate_threshold}
+
+        if duplicates:
+            logger.warning('%s %s ran %d queries, repeated shapes: %s', request.method, request.path,
+                           queries, '; '.join(f'{count}x {shape}' for shape, count in duplicates.items()))
+        if total_ms >= self.slow_ms:
+            logger.warning('Slow request %s %s: %.1f ms, %.1f ms in %d queries',
+                           request.method, request.path, total_ms, db_time[0] * 1000, queries)
+
+        if self.headers:
+            response['X-Request-Time-Ms'] = f'{total_ms:.2f}'
+            response['X-DB-Time-Ms'] = f'{db_time[0] * 1000:.2f}'
+            response['X-DB-Queries'] = str(queries)
+            response['X-DB-Duplicate-Queries'] = str(sum(duplicates.values()))
+        return response
+
+    def dump_profile(self, profiler, request, total_ms):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'root'
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{request.method}-{slug}-{total_ms:.0f}ms.prof'
+        path = os.path.join(self.profile_dir, name)
+        profiler.dump_stats(path)
+        logger.warning('Profile for slow request %s %s written to %s', request.method, request.path, path)
+
+
+class MetricsMiddleware:
+    # Feeds per-view latency, status and query count metrics, see metrics.py
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.REGISTRY.ensure_flusher()
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.url_name or match.view_name if match else 'unmatched'
+        metrics.REQUEST_LATENCY.labels(request.method, view).observe(elapsed)
+        metrics.REQUESTS.labels(request.method, view, str(response.status_code)).inc()
+        metrics.REQUEST_QUERIES.labels(view).observe(queries[0])
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    # Lets safe requests read from DATABASE_REPLICAS, see routers.py. A
+    # principal that writes is pinned to the primary for
+    # REPLICA_STICKY_SECONDS so it always reads its own writes.
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        principal = routers.principal_key(request)
+        safe = request.method in routers.SAFE_METHODS
+        token = routers.begin(safe and not routers.is_pinned(principal))
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end(token)
+
+        if principal and (wrote or not safe):
+            routers.pin(principal)
+        return response
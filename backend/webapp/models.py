@@ -1,10 +1,13 @@
 from datetime import timedelta
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Cast, Floor
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from math import radians, sin, cos, sqrt, atan2
 from django.contrib.auth.models import User
 from django.utils.crypto import get_random_string
+from . import analytics, archive
 # Create your models here.
 
 class Driver(models.Model):
@@ -17,10 +20,15 @@ class Driver(models.Model):
     is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
-    def clean(self):
-        if self.vehicle and self.vehicle.assigned_driver.exists() and self.vehicle.assigned_driver.first() != self:
-            raise ValidationError('This vehicle is already assigned to another driver')
+
+    class Meta:
+        # One driver per vehicle, checked by full_clean() and enforced by the
+        # database under concurrent assignment. Unassigned drivers are NULL
+        # and never collide. See assignments.py for rota changes.
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle'], name='unique_driver_per_vehicle',
+                                    violation_error_message='This vehicle is already assigned to another driver'),
+        ]
     
     def __str__(self):
         return self.username
@@ -35,6 +43,12 @@ class Mechanic(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     location = models.CharField(max_length=255)
+    # Last known position, mechanics without one are never dispatched
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['is_available', 'latitude', 'longitude'])]
     
     def __str__(self):
         return self.username
@@ -51,6 +65,34 @@ class CarOwner(models.Model):
     def __str__(self):
         return self.username
 
+class VehicleQuerySet(models.QuerySet):
+    # Odometer changes are single UPDATE statements so concurrent trips and
+    # readings never overwrite each other
+
+    def add_trip_distance(self, distance_km):
+        # Whole kilometres go on the odometer, the fraction is carried over
+        if distance_km <= 0:
+            return 0
+        total = F('odometer_carry_km') + distance_km
+        whole = Cast(Floor(total), models.IntegerField())
+        return self.update(
+            current_odometer=F('current_odometer') + whole,
+            odometer_carry_km=total - whole,
+            updated_at=timezone.now(),
+        )
+
+    def record_odometer_reading(self, reading, at=None):
+        # A fuel or maintenance reading at least as high as any before it
+        # replaces the trip based estimate, older or lower ones change nothing
+        return self.filter(confirmed_odometer__lte=reading).update(
+            current_odometer=reading,
+            confirmed_odometer=reading,
+            odometer_carry_km=0.0,
+            odometer_confirmed_at=at or timezone.now(),
+            updated_at=timezone.now(),
+        )
+
+
 class Vehicle(models.Model):
     VEHICLE_TYPES = (
         ('car', 'Car'),
@@ -65,11 +107,21 @@ class Vehicle(models.Model):
     manufacturer = models.CharField(max_length=100)
     vehicle_type = models.CharField(max_length=20, choices=VEHICLE_TYPES, default='car')
     year_of_manufacture = models.IntegerField()
+    # Best estimate, the last confirmed reading plus completed trips since
     current_odometer = models.IntegerField(default=0)
+    odometer_carry_km = models.FloatField(default=0.0, editable=False)
+    # Highest reading recorded in a fuel or maintenance log
+    confirmed_odometer = models.IntegerField(default=0, editable=False)
+    odometer_confirmed_at = models.DateTimeField(null=True, blank=True, editable=False)
     image = models.ImageField(upload_to='vehicle_images/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = VehicleQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'updated_at'])]
+    
     def clean(self):
         current_year = timezone.now().year
         if self.year_of_manufacture < 1900 or self.year_of_manufacture > current_year + 1:
@@ -78,6 +130,14 @@ class Vehicle(models.Model):
     def __str__(self):
         return self.vehicle_number
 
+def deleted_with_vehicle(origin):
+    # True for the delete signals of a delete() that started from vehicles or
+    # their owners. Every row such a delete cascades to goes with its vehicle,
+    # so receivers keeping per vehicle records handle the vehicle as a whole.
+    if isinstance(origin, models.QuerySet):
+        return issubclass(origin.model, (Vehicle, CarOwner))
+    return isinstance(origin, (Vehicle, CarOwner))
+
 class Trip(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -96,6 +156,15 @@ class Trip(models.Model):
     started_at = models.DateTimeField(null=True, blank=True)
     ended_at = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Set once archive_trip_locations has moved the locations to TripLocationArchive
+    locations_archived = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicle', 'updated_at']),
+            models.Index(fields=['driver', 'updated_at']),
+        ]
 
     def clean(self):
         if self.started_at and self.ended_at and self.started_at > self.ended_at:
@@ -130,12 +199,51 @@ class Trip(models.Model):
         self.save()
 
     def end_trip(self, end_lat, end_lng):
-        self.end_lat = end_lat
-        self.end_lng = end_lng
-        self.ended_at = timezone.now()
-        self.distance_km = self.calculate_distance()
-        self.status = 'completed'
-        self.save()
+        # False when the trip was already completed. The status is read from
+        # the locked row, not this instance, so of two concurrent calls only
+        # one adds the distance to the odometer.
+        with transaction.atomic():
+            stored = Trip.objects.select_for_update().filter(pk=self.pk).values_list('status', flat=True).first()
+            if stored == 'completed':
+                return False
+            self.end_lat = end_lat
+            self.end_lng = end_lng
+            self.ended_at = timezone.now()
+            self.distance_km = self.calculate_distance()
+            self.status = 'completed'
+            self.save()
+            Vehicle.objects.filter(pk=self.vehicle_id).add_trip_distance(self.distance_km)
+        TripSummary.finalize_trip(self)
+        return True
+
+    # trip.locations only holds live rows. Once archive_trip_locations has
+    # moved them to TripLocationArchive, these read them from there.
+
+    def all_locations(self):
+        locations = list(self.locations.all())
+        if self.locations_archived:
+            archived = TripLocationArchive.objects.filter(trip_id=self.pk).first()
+            if archived is not None:
+                # Archived trips have no live rows left, so nothing interleaves
+                locations.extend(archived.locations())
+        return locations
+
+    def location_points(self):
+        # (latitude, longitude, timestamp) in order, without building instances
+        points = list(self.live_location_points())
+        data = self.archived_location_data()
+        if data is not None:
+            points.extend((lat, lng, timestamp) for _pk, lat, lng, timestamp in archive.unpack_locations(data))
+        return points
+
+    def live_location_points(self):
+        return self.locations.order_by('timestamp', 'id').values_list('latitude', 'longitude', 'timestamp')
+
+    def archived_location_data(self):
+        # The archive blob, or None for trips that were never archived
+        if not self.locations_archived:
+            return None
+        return TripLocationArchive.objects.filter(trip_id=self.pk).values_list('data', flat=True).first()
 
     def __str__(self):
         return f"Trip #{self.id} - {self.driver.username}"
@@ -148,10 +256,128 @@ class TripLocation(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [models.Index(fields=['trip', 'timestamp'])]
 
     def __str__(self):
         return f"Location for trip {self.trip.id}"
 
+class TripSummary(models.Model):
+    # Driving behaviour totals kept current as locations are ingested, so
+    # reports never rescan TripLocation. See analytics.py for the definitions.
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    point_count = models.PositiveIntegerField(default=0)
+    tracked_distance_km = models.FloatField(default=0.0)
+    moving_seconds = models.FloatField(default=0.0)
+    idle_seconds = models.FloatField(default=0.0)
+    stop_count = models.PositiveIntegerField(default=0)
+    max_speed_kmh = models.FloatField(default=0.0)
+    harsh_acceleration_count = models.PositiveIntegerField(default=0)
+    harsh_braking_count = models.PositiveIntegerField(default=0)
+    finalized = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Where the streaming pass left off
+    last_latitude = models.FloatField(null=True, blank=True)
+    last_longitude = models.FloatField(null=True, blank=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    last_speed = models.FloatField(null=True, blank=True)
+    last_duration = models.FloatField(null=True, blank=True)
+    idle_run_seconds = models.FloatField(default=0.0)
+    harsh_state = models.CharField(max_length=20, blank=True)
+
+    @property
+    def average_speed_kmh(self):
+        if self.moving_seconds:
+            return round(self.tracked_distance_km / self.moving_seconds * 3600, 2)
+        return 0.0
+
+    def stats(self):
+        return analytics.TripStats(**{name: getattr(self, name) for name in analytics.TripStats.FIELDS})
+
+    def apply(self, stats):
+        for name, value in stats.as_dict().items():
+            setattr(self, name, value)
+
+    def rebuild(self):
+        points = self.trip.location_points()
+        stats = analytics.recompute(points)
+        if self.finalized:
+            stats.finalize()
+        self.apply(stats)
+        self.save()
+
+    @classmethod
+    def record(cls, trip, points):
+        # points: the (latitude, longitude, timestamp) just stored, in timestamp order
+        with transaction.atomic():
+            summary, _ = cls.objects.select_for_update().get_or_create(trip=trip)
+            if summary.last_timestamp and points and points[0][2] < summary.last_timestamp:
+                # Late fixes land in the middle of the trip, start over
+                summary.rebuild()
+                return summary
+            stats = summary.stats()
+            stats.add(points)
+            summary.apply(stats)
+            summary.save()
+        return summary
+
+    @classmethod
+    def finalize_trip(cls, trip):
+        with transaction.atomic():
+            summary, _ = cls.objects.select_for_update().get_or_create(trip=trip)
+            if not summary.finalized:
+                stats = summary.stats()
+                stats.finalize()
+                summary.apply(stats)
+                summary.finalized = True
+                summary.save()
+        return summary
+
+    def __str__(self):
+        return f"Summary for trip {self.trip_id}"
+
+class TripLocationArchive(models.Model):
+    # Cold storage for the locations of trips completed long ago, one
+    # compressed blob per trip, see archive.py. month is the first day of the
+    # month the trip ended in, so whole months can be exported or dropped.
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, primary_key=True, related_name='location_archive')
+    month = models.DateField(db_index=True)
+    point_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def locations(self):
+        # Unsaved TripLocation instances, in the order they were archived
+        return [TripLocation(id=pk, trip_id=self.trip_id, latitude=lat, longitude=lng, timestamp=timestamp)
+                for pk, lat, lng, timestamp in archive.unpack_locations(self.data)]
+
+    def __str__(self):
+        return f"Archived locations for trip {self.trip_id}"
+
+class DriverScore(models.Model):
+    # Running totals for a driver's trips in one owner's vehicles, kept
+    # current by the signals in scoring.py and rebuilt by rebuild_driver_scores
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='scores')
+    owner = models.ForeignKey(CarOwner, on_delete=models.CASCADE, related_name='driver_scores')
+    # Completed and cancelled trips
+    finished_trips = models.PositiveIntegerField(default=0)
+    completed_trips = models.PositiveIntegerField(default=0)
+    cancelled_trips = models.PositiveIntegerField(default=0)
+    distance_km = models.FloatField(default=0.0)
+    # From finalized trip summaries, tracked_distance_km is what the events are rated against
+    tracked_distance_km = models.FloatField(default=0.0)
+    harsh_acceleration_count = models.PositiveIntegerField(default=0)
+    harsh_braking_count = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['driver', 'owner'], name='unique_driver_owner_score')]
+        indexes = [models.Index(fields=['owner', 'updated_at'])]
+
+    def __str__(self):
+        return f"Score for {self.driver} with {self.owner}"
+
 class FuelLog(models.Model):
     FUEL_TYPES = (
         ('petrol', 'Petrol'),
@@ -170,6 +396,9 @@ class FuelLog(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['vehicle', 'updated_at'])]
+
     def save(self, *args, **kwargs):
         self.total_cost = self.quantity_liters * self.price_per_liter
         super().save(*args, **kwargs)
@@ -200,6 +429,10 @@ class MaintenanceLog(models.Model):
     total_cost = models.DecimalField(max_digits=10, decimal_places=2)
     created_by = models.ForeignKey(CarOwner, on_delete=models.SET_NULL, null=True)
     mechanic = models.ForeignKey(Mechanic, on_delete=models.SET_NULL, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['vehicle', 'updated_at'])]
 
     def __str__(self):
         return f"{self.vehicle} - {self.service_type} on {self.date.date()}"
@@ -223,6 +456,10 @@ class Insurance(models.Model):
     expiry_date = models.DateField()
     document = models.FileField(upload_to="documents/insurance/", blank=True, null=True)
     created_by = models.ForeignKey(CarOwner, on_delete=models.SET_NULL, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['vehicle', 'updated_at'])]
 
     def clean(self):
         if self.expiry_date <= self.start_date:
@@ -241,6 +478,7 @@ class Inspection(models.Model):
     expiry_date = models.DateField()
     document = models.FileField(upload_to="documents/inspection/", blank=True, null=True)
     created_by = models.ForeignKey(CarOwner, on_delete=models.SET_NULL, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def clean(self):
         if self.expiry_date <= self.inspection_date:
@@ -263,6 +501,7 @@ class License(models.Model):
     expiry_date = models.DateField()
     document = models.FileField(upload_to="documents/licenses/", blank=True, null=True)
     created_by = models.ForeignKey(CarOwner, on_delete=models.SET_NULL, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def clean(self):
         if self.expiry_date <= self.issue_date:
@@ -271,12 +510,148 @@ class License(models.Model):
     def __str__(self):
         return f"{self.license_type} - {self.license_number}"
 
+class VehicleMonthlyCost(models.Model):
+    # Running cost totals per vehicle and calendar month, kept current by the
+    # signals in costs.py and rebuilt by rebuild_cost_buckets
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='monthly_costs')
+    # Copied from the vehicle so owner reports need no join
+    owner = models.ForeignKey(CarOwner, on_delete=models.CASCADE, related_name='monthly_costs')
+    # First day of the month
+    month = models.DateField()
+    fuel_cost = models.FloatField(default=0.0)
+    fuel_log_count = models.IntegerField(default=0)
+    maintenance_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    maintenance_count = models.IntegerField(default=0)
+    parts_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['vehicle', 'month'], name='unique_vehicle_month_cost')]
+        indexes = [models.Index(fields=['owner', 'month'])]
+
+    def __str__(self):
+        return f"{self.vehicle} costs for {self.month:%Y-%m}"
+
+class ComplianceItem(models.Model):
+    # One row per Insurance, Inspection and License, kept in step by the
+    # signals in compliance.py, so fleet-wide expiry windows are one range
+    # read on (owner, expiry_date) instead of three scans
+    KINDS = (
+        ("insurance", "Insurance"),
+        ("inspection", "Inspection"),
+        ("license", "License"),
+    )
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.PositiveBigIntegerField()
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='compliance_items')
+    # Copied from the vehicle so the window query needs no join
+    owner = models.ForeignKey(CarOwner, on_delete=models.CASCADE, related_name='compliance_items')
+    reference = models.CharField(max_length=120)
+    expiry_date = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_compliance_item')]
+        indexes = [
+            models.Index(fields=['owner', 'expiry_date']),
+            models.Index(fields=['vehicle', 'expiry_date']),
+        ]
+
+    def is_expired(self):
+        return self.expiry_date < timezone.now().date()
+
+    def __str__(self):
+        return f"{self.vehicle} {self.kind} {self.reference}"
+
+class StoredDocument(models.Model):
+    # One stored copy per distinct file content, shared by every Insurance,
+    # Inspection and License document that points at it
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to="documents/sha256/")
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+class Geofence(models.Model):
+    owner = models.ForeignKey(CarOwner, on_delete=models.CASCADE, related_name='geofences')
+    name = models.CharField(max_length=100)
+    # [[lat, lng], ...] vertices of a simple polygon, the last edge closes it
+    polygon = models.JSONField()
+    alert_on_enter = models.BooleanField(default=True)
+    alert_on_exit = models.BooleanField(default=True)
+    is_active = models.BooleanField(default=True)
+    # Bounding box, kept in sync with polygon on save
+    min_lat = models.FloatField(editable=False)
+    max_lat = models.FloatField(editable=False)
+    min_lng = models.FloatField(editable=False)
+    max_lng = models.FloatField(editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        if not isinstance(self.polygon, list) or len(self.polygon) < 3:
+            raise ValidationError('A geofence needs at least 3 vertices')
+        for vertex in self.polygon:
+            if not (isinstance(vertex, (list, tuple)) and len(vertex) == 2
+                    and all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in vertex)):
+                raise ValidationError('Vertices must be [latitude, longitude] pairs')
+            lat, lng = vertex
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise ValidationError('Vertex out of range')
+
+    def update_bounds(self):
+        lats = [vertex[0] for vertex in self.polygon]
+        lngs = [vertex[1] for vertex in self.polygon]
+        self.min_lat, self.max_lat = min(lats), max(lats)
+        self.min_lng, self.max_lng = min(lngs), max(lngs)
+
+    def save(self, *args, **kwargs):
+        self.update_bounds()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.owner} - {self.name}"
+
+class Dispatch(models.Model):
+    # A breakdown and the mechanic claimed for it, see dispatch.py. A mechanic
+    # holds at most one assigned dispatch, enforced by the database as well as
+    # by the conditional update on Mechanic.is_available.
+    STATUS_CHOICES = (
+        ('assigned', 'Assigned'),
+        ('completed', 'Completed'),
+        ('cancelled', 'Cancelled'),
+    )
+
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='dispatches')
+    mechanic = models.ForeignKey(Mechanic, on_delete=models.CASCADE, related_name='dispatches')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    speciality = models.CharField(max_length=100, blank=True)
+    description = models.TextField(blank=True)
+    distance_km = models.FloatField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='assigned')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mechanic'], condition=models.Q(status='assigned'),
+                                    name='unique_assigned_dispatch_per_mechanic'),
+        ]
+
+    def __str__(self):
+        return f"Dispatch #{self.id} - {self.mechanic} to {self.vehicle}"
+
 class Reminder(models.Model):
     REMINDER_TYPES = (
         ("INSURANCE", "Insurance"),
         ("INSPECTION", "Inspection"),
         ("LICENSE", "License"),
         ("MAINTENANCE", "Maintenance"),
+        ("GEOFENCE", "Geofence"),
     )
 
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='reminders')
@@ -286,18 +661,61 @@ class Reminder(models.Model):
     reminder_date = models.DateTimeField()
     sent = models.BooleanField(default=False)
     acknowledged = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['reminder_date']
+        indexes = [models.Index(fields=['vehicle', 'updated_at'])]
 
     def __str__(self):
         return f"{self.vehicle} - {self.reminder_type} Reminder"
 
+class SyncTombstone(models.Model):
+    # Deleted records the mobile client still has to drop, see sync.py.
+    # Plain ids rather than foreign keys, the rows they point at are gone.
+    collection = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    owner_id = models.BigIntegerField(null=True)
+    vehicle_id = models.BigIntegerField(null=True)
+    driver_id = models.BigIntegerField(null=True)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner_id', 'deleted_at']),
+            models.Index(fields=['vehicle_id', 'deleted_at']),
+            models.Index(fields=['driver_id', 'deleted_at']),
+            models.Index(fields=['deleted_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.collection} {self.object_id} deleted"
+
+
+class TokenQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(expires__gte=timezone.now())
+
+    def expired(self):
+        return self.filter(expires__lt=timezone.now())
+
+    def get_or_create_active(self, **kwargs):
+        # Expired tokens are never handed out again, the sweeper removes them
+        token = self.active().filter(**kwargs).first()
+        if token:
+            return token, False
+        return self.create(**kwargs), True
+
 
 class BaseToken(models.Model):
     key = models.CharField(max_length=40, primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
-    expires = models.DateTimeField()
+    expires = models.DateTimeField(db_index=True)
+
+    objects = TokenQuerySet.as_manager()
+
+    # Never read from a replica, a token is used right after login creates it
+    read_from_primary = True
 
     class Meta:
         abstract = True
@@ -0,0 +1,223 @@
+import csv
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .imaging import normalize_image
+from .models import Vehicle
+
+# Bulk vehicle import for onboarding a fleet, see import_vehicles.
+#
+# Rows are checked against the vehicle numbers already taken, loaded once
+# per batch rather than queried per row, and written with bulk_create.
+# Photos are decoded, rotated upright and scaled down in a process pool,
+# one batch ahead of the database writes; the worker function lives in
+# imaging.py so the workers never load Django. The import is resumable by
+# being idempotent: rows already imported for the owner are skipped, and
+# stored photos are named by their content, so a rerun after a crash or a
+# fix to rejected rows picks up where the last one stopped.
+
+REQUIRED_COLUMNS = ('vehicle_number', 'model', 'manufacturer', 'year_of_manufacture')
+VEHICLE_TYPES = {value for value, _label in Vehicle.VEHICLE_TYPES}
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f'Missing columns: {", ".join(missing)}')
+        # Line numbers as a spreadsheet shows them, after the header
+        return [(line, row) for line, row in enumerate(reader, start=2)]
+
+
+def clean_row(row):
+    # (vehicle field values, image path or ''), raises ValueError with the reason
+    values = {name: (row.get(name) or '').strip() for name in (*REQUIRED_COLUMNS, 'vehicle_type', 'current_odometer')}
+    for name in REQUIRED_COLUMNS:
+        if not values[name]:
+            raise ValueError(f'{name} is required')
+    if len(values['vehicle_number']) > Vehicle._meta.get_field('vehicle_number').max_length:
+        raise ValueError('vehicle_number is too long')
+
+    try:
+        year = int(values['year_of_manufacture'])
+    except ValueError:
+        raise ValueError('year_of_manufacture must be a whole number') from None
+    # Same bounds as Vehicle.clean
+    if year < 1900 or year > timezone.now().year + 1:
+        raise ValueError('Invalid year of manufacture')
+
+    vehicle_type = values['vehicle_type'].lower() or 'car'
+    if vehicle_type not in VEHICLE_TYPES:
+        raise ValueError(f'vehicle_type must be one of {", ".join(sorted(VEHICLE_TYPES))}')
+    try:
+        odometer = int(values['current_odometer'] or 0)
+    except ValueError:
+        raise ValueError('current_odometer must be a whole number') from None
+    if odometer < 0:
+        raise ValueError('current_odometer cannot be negative')
+
+    return {
+        'vehicle_number': values['vehicle_number'],
+        'model': values['model'],
+        'manufacturer': values['manufacturer'],
+        'vehicle_type': vehicle_type,
+        'year_of_manufacture': year,
+        'current_odometer': odometer,
+    }, (row.get('image') or '').strip()
+
+
+def store_image(data):
+    # Named by content, a rerun finds the file it stored before
+    name = f'vehicle_images/import/{hashlib.sha1(data).hexdigest()}.jpg'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+class Batch:
+
+    def __init__(self, size):
+        # size: raw rows read, rows: the valid ones as [(line, vehicle values, image path)],
+        # skipped: rows an earlier run imported. Counted when the batch is written.
+        self.size = size
+        self.rows = []
+        self.skipped = 0
+        self.rejects = []
+        self.images = {}
+
+    def reject(self, line, row, reason):
+        self.rejects.append({'line': line, 'vehicle_number': row.get('vehicle_number', ''), 'reason': reason})
+
+
+class Importer:
+    # import_rows() drives this. progress(report) is called after every
+    # batch with the running totals.
+
+    def __init__(self, owner, images_dir='', workers=None, batch_size=None, dry_run=False, progress=None):
+        self.owner = owner
+        self.images_dir = images_dir
+        self.workers = workers or settings.VEHICLE_IMPORT_WORKERS or os.cpu_count() or 1
+        self.batch_size = batch_size or settings.VEHICLE_IMPORT_BATCH_SIZE
+        self.dry_run = dry_run
+        self.progress = progress
+        self.seen = set()
+        self.report = {'rows': 0, 'created': 0, 'skipped': 0, 'rejected': 0}
+        self.rejects = []
+
+    def _taken(self, vehicle_numbers):
+        # {vehicle number: owner id} for the ones already registered
+        return dict(Vehicle.objects.filter(vehicle_number__in=list(vehicle_numbers))
+                    .values_list('vehicle_number', 'owner_id'))
+
+    def _validated(self, rows):
+        # Checks one batch of raw rows against each other and the database
+        batch = Batch(len(rows))
+        cleaned = []
+        for line, row in rows:
+            try:
+                values, image = clean_row(row)
+            except ValueError as e:
+                batch.reject(line, row, str(e))
+                continue
+            if values['vehicle_number'] in self.seen:
+                batch.reject(line, row, 'vehicle_number appears earlier in the file')
+                continue
+            self.seen.add(values['vehicle_number'])
+            cleaned.append((line, values, image))
+
+        taken = self._taken(values['vehicle_number'] for _line, values, _image in cleaned)
+        for line, values, image in cleaned:
+            owner_id = taken.get(values['vehicle_number'])
+            if owner_id == self.owner.pk:
+                # Imported by an earlier run
+                batch.skipped += 1
+            elif owner_id is not None:
+                batch.reject(line, values, 'vehicle_number is already registered')
+            else:
+                batch.rows.append((line, values, os.path.join(self.images_dir, image) if image else ''))
+        return batch
+
+    def _submit(self, pool, batch):
+        for line, _values, path in batch.rows:
+            if path:
+                batch.images[line] = pool.submit(normalize_image, path, settings.VEHICLE_IMPORT_IMAGE_MAX_SIZE,
+                                                 settings.VEHICLE_IMPORT_IMAGE_QUALITY)
+
+    def _write(self, batch):
+        vehicles = []
+        for line, values, _path in batch.rows:
+            image = None
+            if line in batch.images:
+                data, error = batch.images[line].result()
+                if error:
+                    batch.reject(line, values, error)
+                    continue
+                if not self.dry_run:
+                    image = store_image(data)
+            vehicles.append((line, Vehicle(owner=self.owner, image=image, **values)))
+        if not self.dry_run:
+            vehicles = self._create(batch, vehicles)
+        self.report['created'] += len(vehicles)
+
+    def _create(self, batch, vehicles):
+        # A vehicle number registered by someone else after _validated
+        # checked it fails the whole insert. The batch is checked again and
+        # written without the numbers now taken. Returns what was created.
+        while vehicles:
+            try:
+                with transaction.atomic():
+                    Vehicle.objects.bulk_create([vehicle for _line, vehicle in vehicles], batch_size=self.batch_size)
+                return vehicles
+            except IntegrityError:
+                taken = self._taken(vehicle.vehicle_number for _line, vehicle in vehicles)
+                if not taken:
+                    raise
+            remaining = []
+            for line, vehicle in vehicles:
+                owner_id = taken.get(vehicle.vehicle_number)
+                if owner_id == self.owner.pk:
+                    # Another run of the same import got there first
+                    batch.skipped += 1
+                elif owner_id is not None:
+                    batch.reject(line, {'vehicle_number': vehicle.vehicle_number},
+                                 'vehicle_number is already registered')
+                else:
+                    remaining.append((line, vehicle))
+            vehicles = remaining
+        return vehicles
+
+    def run(self, rows):
+        chunks = [rows[start:start + self.batch_size] for start in range(0, len(rows), self.batch_size)]
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # The pool decodes the next batch's photos while this one is written
+            pending = None
+            for chunk in [*chunks, None]:
+                batch = None
+                if chunk is not None:
+                    batch = self._validated(chunk)
+                    self._submit(pool, batch)
+                if pending is not None:
+                    self._write(pending)
+                    self.report['rows'] += pending.size
+                    self.report['skipped'] += pending.skipped
+                    self.report['rejected'] += len(pending.rejects)
+                    self.rejects.extend(pending.rejects)
+                    if self.progress:
+                        self.progress(dict(self.report))
+                pending = batch
+        return self.report
+
+
+def import_rows(owner, rows, **options):
+    # rows: [(line number, {column: value})]. Returns (report, rejects).
+    importer = Importer(owner, **options)
+    importer.run(rows)
+    return importer.report, importer.rejects
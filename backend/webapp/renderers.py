@@ -0,0 +1,105 @@
+import decimal
+import math
+import re
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# U+2028 and U+2029 in UTF-8, escaped by DRF so output stays a javascript subset
+LINE_SEPARATOR = b'\xe2\x80\xa8'
+PARAGRAPH_SEPARATOR = b'\xe2\x80\xa9'
+
+
+# Where orjson and the stdlib print the same float differently: orjson
+# writes exponents as 1e16 and 1.5e-7 where json writes 1e+16 and 1.5e-07,
+# and 0.00001 where json writes 1e-05. Checked on the encoded bytes, as
+# values and as float dict keys; a match inside a string only costs a
+# fallback.
+STDLIB_FLOAT_FORMS = re.compile(
+    rb'(?:^|[:,\[])-?(?:0\.0000|[0-9]+(?:\.[0-9]+)?e)'
+    rb'|[{,]"-?(?:0\.0000[0-9]*|[0-9]+(?:\.[0-9]+)?e[-0-9]+)":'
+)
+# Starts with a literal, so it scans at memchr speed where the pattern
+# above steps through every byte
+EXPONENT_HINT = re.compile(rb'e(?<=[0-9]e)[-0-9]')
+
+
+def _stdlib_float_forms(encoded):
+    if b'0.0000' not in encoded and EXPONENT_HINT.search(encoded) is None:
+        return False
+    return STDLIB_FLOAT_FORMS.search(encoded) is not None
+
+
+class FastJSONRenderer(JSONRenderer):
+    # Drop-in for DRF's JSONRenderer that encodes with orjson when it is
+    # installed, falling back to the stdlib path for anything it would
+    # render differently. Datetimes are formatted by orjson, OPT_UTC_Z gives
+    # DRF's 'Z' for UTC and both keep microseconds only when non-zero.
+    #
+    # orjson writes float NaN and Infinity as null where DRF's strict
+    # encoder raises; SQLite stores them as NULL, so only computed values
+    # can carry them. Decimals are still checked.
+
+    OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def __init__(self):
+        super().__init__()
+        self._encoder = self.encoder_class()
+
+    def _default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            value = float(obj)
+            if math.isfinite(value):
+                return value
+            raise TypeError('Decimal is not a finite float')
+        return self._encoder.default(obj)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self._default, option=self.OPTIONS)
+        except TypeError:
+            # Integers wider than 64 bits, aware times, ...
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if _stdlib_float_forms(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if LINE_SEPARATOR in ret or PARAGRAPH_SEPARATOR in ret:
+            ret = ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return ret
+
+
+# Trip track encodings, see tracks.py. Selected with the Accept header or
+# ?format=polyline / ?format=track
+
+class TrackPolylineRenderer(FastJSONRenderer):
+    media_type = 'application/vnd.evehicle.track+json'
+    format = 'polyline'
+
+
+class TrackBinaryRenderer(BaseRenderer):
+    media_type = 'application/vnd.evehicle.track'
+    format = 'track'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        # Error responses, 404 and the like, stay readable and say they are
+        # JSON, so clients expecting a frame do not try to parse one
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = FastJSONRenderer.media_type
+        return FastJSONRenderer().render(data)
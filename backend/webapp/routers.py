@@ -0,0 +1,74 @@
+import hashlib
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Read replica routing.
+#
+# Reads go to a replica only inside a request that ReplicaRoutingMiddleware
+# marked as eligible: a GET, HEAD or OPTIONS from a principal that has not
+# written in the last REPLICA_STICKY_SECONDS. Everything else, including
+# management commands and background work, reads from the primary. The
+# first write inside an eligible request moves its remaining reads back to
+# the primary too.
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_routing = ContextVar('replica_routing', default=None)
+
+
+def principal_key(request):
+    # Bearer token, or session cookie for the admin, before authentication has run
+    credential = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credential:
+        return None
+    return 'replica-pin:' + hashlib.sha256(credential.encode()).hexdigest()[:32]
+
+
+def is_pinned(principal):
+    return principal is not None and cache.get(principal) is not None
+
+
+def pin(principal):
+    cache.set(principal, time.time(), settings.REPLICA_STICKY_SECONDS)
+
+
+def begin(use_replica):
+    return _routing.set({'replica': use_replica, 'alias': None, 'wrote': False})
+
+
+def end(token):
+    state = _routing.get()
+    _routing.reset(token)
+    return state['wrote']
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or not state['replica'] or getattr(model, 'read_from_primary', False):
+            return 'default'
+        # One replica per request, so its reads see a single consistent snapshot
+        if state['alias'] is None:
+            state['alias'] = random.choice(settings.DATABASE_REPLICAS)
+        return state['alias']
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state['replica'] = False
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
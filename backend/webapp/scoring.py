@@ -0,0 +1,369 @@
+import threading
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import DriverScore, Trip, TripSummary, Vehicle, deleted_with_vehicle
+
+try:
+    from sortedcontainers import SortedKeyList
+except ImportError:
+    SortedKeyList = None
+
+# Driver scores and per owner leaderboards.
+#
+# A DriverScore row holds the totals for one driver's trips in one owner's
+# vehicles. The receivers below add a trip when it completes or is
+# cancelled, and its harsh driving events when its summary is finalized,
+# taking out the old contribution first when either changes, so no score is
+# ever recomputed from the whole history.
+#
+# Each process keeps every owner's leaderboard as a sorted list. A cheap
+# version query on each read picks up rows changed by other processes, so
+# a page of the ranking is a slice of the list instead of a sorted query.
+
+TERMINAL_STATUSES = ('completed', 'cancelled')
+
+TOTAL_FIELDS = (
+    'finished_trips', 'completed_trips', 'cancelled_trips', 'distance_km',
+    'tracked_distance_km', 'harsh_acceleration_count', 'harsh_braking_count',
+)
+
+# Leaderboard rows, read together with each score
+ROW_FIELDS = ('driver_id', 'driver__username', 'score', 'completed_trips', 'distance_km', 'updated_at')
+
+# owner id: Leaderboard
+_boards = {}
+_lock = threading.Lock()
+
+
+def compute_score(totals):
+    # 0 to 100: safety from harsh events per 100 tracked km, reliability from
+    # the share of finished trips completed, experience from distance driven
+    if not totals['finished_trips']:
+        return 0.0
+    events = totals['harsh_acceleration_count'] + totals['harsh_braking_count']
+    tracked = totals['tracked_distance_km']
+    per_100_km = events * 100 / tracked if tracked else 0.0
+    safety = max(0.0, 1 - per_100_km / settings.DRIVER_SCORE_MAX_EVENTS_PER_100_KM)
+    reliability = totals['completed_trips'] / totals['finished_trips']
+    experience = min(1.0, totals['distance_km'] / settings.DRIVER_SCORE_DISTANCE_TARGET_KM)
+    return round(100 * (settings.DRIVER_SCORE_SAFETY_WEIGHT * safety
+                        + settings.DRIVER_SCORE_RELIABILITY_WEIGHT * reliability
+                        + settings.DRIVER_SCORE_EXPERIENCE_WEIGHT * experience), 2)
+
+
+def _trip_contribution(driver_id, owner_id, status, distance_km):
+    if status not in TERMINAL_STATUSES:
+        return None
+    completed = status == 'completed'
+    return (driver_id, owner_id), {
+        'finished_trips': 1,
+        'completed_trips': int(completed),
+        'cancelled_trips': int(not completed),
+        'distance_km': distance_km if completed else 0.0,
+    }
+
+
+def _summary_contribution(driver_id, owner_id, finalized, tracked_distance_km, accelerations, brakings):
+    if not finalized:
+        return None
+    return (driver_id, owner_id), {
+        'tracked_distance_km': tracked_distance_km,
+        'harsh_acceleration_count': accelerations,
+        'harsh_braking_count': brakings,
+    }
+
+
+def _stored_trip(pk):
+    row = Trip.objects.filter(pk=pk).values_list('driver_id', 'vehicle__owner_id', 'status', 'distance_km').first()
+    return _trip_contribution(*row) if row else None
+
+
+def _stored_summary(pk):
+    row = TripSummary.objects.filter(pk=pk).values_list(
+        'trip__driver_id', 'trip__vehicle__owner_id', 'finalized', 'tracked_distance_km',
+        'harsh_acceleration_count', 'harsh_braking_count').first()
+    return _summary_contribution(*row) if row else None
+
+
+def apply(driver_id, owner_id, deltas, create=True):
+    deltas = {name: value for name, value in deltas.items() if value}
+    if not deltas:
+        return
+    with transaction.atomic():
+        scores = DriverScore.objects.select_for_update()
+        if create:
+            row, _ = scores.get_or_create(driver_id=driver_id, owner_id=owner_id)
+        else:
+            # Nothing to take away from a missing row, it went with its driver or owner
+            row = scores.filter(driver_id=driver_id, owner_id=owner_id).first()
+            if row is None:
+                return
+        for name, value in deltas.items():
+            setattr(row, name, max(0, getattr(row, name) + value))
+        row.score = compute_score({name: getattr(row, name) for name in TOTAL_FIELDS})
+        row.save()
+
+
+def _move(before, after):
+    if before is not None and after is not None and before[0] == after[0]:
+        apply(*after[0], {name: after[1][name] - before[1][name] for name in after[1]})
+        return
+    if before is not None:
+        apply(*before[0], {name: -value for name, value in before[1].items()}, create=False)
+    if after is not None:
+        apply(*after[0], after[1])
+
+
+def totals(drivers=None, owners=None):
+    # {(driver_id, owner_id): {field: total}} computed from trips and summaries
+    trips = Trip.objects.filter(status__in=TERMINAL_STATUSES)
+    summaries = TripSummary.objects.filter(finalized=True)
+    if drivers is not None:
+        trips = trips.filter(driver_id__in=drivers)
+        summaries = summaries.filter(trip__driver_id__in=drivers)
+    if owners is not None:
+        trips = trips.filter(vehicle__owner_id__in=owners)
+        summaries = summaries.filter(trip__vehicle__owner_id__in=owners)
+
+    result = {}
+    completed = Q(status='completed')
+    for row in trips.values('driver', 'vehicle__owner').order_by().annotate(
+            finished_trips=Count('pk'),
+            completed_trips=Count('pk', filter=completed),
+            cancelled_trips=Count('pk', filter=Q(status='cancelled')),
+            distance_km=Sum('distance_km', filter=completed)):
+        key = (row.pop('driver'), row.pop('vehicle__owner'))
+        result[key] = dict.fromkeys(TOTAL_FIELDS, 0) | {name: value or 0 for name, value in row.items()}
+    for row in summaries.values('trip__driver', 'trip__vehicle__owner').order_by().annotate(
+            tracked=Sum('tracked_distance_km'),
+            accelerations=Sum('harsh_acceleration_count'),
+            brakings=Sum('harsh_braking_count')):
+        entry = result.setdefault((row['trip__driver'], row['trip__vehicle__owner']), dict.fromkeys(TOTAL_FIELDS, 0))
+        entry.update(tracked_distance_km=row['tracked'] or 0.0, harsh_acceleration_count=row['accelerations'] or 0,
+                     harsh_braking_count=row['brakings'] or 0)
+    return result
+
+
+def rescore(pairs):
+    # Replaces the rows for these (driver_id, owner_id) pairs with totals from history
+    pairs = set(pairs)
+    if not pairs:
+        return
+    computed = totals(drivers={driver for driver, _owner in pairs}, owners={owner for _driver, owner in pairs})
+    with transaction.atomic():
+        for driver_id, owner_id in pairs:
+            values = computed.get((driver_id, owner_id))
+            if values is None:
+                DriverScore.objects.filter(driver_id=driver_id, owner_id=owner_id).delete()
+                continue
+            DriverScore.objects.update_or_create(
+                driver_id=driver_id, owner_id=owner_id, defaults={**values, 'score': compute_score(values)})
+
+
+class _SortedRows:
+    # The part of SortedKeyList used here, for when sortedcontainers is missing.
+    # Inserts and removals shift the list, which is fine for thousands of rows.
+
+    def __init__(self, rows, key):
+        self._key = key
+        self._rows = sorted(rows, key=key)
+
+    def add(self, row):
+        insort(self._rows, row, key=self._key)
+
+    def remove(self, row):
+        del self._rows[self.index(row)]
+
+    def index(self, row):
+        position = bisect_left(self._rows, self._key(row), key=self._key)
+        if position == len(self._rows) or self._rows[position] != row:
+            raise ValueError(f'{row!r} is not in list')
+        return position
+
+    def __getitem__(self, index):
+        return self._rows[index]
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def _rank_key(row):
+    return (-row['score'], row['driver_id'])
+
+
+class Leaderboard:
+
+    def __init__(self, rows, version):
+        self.by_driver = {row['driver_id']: row for row in rows}
+        rows = list(self.by_driver.values())
+        self.rows = SortedKeyList(rows, key=_rank_key) if SortedKeyList is not None else _SortedRows(rows, _rank_key)
+        self.version = version
+
+    def update(self, rows):
+        for row in rows:
+            previous = self.by_driver.pop(row['driver_id'], None)
+            if previous is not None:
+                self.rows.remove(previous)
+            self.by_driver[row['driver_id']] = row
+            self.rows.add(row)
+
+    def page(self, offset, limit):
+        return [{'rank': offset + position + 1, **row}
+                for position, row in enumerate(self.rows[offset:offset + limit])]
+
+    def rank(self, driver_id):
+        row = self.by_driver.get(driver_id)
+        return self.rows.index(row) + 1 if row is not None else None
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _rows(queryset):
+    return [
+        {'driver_id': driver_id, 'username': username, 'score': score,
+         'completed_trips': completed_trips, 'distance_km': round(distance_km, 2), 'updated_at': updated_at}
+        for driver_id, username, score, completed_trips, distance_km, updated_at in queryset.values_list(*ROW_FIELDS)
+    ]
+
+
+def _board(owner_id, version):
+    # Rows changed since the cached version are read and moved into place, a
+    # board that lost rows is reloaded. The overlap covers rows committed
+    # after one with a later timestamp. Queries run with _lock released, so
+    # one owner's refresh never holds up reads of another's board; under it
+    # rows are only moved onto the board they were read against.
+    with _lock:
+        board = _boards.get(owner_id)
+        if board is not None and board.version == version:
+            return board
+        seen = board.version if board is not None else None
+        incremental = seen is not None and seen[0] is not None and version[1] >= len(board)
+    scores = DriverScore.objects.filter(owner_id=owner_id)
+    if incremental:
+        overlap = timedelta(seconds=settings.LEADERBOARD_REFRESH_OVERLAP_SECONDS)
+        rows = _rows(scores.filter(updated_at__gte=seen[0] - overlap))
+        with _lock:
+            current = _boards.get(owner_id)
+            if current is not None and current.version == version:
+                # Refreshed by another thread in the meantime
+                return current
+            if current is board and board.version == seen:
+                board.update(rows)
+                if len(board) == version[1]:
+                    board.version = version
+                    return board
+    board = Leaderboard(_rows(scores), version)
+    with _lock:
+        _boards[owner_id] = board
+    return board
+
+
+def _version(owner_id):
+    # One indexed aggregate query, which also catches writes by other processes
+    return tuple(DriverScore.objects.filter(owner_id=owner_id).aggregate(Max('updated_at'), Count('id')).values())
+
+
+def ranking(owner_id, offset, limit):
+    # (number of ranked drivers, one page of rows with their rank)
+    board = _board(owner_id, _version(owner_id))
+    with _lock:
+        return len(board), board.page(offset, limit)
+
+
+def ranks(owner_id, driver_ids):
+    # (number of ranked drivers, {driver id: rank or None})
+    board = _board(owner_id, _version(owner_id))
+    with _lock:
+        return len(board), {driver_id: board.rank(driver_id) for driver_id in driver_ids}
+
+
+@receiver(pre_save, sender=Trip)
+def remember_trip(sender, instance, **kwargs):
+    instance._score_before = _stored_trip(instance.pk) if instance.pk is not None else None
+
+
+@receiver(post_save, sender=Trip)
+def score_trip(sender, instance, **kwargs):
+    before = getattr(instance, '_score_before', None)
+    after = None
+    if instance.status in TERMINAL_STATUSES:
+        owner_id = Vehicle.objects.filter(pk=instance.vehicle_id).values_list('owner_id', flat=True).first()
+        after = _trip_contribution(instance.driver_id, owner_id, instance.status, instance.distance_km)
+    _move(before, after)
+
+
+@receiver(pre_save, sender=TripSummary)
+def remember_summary(sender, instance, **kwargs):
+    # Summaries are saved with every batch of locations, only finalized
+    # ones count and a summary never goes back to unfinalized
+    instance._score_before = _stored_summary(instance.pk) if instance.finalized else None
+
+
+@receiver(post_save, sender=TripSummary)
+def score_summary(sender, instance, **kwargs):
+    if not instance.finalized:
+        return
+    driver_id, owner_id = Trip.objects.filter(pk=instance.trip_id).values_list(
+        'driver_id', 'vehicle__owner_id').get()
+    after = _summary_contribution(driver_id, owner_id, True, instance.tracked_distance_km,
+                                  instance.harsh_acceleration_count, instance.harsh_braking_count)
+    _move(getattr(instance, '_score_before', None), after)
+
+
+@receiver(pre_delete, sender=Trip)
+def remember_deleted_trip(sender, instance, origin=None, **kwargs):
+    # A vehicle's trips are rescored together once it is gone, see unscore_vehicle
+    instance._score_before = None if deleted_with_vehicle(origin) else _stored_trip(instance.pk)
+
+
+@receiver(pre_delete, sender=TripSummary)
+def remember_deleted_summary(sender, instance, origin=None, **kwargs):
+    # Read while the summary's trip still exists
+    instance._score_before = None if deleted_with_vehicle(origin) else _stored_summary(instance.pk)
+
+
+@receiver(post_delete, sender=Trip)
+@receiver(post_delete, sender=TripSummary)
+def unscore(sender, instance, **kwargs):
+    _move(getattr(instance, '_score_before', None), None)
+
+
+@receiver(pre_delete, sender=Vehicle)
+def remember_vehicle_drivers(sender, instance, **kwargs):
+    instance._score_drivers = set(Trip.objects.filter(vehicle=instance, status__in=TERMINAL_STATUSES)
+                                  .values_list('driver_id', flat=True).distinct())
+
+
+@receiver(post_delete, sender=Vehicle)
+def unscore_vehicle(sender, instance, **kwargs):
+    # After its trips are deleted, the scores they counted towards are
+    # recomputed from what is left rather than taken apart trip by trip
+    rescore((driver, instance.owner_id) for driver in getattr(instance, '_score_drivers', ()))
+
+
+@receiver(pre_save, sender=Vehicle)
+def remember_vehicle_owner(sender, instance, update_fields=None, **kwargs):
+    # Saves that leave the owner alone, odometer updates and the like, skip the read
+    if instance.pk is None or (update_fields is not None and 'owner' not in update_fields):
+        instance._score_owner = None
+        return
+    instance._score_owner = Vehicle.objects.filter(pk=instance.pk).values_list('owner_id', flat=True).first()
+
+
+@receiver(post_save, sender=Vehicle)
+def follow_vehicle_owner(sender, instance, created, **kwargs):
+    # The vehicle's trips now count for the new owner, both owners' scores
+    # for its drivers are recomputed from their trips
+    previous = getattr(instance, '_score_owner', None)
+    if created or previous is None or previous == instance.owner_id:
+        return
+    drivers = set(Trip.objects.filter(vehicle=instance).values_list('driver_id', flat=True).distinct())
+    rescore((driver, owner) for driver in drivers for owner in (previous, instance.owner_id))
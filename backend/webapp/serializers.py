@@ -4,19 +4,48 @@ from django.contrib.auth.models import User
 from .models import (
     Driver, Mechanic, CarOwner, Vehicle, Trip, TripLocation,
     FuelLog, ServiceType, MaintenanceLog, PartReplacement,
-    Insurance, Inspection, License, Reminder
+    Insurance, Inspection, License, Reminder, Geofence, ComplianceItem, Dispatch
 )
+from datetime import datetime
+from django.conf import settings
 from django.utils import timezone
 from math import radians, sin, cos, sqrt, atan2
+from . import hashing, thumbnails
+from .fieldsets import SparseFieldsMixin
+from .documents import DOCUMENT_EXTENSIONS, MAX_DOCUMENT_SIZE
 
 # User Serializer
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
         extra_kwargs = {'password': {'write_only': True}}
 
+def create_user(user_data, password):
+    # Hash on the shared pool before touching the database
+    encoded_password = hashing.make_password(password)
+    
+    user = User(
+        username=User.normalize_username(user_data.get('username')),
+        email=User.objects.normalize_email(user_data.get('email')),
+        first_name=user_data.get('first_name', ''),
+        last_name=user_data.get('last_name', '')
+    )
+    user.password = encoded_password
+    user.save()
+    return user
+
 # Registration Serializers
+def _unassigned_vehicle(vehicle, driver=None):
+    # The unique_driver_per_vehicle constraint checked up front, for a clear error
+    if vehicle is not None:
+        others = Driver.objects.filter(vehicle=vehicle)
+        if driver is not None:
+            others = others.exclude(pk=driver.pk)
+        if others.exists():
+            raise serializers.ValidationError('This vehicle is already assigned to another driver')
+    return vehicle
+
 class DriverRegistrationSerializer(serializers.ModelSerializer):
     user = UserSerializer(write_only=True)
     password = serializers.CharField(write_only=True)
@@ -26,17 +55,14 @@ class DriverRegistrationSerializer(serializers.ModelSerializer):
         fields = ['user', 'password', 'username', 'email', 'phone_number', 
                  'licence_number', 'vehicle', 'is_available']
     
+    def validate_vehicle(self, value):
+        return _unassigned_vehicle(value)
+    
     def create(self, validated_data):
         user_data = validated_data.pop('user')
         password = validated_data.pop('password')
         
-        user = User.objects.create_user(
-            username=user_data.get('username'),
-            email=user_data.get('email'),
-            password=password,
-            first_name=user_data.get('first_name', ''),
-            last_name=user_data.get('last_name', '')
-        )
+        user = create_user(user_data, password)
         
         driver = Driver.objects.create(user=user, **validated_data)
         return driver
@@ -54,13 +80,7 @@ class MechanicRegistrationSerializer(serializers.ModelSerializer):
         user_data = validated_data.pop('user')
         password = validated_data.pop('password')
         
-        user = User.objects.create_user(
-            username=user_data.get('username'),
-            email=user_data.get('email'),
-            password=password,
-            first_name=user_data.get('first_name', ''),
-            last_name=user_data.get('last_name', '')
-        )
+        user = create_user(user_data, password)
         
         mechanic = Mechanic.objects.create(user=user, **validated_data)
         return mechanic
@@ -77,22 +97,20 @@ class CarOwnerRegistrationSerializer(serializers.ModelSerializer):
         user_data = validated_data.pop('user')
         password = validated_data.pop('password')
         
-        user = User.objects.create_user(
-            username=user_data.get('username'),
-            email=user_data.get('email'),
-            password=password,
-            first_name=user_data.get('first_name', ''),
-            last_name=user_data.get('last_name', '')
-        )
+        user = create_user(user_data, password)
         
         car_owner = CarOwner.objects.create(user=user, **validated_data)
         return car_owner
 
 # Main Model Serializers
-class DriverSerializer(serializers.ModelSerializer):
+class DriverSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     vehicle_details = serializers.SerializerMethodField()
     
+    method_field_sources = {
+        'vehicle_details': ('vehicle__id', 'vehicle__vehicle_number', 'vehicle__model', 'vehicle__manufacturer'),
+    }
+    
     class Meta:
         model = Driver
         fields = ['id', 'user', 'username', 'email', 'phone_number', 'licence_number',
@@ -109,7 +127,7 @@ class DriverSerializer(serializers.ModelSerializer):
             }
         return None
 
-class MechanicSerializer(serializers.ModelSerializer):
+class MechanicSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     
     class Meta:
@@ -134,7 +152,7 @@ class MechanicLoginSerializer(serializers.Serializer):
                 'email': 'No mechanic found with this email address'
             })
         
-        if not mechanic.check_password(password):
+        if not hashing.check_password(mechanic.user, password):
             raise serializers.ValidationError({
                 'password': 'Invalid password'
             })
@@ -156,7 +174,7 @@ class DriverLoginSerializer(serializers.Serializer):
                 'email': 'No driver found with this email address'
             })
         
-        if not driver.check_password(password):
+        if not hashing.check_password(driver.user, password):
             raise serializers.ValidationError({
                 'password': 'Invalid password'
             })
@@ -178,7 +196,7 @@ class ChangePasswordSerializer(serializers.Serializer):
     
     def validate_current_password(self, value):
         user = self.context['request'].user
-        if not user.check_password(value):
+        if not hashing.check_password(user.user, value):
             raise serializers.ValidationError('Current password is incorrect')
         return value
         
@@ -197,7 +215,7 @@ class CarOwnerLoginSerializer(serializers.Serializer):
                 'email': 'No car owner found with this email address'
             })
         
-        if not car_owner.check_password(password):
+        if not hashing.check_password(car_owner.user, password):
             raise serializers.ValidationError({
                 'password': 'Invalid password'
             })
@@ -210,6 +228,9 @@ class DriverProfileSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'phone_number', 'licence_number', 
                  'vehicle', 'is_available', 'created_at']
         read_only_fields = ['id', 'created_at']
+    
+    def validate_vehicle(self, value):
+        return _unassigned_vehicle(value, self.instance)
 
 class CarOwnerProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -221,12 +242,14 @@ class MechanicProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = Mechanic
         fields = ['id', 'username', 'email', 'phone_number', 'speciality', 
-                 'location', 'is_available', 'created_at']
+                 'location', 'latitude', 'longitude', 'is_available', 'created_at']
         read_only_fields = ['id', 'created_at']      
-class CarOwnerSerializer(serializers.ModelSerializer):
+class CarOwnerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     vehicles_count = serializers.SerializerMethodField()
     
+    method_field_sources = {'vehicles_count': ()}
+    
     class Meta:
         model = CarOwner
         fields = ['id', 'user', 'username', 'email', 'phone_number', 'address',
@@ -234,17 +257,26 @@ class CarOwnerSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
     
     def get_vehicles_count(self, obj):
+        # Annotated up front by the vehicle dashboard
+        if hasattr(obj, 'vehicles_total'):
+            return obj.vehicles_total
         return obj.vehicles.count()
 
-class VehicleListSerializer(serializers.ModelSerializer):
+class VehicleListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     owner_name = serializers.CharField(source='owner.username', read_only=True)
     assigned_driver = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
+    
+    method_field_sources = {'assigned_driver': (), 'image_variants': ('id', 'image')}
     
     class Meta:
         model = Vehicle
         fields = ['id', 'vehicle_number', 'model', 'manufacturer', 'vehicle_type',
                  'year_of_manufacture', 'owner', 'owner_name', 'assigned_driver',
-                 'current_odometer', 'image', 'created_at']
+                 'current_odometer', 'image', 'image_variants', 'created_at']
+    
+    def get_image_variants(self, obj):
+        return thumbnails.variant_urls(obj, self.context.get('request'))
     
     def get_assigned_driver(self, obj):
         driver = obj.assigned_driver.first()
@@ -256,28 +288,50 @@ class VehicleListSerializer(serializers.ModelSerializer):
             }
         return None
 
-class VehicleDetailSerializer(serializers.ModelSerializer):
+class VehicleDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     owner_details = CarOwnerSerializer(source='owner', read_only=True)
-    assigned_driver = DriverSerializer(read_only=True)
+    assigned_driver = serializers.SerializerMethodField()
     maintenance_logs_count = serializers.SerializerMethodField()
     fuel_logs_count = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
+    
+    method_field_sources = {
+        'assigned_driver': ('assigned_driver',),
+        'maintenance_logs_count': (),
+        'fuel_logs_count': (),
+        'image_variants': ('id', 'image'),
+    }
     
     class Meta:
         model = Vehicle
         fields = ['id', 'vehicle_number', 'model', 'manufacturer', 'vehicle_type',
-                 'year_of_manufacture', 'current_odometer', 'image',
+                 'year_of_manufacture', 'current_odometer', 'image', 'image_variants',
                  'owner', 'owner_details', 'assigned_driver',
                  'maintenance_logs_count', 'fuel_logs_count',
                  'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
     
+    def get_assigned_driver(self, obj):
+        # all() so a prefetched driver is used
+        drivers = obj.assigned_driver.all()
+        if drivers:
+            return DriverSerializer(drivers[0]).data
+        return None
+    
     def get_maintenance_logs_count(self, obj):
+        if hasattr(obj, 'maintenance_logs_total'):
+            return obj.maintenance_logs_total
         return obj.maintenance_logs.count()
     
     def get_fuel_logs_count(self, obj):
+        if hasattr(obj, 'fuel_logs_total'):
+            return obj.fuel_logs_total
         return obj.fuel_logs.count()
+    
+    def get_image_variants(self, obj):
+        return thumbnails.variant_urls(obj, self.context.get('request'))
 
-class TripLocationSerializer(serializers.ModelSerializer):
+class TripLocationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = TripLocation
         fields = ['id', 'latitude', 'longitude', 'timestamp']
@@ -299,12 +353,18 @@ class TripListSerializer(serializers.ModelSerializer):
             return str(duration)
         return None
 
-class TripDetailSerializer(serializers.ModelSerializer):
+class TripDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     driver_details = DriverSerializer(source='driver', read_only=True)
     vehicle_details = VehicleListSerializer(source='vehicle', read_only=True)
-    locations = TripLocationSerializer(many=True, read_only=True)
+    # Live rows come from the prefetch, archived ones from TripLocationArchive
+    locations = TripLocationSerializer(source='all_locations', many=True, read_only=True)
     duration = serializers.SerializerMethodField()
     
+    method_field_sources = {
+        'locations': ('locations', 'locations_archived'),
+        'duration': ('started_at', 'ended_at'),
+    }
+    
     class Meta:
         model = Trip
         fields = ['id', 'driver', 'driver_details', 'vehicle', 'vehicle_details',
@@ -352,7 +412,7 @@ class TripCreateSerializer(serializers.ModelSerializer):
 
 class FuelLogSerializer(serializers.ModelSerializer):
     vehicle_number = serializers.CharField(source='vehicle.vehicle_number', read_only=True)
-    cost_per_liter = serializers.FloatField(source='price_per_liter', read_only=True)
+    cost_per_liter = serializers.FloatField(source='price_per_liter')
     
     class Meta:
         model = FuelLog
@@ -361,20 +421,28 @@ class FuelLogSerializer(serializers.ModelSerializer):
                  'odometer_reading', 'created_at']
         read_only_fields = ['total_cost', 'created_at']
     
-    def validate_odometer_reading(self, value):
-        vehicle = self.instance.vehicle if self.instance else self.initial_data.get('vehicle')
-        if vehicle and value < vehicle.current_odometer:
-            raise serializers.ValidationError(
-                "Odometer reading cannot be less than current vehicle odometer"
-            )
-        return value
+    def validate(self, data):
+        # Compared with the last recorded reading, not the trip based estimate
+        vehicle = data.get('vehicle') or (self.instance.vehicle if self.instance else None)
+        reading = data.get('odometer_reading')
+        if vehicle and reading is not None and reading < vehicle.confirmed_odometer:
+            raise serializers.ValidationError({
+                'odometer_reading': "Odometer reading cannot be less than the last recorded reading"
+            })
+        return data
+    
+    def save(self, **kwargs):
+        fuel_log = super().save(**kwargs)
+        Vehicle.objects.filter(pk=fuel_log.vehicle_id).record_odometer_reading(
+            fuel_log.odometer_reading, fuel_log.created_at)
+        return fuel_log
 
-class ServiceTypeSerializer(serializers.ModelSerializer):
+class ServiceTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ServiceType
         fields = ['id', 'name', 'description', 'recommended_interval_km']
 
-class PartReplacementSerializer(serializers.ModelSerializer):
+class PartReplacementSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = PartReplacement
         fields = ['id', 'part_name', 'brand', 'cost', 
@@ -390,7 +458,7 @@ class MaintenanceLogListSerializer(serializers.ModelSerializer):
         fields = ['id', 'vehicle', 'vehicle_number', 'service_type', 'service_type_name',
                  'odometer_reading', 'date', 'total_cost', 'mechanic', 'mechanic_name']
 
-class MaintenanceLogDetailSerializer(serializers.ModelSerializer):
+class MaintenanceLogDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     vehicle_details = VehicleListSerializer(source='vehicle', read_only=True)
     service_type_details = ServiceTypeSerializer(source='service_type', read_only=True)
     mechanic_details = MechanicSerializer(source='mechanic', read_only=True)
@@ -417,11 +485,9 @@ class MaintenanceLogCreateSerializer(serializers.ModelSerializer):
         for part_data in parts_data:
             PartReplacement.objects.create(maintenance_log=maintenance_log, **part_data)
         
-        # Update vehicle odometer if this reading is higher
-        vehicle = maintenance_log.vehicle
-        if maintenance_log.odometer_reading > vehicle.current_odometer:
-            vehicle.current_odometer = maintenance_log.odometer_reading
-            vehicle.save()
+        # Update vehicle odometer if this is the highest reading so far
+        Vehicle.objects.filter(pk=maintenance_log.vehicle_id).record_odometer_reading(
+            maintenance_log.odometer_reading, maintenance_log.date)
         
         return maintenance_log
 
@@ -470,6 +536,25 @@ class LicenseSerializer(serializers.ModelSerializer):
     def get_is_expired(self, obj):
         return obj.expiry_date < timezone.now().date()
 
+class ComplianceItemSerializer(serializers.ModelSerializer):
+    vehicle_number = serializers.CharField(source='vehicle.vehicle_number', read_only=True)
+    is_expired = serializers.SerializerMethodField()
+    days_until_expiry = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ComplianceItem
+        fields = ['kind', 'object_id', 'vehicle', 'vehicle_number', 'reference',
+                 'expiry_date', 'is_expired', 'days_until_expiry']
+    
+    def get_is_expired(self, obj):
+        return obj.is_expired()
+    
+    def get_days_until_expiry(self, obj):
+        today = timezone.now().date()
+        if obj.expiry_date > today:
+            return (obj.expiry_date - today).days
+        return 0
+
 class ReminderSerializer(serializers.ModelSerializer):
     vehicle_number = serializers.CharField(source='vehicle.vehicle_number', read_only=True)
     is_overdue = serializers.SerializerMethodField()
@@ -505,16 +590,17 @@ class DocumentUploadSerializer(serializers.Serializer):
     document = serializers.FileField()
     
     def validate_document(self, value):
-        valid_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.doc', '.docx']
+        # DocumentUploadHandler runs the same checks while streaming, and keeps
+        # the full byte count in value.size even after it stops storing data
         file_extension = value.name.split('.')[-1].lower()
         
-        if f'.{file_extension}' not in valid_extensions:
+        if f'.{file_extension}' not in DOCUMENT_EXTENSIONS:
             raise serializers.ValidationError(
-                f'Unsupported file format. Supported formats: {", ".join(valid_extensions)}'
+                f'Unsupported file format. Supported formats: {", ".join(DOCUMENT_EXTENSIONS)}'
             )
         
         # Limit file size to 10MB
-        if value.size > 10 * 1024 * 1024:
+        if value.size > MAX_DOCUMENT_SIZE:
             raise serializers.ValidationError('File size cannot exceed 10MB')
         
         return value
@@ -527,6 +613,60 @@ class NearbyMechanicSerializer(serializers.Serializer):
     distance_km = serializers.FloatField()
     location = serializers.CharField()
 
+class DispatchSerializer(serializers.ModelSerializer):
+    vehicle_number = serializers.CharField(source='vehicle.vehicle_number', read_only=True)
+    mechanic_name = serializers.CharField(source='mechanic.username', read_only=True)
+    mechanic_phone = serializers.CharField(source='mechanic.phone_number', read_only=True)
+    
+    class Meta:
+        model = Dispatch
+        fields = ['id', 'vehicle', 'vehicle_number', 'mechanic', 'mechanic_name', 'mechanic_phone',
+                 'latitude', 'longitude', 'speciality', 'description', 'distance_km', 'status',
+                 'created_at', 'updated_at']
+        read_only_fields = fields
+
+class DispatchRequestSerializer(serializers.Serializer):
+    vehicle = serializers.IntegerField()
+    latitude = serializers.FloatField()
+    longitude = serializers.FloatField()
+    speciality = serializers.CharField(max_length=100, required=False, allow_blank=True, default='')
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def validate_latitude(self, value):
+        if not (-90 <= value <= 90):
+            raise serializers.ValidationError('Latitude must be between -90 and 90')
+        return value
+    
+    def validate_longitude(self, value):
+        if not (-180 <= value <= 180):
+            raise serializers.ValidationError('Longitude must be between -180 and 180')
+        return value
+
+class DispatchBulkSerializer(serializers.Serializer):
+    incidents = DispatchRequestSerializer(many=True, allow_empty=False)
+    
+    def validate_incidents(self, value):
+        if len(value) > settings.DISPATCH_BULK_MAX_INCIDENTS:
+            raise serializers.ValidationError(
+                f'At most {settings.DISPATCH_BULK_MAX_INCIDENTS} incidents per request')
+        return value
+
+class DriverAssignmentSerializer(serializers.Serializer):
+    driver = serializers.IntegerField()
+    # null takes the driver off their vehicle
+    vehicle = serializers.IntegerField(allow_null=True)
+
+class DriverAssignmentBatchSerializer(serializers.Serializer):
+    assignments = DriverAssignmentSerializer(many=True, allow_empty=False)
+    
+    def validate_assignments(self, value):
+        if len(value) > settings.DRIVER_ASSIGNMENT_MAX:
+            raise serializers.ValidationError(f'At most {settings.DRIVER_ASSIGNMENT_MAX} assignments per request')
+        drivers = [item['driver'] for item in value]
+        if len(set(drivers)) != len(drivers):
+            raise serializers.ValidationError('Each driver may appear only once')
+        return value
+
 class TripStartSerializer(serializers.Serializer):
     start_lat = serializers.FloatField(required=True)
     start_lng = serializers.FloatField(required=True)
@@ -553,4 +693,55 @@ class TripEndSerializer(serializers.Serializer):
     def validate_end_lng(self, value):
         if not (-180 <= value <= 180):
             raise serializers.ValidationError('Longitude must be between -180 and 180')
-        return value
\ No newline at end of file
+        return value
+
+class GeofenceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Geofence
+        fields = ['id', 'name', 'polygon', 'alert_on_enter', 'alert_on_exit', 'is_active',
+                 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+    
+    def validate_polygon(self, value):
+        if not isinstance(value, list) or len(value) < 3:
+            raise serializers.ValidationError('A geofence needs at least 3 vertices')
+        
+        vertices = []
+        for vertex in value:
+            if not (isinstance(vertex, list) and len(vertex) == 2
+                    and all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in vertex)):
+                raise serializers.ValidationError('Vertices must be [latitude, longitude] pairs')
+            lat, lng = vertex
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise serializers.ValidationError('Vertex out of range')
+            vertices.append([float(lat), float(lng)])
+        return vertices
+
+class TripLocationBatchSerializer(serializers.Serializer):
+    # Points are checked in one plain loop rather than a nested serializer
+    # per point, which would dominate the cost of large batches
+    points = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+    
+    def validate_points(self, value):
+        if len(value) > settings.TRIP_LOCATION_MAX_BATCH:
+            raise serializers.ValidationError(
+                f'At most {settings.TRIP_LOCATION_MAX_BATCH} points per batch')
+        
+        now = timezone.now()
+        points = []
+        for i, point in enumerate(value):
+            try:
+                lat = float(point['latitude'])
+                lng = float(point['longitude'])
+                timestamp = point.get('timestamp')
+                timestamp = datetime.fromisoformat(timestamp) if timestamp else now
+            except (KeyError, TypeError, ValueError):
+                raise serializers.ValidationError(f'Point {i}: latitude, longitude and an ISO 8601 timestamp are expected')
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise serializers.ValidationError(f'Point {i}: coordinates out of range')
+            if timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp)
+            points.append((lat, lng, timestamp))
+        
+        points.sort(key=lambda point: point[2])
+        return points
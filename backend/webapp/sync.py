@@ -0,0 +1,240 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .fast_serializers import (
+    fuel_log_fast, insurance_fast, maintenance_log_fast, reminder_fast,
+    trip_list_fast, vehicle_list_fast
+)
+from .models import (
+    Driver, FuelLog, Insurance, MaintenanceLog, Reminder, SyncTombstone, Trip,
+    Vehicle, deleted_with_vehicle
+)
+
+# Delta sync for the mobile client.
+#
+# A sync token carries, per collection, the (updated_at, pk) of the last row
+# the client received, plus the same cursor for tombstones. Each call is one
+# indexed range read per collection past its cursor. Rows touched in the
+# last SYNC_SAFETY_SECONDS are left for the next call, so a transaction that
+# commits a little after it stamped updated_at is not skipped over.
+#
+# Deletes leave a SyncTombstone. They are purged after
+# SYNC_TOMBSTONE_RETENTION_DAYS, so older tokens are refused and the client
+# starts again from a full sync.
+
+SALT = 'webapp.sync'
+
+# name: (model, compiled serializer)
+COLLECTIONS = {
+    'vehicles': (Vehicle, vehicle_list_fast),
+    'trips': (Trip, trip_list_fast),
+    'fuel_logs': (FuelLog, fuel_log_fast),
+    'maintenance_logs': (MaintenanceLog, maintenance_log_fast),
+    'insurances': (Insurance, insurance_fast),
+    'reminders': (Reminder, reminder_fast),
+}
+
+COLLECTION_NAMES = {model: name for name, (model, _serializer) in COLLECTIONS.items()}
+
+
+class Scope:
+    # What one principal sees: a car owner gets everything on their
+    # vehicles, a driver gets their assigned vehicle and their own trips
+
+    def __init__(self, user):
+        if isinstance(user, Driver):
+            self.key = f'driver:{user.pk}:{user.vehicle_id}'
+            self.driver_id = user.pk
+            self.vehicle_id = user.vehicle_id
+            self.owner_id = None
+        else:
+            self.key = f'owner:{user.pk}'
+            self.driver_id = self.vehicle_id = None
+            self.owner_id = user.pk
+
+    def queryset(self, name, model):
+        if self.owner_id is not None:
+            if name == 'vehicles':
+                return model.objects.filter(owner_id=self.owner_id)
+            return model.objects.filter(vehicle__owner_id=self.owner_id)
+        if name == 'trips':
+            return model.objects.filter(driver_id=self.driver_id)
+        if self.vehicle_id is None:
+            return model.objects.none()
+        if name == 'vehicles':
+            return model.objects.filter(pk=self.vehicle_id)
+        return model.objects.filter(vehicle_id=self.vehicle_id)
+
+    def tombstones(self):
+        if self.owner_id is not None:
+            return SyncTombstone.objects.filter(owner_id=self.owner_id)
+        scope = Q(driver_id=self.driver_id, collection='trips')
+        if self.vehicle_id is not None:
+            scope |= Q(vehicle_id=self.vehicle_id) & ~Q(collection='trips')
+        return SyncTombstone.objects.filter(scope)
+
+
+def _dump_cursor(cursor):
+    if cursor is None:
+        return None
+    at, pk = cursor
+    return [at.isoformat(), pk]
+
+
+def _load_cursor(cursor):
+    if cursor is None:
+        return None
+    at, pk = cursor
+    return datetime.fromisoformat(at), pk
+
+
+def _after(queryset, field, cursor):
+    if cursor is None:
+        return queryset
+    at, pk = cursor
+    return queryset.filter(Q(**{f'{field}__gt': at}) | Q(**{field: at, 'pk__gt': pk}))
+
+
+def make_token(scope, cursors, tombstone_cursor):
+    return signing.dumps({
+        'scope': scope.key,
+        'cursors': {name: _dump_cursor(cursor) for name, cursor in cursors.items()},
+        'deleted': _dump_cursor(tombstone_cursor),
+    }, salt=SALT, compress=True)
+
+
+def read_token(scope, token):
+    # None when the client has to start over with a full sync
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=SALT,
+                             max_age=timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS))
+    except signing.BadSignature:
+        return None
+    # A driver moved to another vehicle has a different data set altogether
+    if data.get('scope') != scope.key:
+        return None
+    cursors = {name: _load_cursor(data['cursors'].get(name)) for name in COLLECTIONS}
+    return cursors, _load_cursor(data['deleted'])
+
+
+def changes(user, token=None, request=None):
+    scope = Scope(user)
+    horizon = timezone.now() - timedelta(seconds=settings.SYNC_SAFETY_SECONDS)
+    page_size = settings.SYNC_PAGE_SIZE
+
+    state = read_token(scope, token)
+    reset = state is None
+    if reset:
+        # Deletes before the snapshot are already reflected in it
+        cursors, tombstone_cursor = {name: None for name in COLLECTIONS}, (horizon, 0)
+    else:
+        cursors, tombstone_cursor = state
+
+    has_more = False
+    records = {}
+    for name, (model, serializer) in COLLECTIONS.items():
+        queryset = _after(scope.queryset(name, model).filter(updated_at__lt=horizon), 'updated_at', cursors[name])
+        rows = serializer.serialize_with(queryset.order_by('updated_at', 'pk')[:page_size + 1],
+                                         ('updated_at', 'pk'), request)
+        if len(rows) > page_size:
+            has_more = True
+            rows = rows[:page_size]
+        if rows:
+            cursors[name] = tuple(rows[-1][1])
+        records[name] = [record for record, _cursor in rows]
+
+    deleted = {name: [] for name in COLLECTIONS}
+    tombstones = list(
+        _after(scope.tombstones().filter(deleted_at__lt=horizon), 'deleted_at', tombstone_cursor)
+        .order_by('deleted_at', 'pk')
+        .values_list('collection', 'object_id', 'deleted_at', 'pk')[:page_size + 1]
+    )
+    if len(tombstones) > page_size:
+        has_more = True
+        tombstones = tombstones[:page_size]
+    for collection, object_id, _deleted_at, _pk in tombstones:
+        deleted[collection].append(object_id)
+    if tombstones:
+        tombstone_cursor = tombstones[-1][2:]
+
+    return {
+        'token': make_token(scope, cursors, tombstone_cursor),
+        'reset': reset,
+        'has_more': has_more,
+        'changes': records,
+        'deleted': deleted,
+    }
+
+
+def _owner_id(vehicle_id, origin):
+    # Looked up once per vehicle for all the rows one delete cascades to
+    owners = getattr(origin, '_tombstone_owners', None)
+    if owners is None:
+        owners = {}
+        if origin is not None:
+            origin._tombstone_owners = owners
+    if vehicle_id not in owners:
+        owners[vehicle_id] = Vehicle.objects.filter(pk=vehicle_id).values_list('owner_id', flat=True).first()
+    return owners[vehicle_id]
+
+
+@receiver(pre_delete, sender=Vehicle)
+def record_vehicle_tombstones(sender, instance, **kwargs):
+    # pre_delete, the rows the vehicle's delete cascades to are still there.
+    # Their tombstones are written here in one go rather than row by row.
+    tombstones = [SyncTombstone(collection=COLLECTION_NAMES[Vehicle], object_id=instance.pk,
+                                owner_id=instance.owner_id, vehicle_id=instance.pk)]
+    for model in (Trip, FuelLog, MaintenanceLog, Insurance, Reminder):
+        columns = ('pk', 'driver_id') if model is Trip else ('pk',)
+        for row in model.objects.filter(vehicle_id=instance.pk).values_list(*columns):
+            tombstones.append(SyncTombstone(
+                collection=COLLECTION_NAMES[model],
+                object_id=row[0],
+                owner_id=instance.owner_id,
+                vehicle_id=instance.pk,
+                driver_id=row[1] if model is Trip else None,
+            ))
+    SyncTombstone.objects.bulk_create(tombstones, batch_size=500)
+
+
+@receiver(pre_delete, sender=Trip)
+@receiver(pre_delete, sender=FuelLog)
+@receiver(pre_delete, sender=MaintenanceLog)
+@receiver(pre_delete, sender=Insurance)
+@receiver(pre_delete, sender=Reminder)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    if deleted_with_vehicle(origin):
+        # Recorded by record_vehicle_tombstones
+        return
+    SyncTombstone.objects.create(
+        collection=COLLECTION_NAMES[sender],
+        object_id=instance.pk,
+        owner_id=_owner_id(instance.vehicle_id, origin),
+        vehicle_id=instance.vehicle_id,
+        driver_id=instance.driver_id if sender is Trip else None,
+    )
+
+
+# A vehicle's payload names its assigned driver, which lives on the Driver row
+
+@receiver(pre_save, sender=Driver)
+def remember_assignment(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._synced_vehicle_id = (Driver.objects.filter(pk=instance.pk)
+                                       .values_list('vehicle_id', flat=True).first())
+
+
+@receiver(post_save, sender=Driver)
+@receiver(post_delete, sender=Driver)
+def touch_assigned_vehicles(sender, instance, **kwargs):
+    vehicle_ids = {instance.vehicle_id, getattr(instance, '_synced_vehicle_id', None)} - {None}
+    if vehicle_ids:
+        Vehicle.objects.filter(pk__in=vehicle_ids).update(updated_at=timezone.now())
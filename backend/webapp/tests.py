@@ -1,3 +1,237 @@
-from django.test import TestCase
+import io
+import time
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from webapp import costs, dashboard, routers
+from webapp.bench import create_tables, seed_fleet
+from webapp.middleware import ReplicaRoutingMiddleware
+from webapp.models import (CarOwner, CarOwnerToken, FuelLog, MaintenanceLog, PartReplacement, Trip, Vehicle,
+                           VehicleMonthlyCost)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    # Routing decisions only, QuerySet.db asks the router without running a query
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory(HTTP_AUTHORIZATION='Bearer owner-token')
+
+    def serve(self, request, write=False):
+        seen = {}
+
+        def view(request):
+            seen['read'] = Vehicle.objects.all().db
+            if write:
+                seen['write'] = router.db_for_write(FuelLog)
+                seen['read_after_write'] = Vehicle.objects.all().db
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(view)(request)
+        return seen
+
+    def test_safe_request_reads_replica(self):
+        self.assertEqual(self.serve(self.factory.get('/car-owner/vehicles/'))['read'], 'replica')
+        self.assertEqual(self.serve(self.factory.head('/car-owner/vehicles/'))['read'], 'replica')
+
+    def test_unsafe_request_reads_and_writes_primary(self):
+        seen = self.serve(self.factory.post('/car-owner/fuel-logs/'), write=True)
+        self.assertEqual(seen, {'read': 'default', 'write': 'default', 'read_after_write': 'default'})
+
+    def test_write_moves_rest_of_request_to_primary(self):
+        seen = self.serve(self.factory.get('/car-owner/vehicles/'), write=True)
+        self.assertEqual(seen, {'read': 'replica', 'write': 'default', 'read_after_write': 'default'})
+
+    def test_writer_reads_primary_until_sticky_window_passes(self):
+        self.serve(self.factory.post('/car-owner/fuel-logs/'), write=True)
+        self.assertEqual(self.serve(self.factory.get('/car-owner/fuel-logs/'))['read'], 'default')
+
+        # Other principals are not pinned
+        other = RequestFactory(HTTP_AUTHORIZATION='Bearer other-token').get('/car-owner/fuel-logs/')
+        self.assertEqual(self.serve(other)['read'], 'replica')
+
+        with mock.patch('time.time', return_value=time.time() + 6):
+            self.assertEqual(self.serve(self.factory.get('/car-owner/fuel-logs/'))['read'], 'replica')
+
+    def test_outside_request_reads_primary(self):
+        self.assertEqual(Vehicle.objects.all().db, 'default')
+
+    def test_tokens_read_primary(self):
+        token = routers.begin(True)
+        try:
+            self.assertEqual(CarOwnerToken.objects.all().db, 'default')
+            self.assertEqual(Vehicle.objects.all().db, 'replica')
+        finally:
+            routers.end(token)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: HttpResponse())
+
+
+class VehicleDashboardTests(TestCase):
+    # One query authenticates the owner, the rest is the dashboard's budget
+
+    @classmethod
+    def setUpClass(cls):
+        # webapp has no migrations yet, its tables are created before the
+        # class transaction opens, as bench.temporary_database does
+        create_tables()
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        fleet = seed_fleet(vehicles_per_owner=2, trips_per_vehicle=5, fuel_logs_per_vehicle=5,
+                           reminders_per_vehicle=5)
+        cls.owner = fleet['owners'][0]
+        cls.vehicle = fleet['vehicles'][0]
+        cls.token = CarOwnerToken.objects.create(car_owner=cls.owner)
+
+    def get(self, vehicle_id, query=''):
+        return self.client.get(f'/vehicles/{vehicle_id}/dashboard/{query}',
+                               HTTP_AUTHORIZATION=f'Bearer {self.token.key}')
+
+    def test_all_sections_within_budget(self):
+        with self.assertNumQueries(1 + dashboard.query_budget()):
+            response = self.get(self.vehicle.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), set(dashboard.SECTIONS))
+
+    def test_selected_sections_within_budget(self):
+        sections = ('trips', 'reminders')
+        with self.assertNumQueries(1 + dashboard.query_budget(sections)):
+            response = self.get(self.vehicle.pk, '?sections=reminders,trips')
+        self.assertEqual(set(response.json()), set(sections))
+
+    def test_queries_do_not_grow_with_rows(self):
+        Trip.objects.bulk_create([Trip(vehicle=self.vehicle, driver=trip.driver, status='completed')
+                                  for trip in Trip.objects.filter(vehicle=self.vehicle)] * 10)
+        with self.assertNumQueries(1 + dashboard.query_budget()):
+            self.get(self.vehicle.pk)
+
+    def test_empty_vehicle_within_budget(self):
+        empty = Vehicle.objects.create(owner=self.owner, vehicle_number='EMPTY-1', model='Bare',
+                                       manufacturer='Test', year_of_manufacture=2020)
+        with self.assertNumQueries(1 + dashboard.query_budget()):
+            response = self.get(empty.pk)
+        self.assertEqual(response.json()['trips'], [])
+
+    def test_other_owners_vehicle_not_found(self):
+        owner = CarOwner.objects.create(username='other', email='other@fleet.test', phone_number='0700000000',
+                                        address='Nairobi')
+        other = Vehicle.objects.create(owner=owner, vehicle_number='OTHER-1', model='Bare', manufacturer='Test',
+                                       year_of_manufacture=2020)
+        self.assertEqual(self.get(other.pk).status_code, 404)
+
+    def test_unknown_section(self):
+        self.assertEqual(self.get(self.vehicle.pk, '?sections=vehicle,tyres').status_code, 400)
+
+
+class CostBucketTests(TestCase):
+    # The buckets are kept by delta signals, after every kind of write they
+    # must agree with what rebuild_cost_buckets would compute
+
+    @classmethod
+    def setUpClass(cls):
+        create_tables()
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        fleet = seed_fleet(owners=2, vehicles_per_owner=2, trips_per_vehicle=0, fuel_logs_per_vehicle=0,
+                           reminders_per_vehicle=0)
+        cls.owner, cls.other_owner = fleet['owners']
+        cls.vehicle, cls.other_vehicle = fleet['vehicles'][:2]
+        cls.vehicle_ids = [vehicle.pk for vehicle in fleet['vehicles']]
+
+    def assertBucketsCurrent(self):
+        self.assertEqual(costs.stale_buckets(self.vehicle_ids), [])
+
+    def fuel_log(self, vehicle, day, liters=40):
+        return FuelLog.objects.create(vehicle=vehicle, date=day, fuel_type='petrol', quantity_liters=liters,
+                                      price_per_liter=1.85, odometer_reading=1000)
+
+    def maintenance_log(self, vehicle, when, cost='250.00', parts=('40.10', '12.35')):
+        log = MaintenanceLog.objects.create(vehicle=vehicle, odometer_reading=1000, date=when,
+                                            total_cost=Decimal(cost))
+        for part_cost in parts:
+            PartReplacement.objects.create(maintenance_log=log, part_name='Filter', cost=Decimal(part_cost))
+        return log
+
+    def test_fuel_logs(self):
+        log = self.fuel_log(self.vehicle, date(2024, 1, 15))
+        self.fuel_log(self.vehicle, date(2024, 1, 20), liters=12.5)
+        self.assertBucketsCurrent()
+
+        log.quantity_liters = 55
+        log.save()
+        self.assertBucketsCurrent()
+
+        log.date = date(2024, 3, 2)
+        log.save()
+        self.assertBucketsCurrent()
+
+        log.vehicle = self.other_vehicle
+        log.save()
+        self.assertBucketsCurrent()
+
+        log.delete()
+        self.assertBucketsCurrent()
+
+    def test_maintenance_logs_and_parts(self):
+        log = self.maintenance_log(self.vehicle, datetime(2024, 2, 10, 9, tzinfo=dt_timezone.utc))
+        self.assertBucketsCurrent()
+
+        part = log.replaced_parts.first()
+        part.cost = Decimal('99.99')
+        part.save()
+        log.total_cost = Decimal('310.50')
+        log.save()
+        self.assertBucketsCurrent()
+
+        # The log's parts follow it to the new month and vehicle
+        log.date = datetime(2024, 4, 1, 9, tzinfo=dt_timezone.utc)
+        log.save()
+        log.vehicle = self.other_vehicle
+        log.save()
+        self.assertBucketsCurrent()
+
+        part.delete()
+        self.assertBucketsCurrent()
+        log.delete()
+        self.assertBucketsCurrent()
+
+    def test_vehicle_moves_and_deletes(self):
+        self.fuel_log(self.vehicle, date(2024, 5, 1))
+        self.maintenance_log(self.vehicle, datetime(2024, 5, 3, tzinfo=dt_timezone.utc))
+
+        self.vehicle.current_odometer += 10
+        self.vehicle.save(update_fields=['current_odometer'])
+        self.vehicle.owner = self.other_owner
+        self.vehicle.save(update_fields=['owner'])
+        self.assertBucketsCurrent()
+
+        self.vehicle.delete()
+        self.assertBucketsCurrent()
+
+    def test_check_command(self):
+        self.fuel_log(self.vehicle, date(2024, 6, 1))
+        call_command('rebuild_cost_buckets', check=True, stdout=io.StringIO())
+
+        # Bulk writes skip the signals
+        FuelLog.objects.filter(vehicle=self.vehicle).update(total_cost=1.0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_cost_buckets', check=True, stdout=io.StringIO())
+        call_command('rebuild_cost_buckets', stdout=io.StringIO())
+        call_command('rebuild_cost_buckets', check=True, stdout=io.StringIO())
+        self.assertTrue(VehicleMonthlyCost.objects.filter(vehicle=self.vehicle, fuel_cost=1.0).exists())
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from PIL import Image, ImageOps
+
+# Resized copies of Vehicle.image, generated on first request on a small
+# worker pool and kept in a size-bounded disk cache. Pillow releases the GIL
+# while decoding and resampling, so threads are enough here.
+#
+# Variant URLs are handed out by authenticated vehicle endpoints and carry
+# a signature over the vehicle and image version, so they work in <img>
+# tags without a token but cannot be guessed by walking primary keys.
+
+SALT = 'webapp.thumbnails'
+
+# A source image that cannot be read or decoded
+RENDER_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_pending = {}
+_last_eviction = 0.0
+
+
+def image_version(image_name):
+    # Changes whenever a new image is uploaded, so variant URLs can be cached forever
+    return hashlib.sha1(image_name.encode()).hexdigest()[:16]
+
+
+def signature(pk, version):
+    return signing.Signer(salt=SALT).signature(f'{pk}/{version}')
+
+
+def check_signature(pk, version, value):
+    return bool(version and value) and constant_time_compare(signature(pk, version), value)
+
+
+def variant_path(image_name, variant):
+    return os.path.join(settings.VEHICLE_IMAGE_CACHE_DIR, variant, f'{image_version(image_name)}.jpg')
+
+
+def variant_urls(vehicle, request=None):
+    return variant_urls_for(vehicle.pk, vehicle.image.name, request)
+
+
+def variant_urls_for(pk, image_name, request=None):
+    if not image_name:
+        return None
+
+    version = image_version(image_name)
+    urls = {}
+    for variant in settings.VEHICLE_IMAGE_VARIANTS:
+        url = reverse('vehicle_image_variant', args=[pk, variant]) + f'?v={version}&sig={signature(pk, version)}'
+        urls[variant] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+def _get_pool():
+    global _pool, _pool_pid
+
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=settings.VEHICLE_IMAGE_WORKERS,
+                                       thread_name_prefix='vehicle-images')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _render(image_name, variant, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f'{target}.{threading.get_ident()}.tmp'
+
+    with default_storage.open(image_name, 'rb') as source, Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(settings.VEHICLE_IMAGE_VARIANTS[variant], Image.Resampling.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(temporary, 'JPEG', quality=85, optimize=True, progressive=True)
+
+    # Readers only ever see a complete file
+    os.replace(temporary, target)
+    _maybe_evict()
+    return target
+
+
+def _finished(target):
+    with _lock:
+        _pending.pop(target, None)
+
+
+def get_variant(image_name, variant):
+    target = variant_path(image_name, variant)
+    try:
+        mtime = os.stat(target).st_mtime
+    except FileNotFoundError:
+        pass
+    else:
+        # Refresh at most daily so eviction approximates least recently used
+        if time.time() - mtime > 86400:
+            os.utime(target)
+        return target
+
+    # Concurrent requests for the same variant share one render
+    pool = _get_pool()
+    with _lock:
+        future = _pending.get(target)
+        submitted = future is None
+        if submitted:
+            future = pool.submit(_render, image_name, variant, target)
+            _pending[target] = future
+    if submitted:
+        # Outside the lock, the callback runs inline if the render already finished
+        future.add_done_callback(lambda f: _finished(target))
+    return future.result(timeout=settings.VEHICLE_IMAGE_TIMEOUT)
+
+
+def open_variant(image_name, variant):
+    # The variant can be evicted between get_variant and the open, render it again then
+    try:
+        return open(get_variant(image_name, variant), 'rb')
+    except FileNotFoundError:
+        return open(get_variant(image_name, variant), 'rb')
+
+
+def evict(max_bytes):
+    # Drop the least recently used variants until the cache fits
+    entries = []
+    total = 0
+    for root, _dirs, files in os.walk(settings.VEHICLE_IMAGE_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    removed = 0
+    entries.sort()
+    for _mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def _maybe_evict():
+    global _last_eviction
+
+    now = time.monotonic()
+    with _lock:
+        if now - _last_eviction < settings.VEHICLE_IMAGE_EVICTION_INTERVAL:
+            return
+        _last_eviction = now
+    evict(settings.VEHICLE_IMAGE_CACHE_MAX_BYTES)
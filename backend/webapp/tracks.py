@@ -0,0 +1,231 @@
+import math
+import struct
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from . import archive
+from .serializers import TripLocationSerializer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Compact encodings of a trip track for the mobile client.
+#
+# polyline: the encoded polyline format (latitude and longitude interleaved,
+#   scaled by 10^precision, delta and zigzag encoded, 5 bits per printable
+#   character) plus a second string in the same encoding holding
+#   millisecond timestamp deltas.
+# binary: a TRK1 frame, a fixed header then three columns of zigzag LEB128
+#   varints: latitude deltas, longitude deltas and millisecond timestamp
+#   deltas, coordinates scaled by 10^6.
+#
+# Both are lossy below their precision and drop location ids. A track is
+# encoded from three columns, latitudes, longitudes and epoch milliseconds.
+# With numpy installed they are arrays and every step after reading them is
+# vectorized; archived trips are decoded straight into arrays. Without it
+# they are lists handled one value at a time, with identical output.
+
+POLYLINE_PRECISION = 5
+BINARY_PRECISION = 6
+
+MAGIC = b'TRK1'
+# magic, point count, coordinate precision, first timestamp in epoch milliseconds
+HEADER = struct.Struct('<4sIBq')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+# (bits per chunk, continuation flag, offset added to each chunk)
+POLYLINE_CHUNKS = (5, 0x20, 63)
+VARINT_CHUNKS = (7, 0x80, 0)
+
+
+def _deltas(values):
+    previous = 0
+    out = []
+    for value in values:
+        out.append(value - previous)
+        previous = value
+    return out
+
+
+def _scaled_deltas(values, precision):
+    # Half up like the reference encoder, round() would round half to even
+    scale = 10 ** precision
+    if numpy is not None:
+        scaled = numpy.floor(numpy.asarray(values, dtype=numpy.float64) * scale + 0.5).astype(numpy.int64)
+        return numpy.diff(scaled, prepend=0)
+    return _deltas([math.floor(value * scale + 0.5) for value in values])
+
+
+def _time_deltas(milliseconds, start):
+    if numpy is not None:
+        return numpy.diff(numpy.asarray(milliseconds, dtype=numpy.int64) - start, prepend=0)
+    return _deltas([value - start for value in milliseconds])
+
+
+def _concatenate(*columns):
+    if numpy is not None:
+        return numpy.concatenate(columns)
+    return [value for column in columns for value in column]
+
+
+def _interleave(first, second):
+    if numpy is not None:
+        return numpy.column_stack((first, second)).ravel()
+    return [value for pair in zip(first, second) for value in pair]
+
+
+def _encode_python(values, chunks):
+    bits, flag, offset = chunks
+    mask = (1 << bits) - 1
+    out = bytearray()
+    for value in values:
+        value = ~(value << 1) if value < 0 else value << 1
+        while value > mask:
+            out.append(((value & mask) | flag) + offset)
+            value >>= bits
+        out.append(value + offset)
+    return bytes(out)
+
+
+def _encode_numpy(values, chunks):
+    bits, flag, offset = chunks
+    values = numpy.asarray(values, dtype=numpy.int64)
+    zigzag = ((values << 1) ^ (values >> 63)).view(numpy.uint64)
+
+    # Chunks each value needs, looping once per chunk of the widest value
+    used = numpy.ones(len(zigzag), dtype=numpy.int64)
+    rest = zigzag >> numpy.uint64(bits)
+    while rest.any():
+        used += rest != 0
+        rest >>= numpy.uint64(bits)
+
+    # One output byte per chunk: the value it belongs to and its place in it
+    owner = numpy.repeat(numpy.arange(len(zigzag)), used)
+    place = numpy.arange(len(owner)) - numpy.repeat(numpy.cumsum(used) - used, used)
+    out = (zigzag[owner] >> (place * bits).astype(numpy.uint64)) & numpy.uint64((1 << bits) - 1)
+    out[place < used[owner] - 1] |= numpy.uint64(flag)
+    out += numpy.uint64(offset)
+    return out.astype(numpy.uint8).tobytes()
+
+
+def _encode(values, chunks):
+    if numpy is not None and len(values):
+        return _encode_numpy(values, chunks)
+    return _encode_python(values, chunks)
+
+
+def _decode(data, chunks, start=0, count=None):
+    bits, flag, offset = chunks
+    values = []
+    position = start
+    while position < len(data) and (count is None or len(values) < count):
+        value = shift = 0
+        while True:
+            chunk = data[position] - offset
+            position += 1
+            value |= (chunk & ~flag) << shift
+            shift += bits
+            if not chunk & flag:
+                break
+        values.append(~(value >> 1) if value & 1 else value >> 1)
+    return values, position
+
+
+def point_columns(rows):
+    # (latitudes, longitudes, epoch milliseconds) from (latitude, longitude,
+    # timestamp) rows in track order
+    count = len(rows)
+    lats, lngs, timestamps = zip(*rows) if rows else ((), (), ())
+    if numpy is not None:
+        # datetime.timestamp runs in C; microseconds survive the trip through
+        # a double exactly until 2255, then are floored like the Python path
+        seconds = numpy.fromiter(map(datetime.timestamp, timestamps), numpy.float64, count)
+        return (numpy.fromiter(lats, numpy.float64, count), numpy.fromiter(lngs, numpy.float64, count),
+                numpy.rint(seconds * 1e6).astype(numpy.int64) // 1000)
+    return lats, lngs, [(timestamp - EPOCH) // MILLISECOND for timestamp in timestamps]
+
+
+def archive_columns(data):
+    # The same columns from a TripLocationArchive blob, without building rows
+    _id_deltas, time_deltas, lats, lngs = archive.unpack_columns(data)
+    if numpy is not None:
+        micros = numpy.cumsum(numpy.frombuffer(time_deltas, dtype=numpy.int64))
+        return (numpy.frombuffer(lats, dtype=numpy.float64), numpy.frombuffer(lngs, dtype=numpy.float64),
+                micros // 1000)
+    return lats.tolist(), lngs.tolist(), [micros // 1000 for micros in _undelta(time_deltas)]
+
+
+def track_columns(trip):
+    # Live points, then archived ones, as Trip.location_points orders them
+    columns = point_columns(list(trip.live_location_points()))
+    data = trip.archived_location_data()
+    if data is not None:
+        columns = tuple(_concatenate(live, archived) for live, archived in zip(columns, archive_columns(data)))
+    return columns
+
+
+def _undelta(deltas):
+    total = 0
+    out = []
+    for delta in deltas:
+        total += delta
+        out.append(total)
+    return out
+
+
+def encode_polyline(columns, precision=POLYLINE_PRECISION):
+    # columns: see point_columns
+    lats, lngs, times = columns
+    start = int(times[0]) if len(times) else None
+    points = _interleave(_scaled_deltas(lats, precision), _scaled_deltas(lngs, precision))
+    return {
+        'format': 'polyline',
+        'precision': precision,
+        'count': len(times),
+        'start': start,
+        'polyline': _encode(points, POLYLINE_CHUNKS).decode('ascii'),
+        'timestamps': _encode(_time_deltas(times, start or 0), POLYLINE_CHUNKS).decode('ascii'),
+    }
+
+
+def decode_polyline(payload):
+    scale = 10 ** payload['precision']
+    values, _end = _decode(payload['polyline'].encode('ascii'), POLYLINE_CHUNKS)
+    lats = _undelta(values[0::2])
+    lngs = _undelta(values[1::2])
+    offsets, _end = _decode(payload['timestamps'].encode('ascii'), POLYLINE_CHUNKS)
+    times = [EPOCH + (payload['start'] + offset) * MILLISECOND for offset in _undelta(offsets)]
+    return [(lat / scale, lng / scale, at) for lat, lng, at in zip(lats, lngs, times)]
+
+
+def pack_track(columns, precision=BINARY_PRECISION):
+    lats, lngs, times = columns
+    start = int(times[0]) if len(times) else 0
+    columns = _concatenate(_scaled_deltas(lats, precision), _scaled_deltas(lngs, precision),
+                           _time_deltas(times, start))
+    return HEADER.pack(MAGIC, len(times), precision, start) + _encode(columns, VARINT_CHUNKS)
+
+
+def unpack_track(frame):
+    magic, count, precision, start = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise ValueError('Not a track frame')
+    values, _end = _decode(frame, VARINT_CHUNKS, HEADER.size, count * 3)
+    scale = 10 ** precision
+    lats = _undelta(values[:count])
+    lngs = _undelta(values[count:2 * count])
+    times = [EPOCH + (start + offset) * MILLISECOND for offset in _undelta(values[2 * count:])]
+    return [(lat / scale, lng / scale, at) for lat, lng, at in zip(lats, lngs, times)]
+
+
+def track_data(request, trip):
+    # What the negotiated renderer expects: plain location objects for JSON
+    fmt = request.accepted_renderer.format
+    if fmt == 'polyline':
+        return encode_polyline(track_columns(trip))
+    if fmt == 'track':
+        return pack_track(track_columns(trip))
+    return TripLocationSerializer(trip.all_locations(), many=True).data
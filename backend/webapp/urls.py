@@ -0,0 +1,61 @@
+from django.urls import path
+
+from webapp import views
+
+urlpatterns = [
+    # Drivers
+    path('driver/register/', views.driver_registration, name='driver_registration'),
+    path('driver/login/', views.driver_login, name='driver_login'),
+    path('driver/logout/', views.driver_logout, name='driver_logout'),
+    path('driver/change-password/', views.driver_change_password, name='driver_change_password'),
+    path('driver/profile/', views.driver_profile, name='driver_profile'),
+    path('driver/trips/', views.driver_trips, name='driver_trips'),
+    path('driver/trips/<int:trip_id>/', views.driver_trip_detail, name='driver_trip_detail'),
+    path('driver/trips/<int:trip_id>/track/', views.driver_trip_track, name='driver_trip_track'),
+    path('driver/trips/<int:trip_id>/end/', views.trip_end, name='trip_end'),
+    path('driver/trips/<int:trip_id>/locations/', views.trip_locations, name='trip_locations'),
+    path('driver/sync/', views.driver_sync, name='driver_sync'),
+    path('driver/scores/', views.driver_scores, name='driver_scores'),
+
+    # Car owners
+    path('car-owner/register/', views.car_owner_registration, name='car_owner_registration'),
+    path('car-owner/login/', views.car_owner_login, name='car_owner_login'),
+    path('car-owner/logout/', views.car_owner_logout, name='car_owner_logout'),
+    path('car-owner/change-password/', views.car_owner_change_password, name='car_owner_change_password'),
+    path('car-owner/profile/', views.car_owner_profile, name='car_owner_profile'),
+    path('car-owner/drivers/<int:driver_id>/driving-report/', views.driver_driving_report, name='driver_driving_report'),
+    path('car-owner/geofences/', views.car_owner_geofences, name='car_owner_geofences'),
+    path('car-owner/geofences/<int:pk>/', views.car_owner_geofence_detail, name='car_owner_geofence_detail'),
+    path('car-owner/sync/', views.car_owner_sync, name='car_owner_sync'),
+    path('car-owner/compliance/', views.car_owner_compliance, name='car_owner_compliance'),
+    path('car-owner/compliance/summary/', views.car_owner_compliance_summary, name='car_owner_compliance_summary'),
+    path('car-owner/costs/', views.car_owner_costs, name='car_owner_costs'),
+    path('car-owner/leaderboard/', views.car_owner_leaderboard, name='car_owner_leaderboard'),
+    path('car-owner/driver-assignments/', views.car_owner_driver_assignments, name='car_owner_driver_assignments'),
+    path('car-owner/dispatch/', views.dispatch_create, name='dispatch_create'),
+    path('car-owner/dispatch/bulk/', views.dispatch_bulk, name='dispatch_bulk'),
+    path('car-owner/dispatch/candidates/', views.dispatch_candidates, name='dispatch_candidates'),
+    path('car-owner/dispatch/<int:pk>/cancel/', views.dispatch_cancel, name='dispatch_cancel'),
+
+    # Mechanics
+    path('mechanic/register/', views.mechanic_registration, name='mechanic_registration'),
+    path('mechanic/login/', views.mechanic_login, name='mechanic_login'),
+    path('mechanic/logout/', views.mechanic_logout, name='mechanic_logout'),
+    path('mechanic/change-password/', views.mechanic_change_password, name='mechanic_change_password'),
+    path('mechanic/profile/', views.mechanic_profile, name='mechanic_profile'),
+    path('mechanic/dispatches/', views.mechanic_dispatches, name='mechanic_dispatches'),
+    path('mechanic/dispatches/<int:pk>/complete/', views.mechanic_dispatch_complete, name='mechanic_dispatch_complete'),
+
+    # Vehicles
+    path('vehicles/<int:vehicle_id>/trips/', views.vehicle_trips, name='vehicle_trips'),
+    path('vehicles/<int:vehicle_id>/trips/<int:trip_id>/track/', views.vehicle_trip_track, name='vehicle_trip_track'),
+    path('vehicles/<int:vehicle_id>/fuel-logs/', views.vehicle_fuel_logs, name='vehicle_fuel_logs'),
+    path('vehicles/<int:vehicle_id>/reminders/', views.vehicle_reminders, name='vehicle_reminders'),
+    path('vehicles/<int:vehicle_id>/maintenance-logs/<int:log_id>/', views.vehicle_maintenance_log_detail,
+         name='vehicle_maintenance_log_detail'),
+    path('vehicles/<int:vehicle_id>/dashboard/', views.vehicle_dashboard, name='vehicle_dashboard'),
+    path('vehicles/<int:pk>/image/<str:variant>/', views.vehicle_image_variant, name='vehicle_image_variant'),
+
+    # Insurance, inspection and license documents
+    path('documents/<str:kind>/<int:pk>/', views.document_upload, name='document_upload'),
+]
@@ -1,11 +1,24 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Count, Max, Sum
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
+from django.shortcuts import get_object_or_404, render
+from django.utils.dateparse import parse_date
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
 from rest_framework import status
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, renderer_classes
 from rest_framework.response import Response
 from webapp.authentication import CarOwnerTokenAuthentication, DriverTokenAuthentication, MechanicTokenAuthentication
-from webapp.models import CarOwnerToken, DriverToken, MechanicToken
+from webapp.caching import invalidate_profile, profile_response
+from webapp.documents import DOCUMENT_MODELS, DocumentUploadHandler, attach_document
+from webapp.fast_serializers import compliance_item_fast, fuel_log_fast, reminder_fast, trip_list_fast
+from webapp.hashing import PasswordHashingBusy
+from webapp.models import CarOwnerToken, Dispatch, DriverScore, DriverToken, FuelLog, Geofence, MaintenanceLog, MechanicToken, Reminder, Trip, TripLocation, TripSummary, Vehicle
 from webapp.permissions import IsAuthenticated
-from webapp.serializers import CarOwnerLoginSerializer, CarOwnerProfileSerializer, CarOwnerRegistrationSerializer, ChangePasswordSerializer, DriverLoginSerializer, DriverProfileSerializer, DriverRegistrationSerializer, MechanicLoginSerializer, MechanicProfileSerializer, MechanicRegistrationSerializer
+from webapp.renderers import FastJSONRenderer, TrackBinaryRenderer, TrackPolylineRenderer
+from webapp import assignments, compliance, costs, dashboard, dispatch, fieldsets, geofencing, hashing, metrics, scoring, sync, thumbnails, tracks
+from webapp.serializers import CarOwnerLoginSerializer, CarOwnerProfileSerializer, CarOwnerRegistrationSerializer, ChangePasswordSerializer, DispatchBulkSerializer, DispatchRequestSerializer, DispatchSerializer, DocumentUploadSerializer, DriverAssignmentBatchSerializer, DriverLoginSerializer, DriverProfileSerializer, DriverRegistrationSerializer, FuelLogSerializer, GeofenceSerializer, MaintenanceLogDetailSerializer, MechanicLoginSerializer, MechanicProfileSerializer, MechanicRegistrationSerializer, NearbyMechanicSerializer, ReminderSerializer, TripDetailSerializer, TripEndSerializer, TripLocationBatchSerializer
 
 # Create your views here.
 
@@ -21,6 +34,8 @@ def driver_registration(request):
                     'driver_id': driver.id,
                     'username': driver.username
                 }, status=status.HTTP_201_CREATED)
+            except PasswordHashingBusy:
+                raise
             except Exception as e:
                 return Response({
                     'error': str(e)
@@ -40,6 +55,8 @@ def car_owner_registration(request):
                     'car_owner_id': car_owner.id,
                     'username': car_owner.username
                 }, status=status.HTTP_201_CREATED)
+            except PasswordHashingBusy:
+                raise
             except Exception as e:
                 return Response({
                     'error': str(e)
@@ -58,7 +75,7 @@ def car_owner_login(request):
             car_owner = serializer.validated_data['car_owner']
             
             # Create or get token
-            token, created = CarOwnerToken.objects.get_or_create(car_owner=car_owner)
+            token, created = CarOwnerToken.objects.get_or_create_active(car_owner=car_owner)
             
             return Response({
                 'message': 'Login successful',
@@ -84,6 +101,8 @@ def mechanic_registration(request):
                     'mechanic_id': mechanic.id,
                     'username': mechanic.username
                 }, status=status.HTTP_201_CREATED)
+            except PasswordHashingBusy:
+                raise
             except Exception as e:
                 return Response({
                     'error': str(e)
@@ -99,7 +118,7 @@ def driver_login(request):
             driver = serializer.validated_data['driver']
             
             # Create or get token
-            token, created = DriverToken.objects.get_or_create(driver=driver)
+            token, created = DriverToken.objects.get_or_create_active(driver=driver)
             
             return Response({
                 'message': 'Login successful',
@@ -121,13 +140,13 @@ def mechanic_login(request):
         if serializer.is_valid():
             mechanic = serializer.validated_data['mechanic']
                    
-        # Create or get token
-        token, created = MechanicToken.objetcs.get_or_create(mechanic=mechanic)
-        return Response({
-            'message':'login successful',
-            'token':token.key,
-            'mechanic':{
-                 'id': mechanic.id,
+            # Create or get token
+            token, created = MechanicToken.objects.get_or_create_active(mechanic=mechanic)
+            return Response({
+                'message':'login successful',
+                'token':token.key,
+                'mechanic':{
+                    'id': mechanic.id,
                     'username': mechanic.username,
                     'email': mechanic.email,
                     'phone_number': mechanic.phone_number,
@@ -202,8 +221,7 @@ def driver_change_password(request):
    
     serializer = ChangePasswordSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        request.user.set_password(serializer.validated_data['new_password'])
-        request.user.save()
+        hashing.set_password(request.user.user, serializer.validated_data['new_password'])
         return Response({
             'message': 'Password changed successfully'
         }, status=status.HTTP_200_OK)
@@ -216,8 +234,7 @@ def car_owner_change_password(request):
     
     serializer = ChangePasswordSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        request.user.set_password(serializer.validated_data['new_password'])
-        request.user.save()
+        hashing.set_password(request.user.user, serializer.validated_data['new_password'])
         return Response({
             'message': 'Password changed successfully'
         }, status=status.HTTP_200_OK)
@@ -230,8 +247,7 @@ def mechanic_change_password(request):
     
     serializer = ChangePasswordSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        request.user.set_password(serializer.validated_data['new_password'])
-        request.user.save()
+        hashing.set_password(request.user.user, serializer.validated_data['new_password'])
         return Response({
             'message': 'Password changed successfully'
         }, status=status.HTTP_200_OK)
@@ -244,13 +260,19 @@ def mechanic_change_password(request):
 def driver_profile(request):
     
     if request.method == 'GET':
-        serializer = DriverProfileSerializer(request.user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return profile_response(request, 'driver', DriverProfileSerializer)
     
     elif request.method == 'PUT':
         serializer = DriverProfileSerializer(request.user, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                serializer.save()
+            except IntegrityError:
+                # Another driver took the vehicle since validation
+                return Response({
+                    'vehicle': ['This vehicle is already assigned to another driver']
+                }, status=status.HTTP_400_BAD_REQUEST)
+            invalidate_profile('driver', request.user.pk)
             return Response({
                 'message': 'Profile updated successfully',
                 'driver': serializer.data
@@ -263,13 +285,13 @@ def driver_profile(request):
 def car_owner_profile(request):
     
     if request.method == 'GET':
-        serializer = CarOwnerProfileSerializer(request.user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return profile_response(request, 'car_owner', CarOwnerProfileSerializer)
     
     elif request.method == 'PUT':
         serializer = CarOwnerProfileSerializer(request.user, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            invalidate_profile('car_owner', request.user.pk)
             return Response({
                 'message': 'Profile updated successfully',
                 'car_owner': serializer.data
@@ -282,15 +304,551 @@ def car_owner_profile(request):
 def mechanic_profile(request):
     
     if request.method == 'GET':
-        serializer = MechanicProfileSerializer(request.user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return profile_response(request, 'mechanic', MechanicProfileSerializer)
     
     elif request.method == 'PUT':
         serializer = MechanicProfileSerializer(request.user, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            invalidate_profile('mechanic', request.user.pk)
             return Response({
                 'message': 'Profile updated successfully',
                 'mechanic': serializer.data
             }, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# List endpoints use the compiled read-only serializers, see fast_serializers.py
+@api_view(['GET'])
+@authentication_classes([DriverTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def driver_trips(request):
+    
+    trips = Trip.objects.filter(driver=request.user).order_by('-id')
+    return Response(trip_list_fast.serialize(trips, request), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def vehicle_trips(request, vehicle_id):
+    
+    trips = Trip.objects.filter(vehicle_id=vehicle_id, vehicle__owner=request.user).order_by('-id')
+    return Response(trip_list_fast.serialize(trips, request), status=status.HTTP_200_OK)
+
+@api_view(['GET', 'POST'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def vehicle_fuel_logs(request, vehicle_id):
+    
+    if request.method == 'GET':
+        fuel_logs = FuelLog.objects.filter(vehicle_id=vehicle_id, vehicle__owner=request.user).order_by('-date', '-id')
+        return Response(fuel_log_fast.serialize(fuel_logs, request), status=status.HTTP_200_OK)
+    
+    get_object_or_404(Vehicle, pk=vehicle_id, owner=request.user)
+    data = request.data.copy()
+    data['vehicle'] = vehicle_id
+    serializer = FuelLogSerializer(data=data)
+    if serializer.is_valid():
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def vehicle_reminders(request, vehicle_id):
+    
+    reminders = Reminder.objects.filter(vehicle_id=vehicle_id, vehicle__owner=request.user)
+    return Response(reminder_fast.serialize(reminders, request), status=status.HTTP_200_OK)
+
+# One round trip for the vehicle screen, ?sections=vehicle,trips,... to pick parts
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def vehicle_dashboard(request, vehicle_id):
+    
+    try:
+        sections = dashboard.parse_sections(request.GET.get('sections'))
+    except ValueError as exc:
+        return Response({
+            'error': str(exc),
+            'sections': dashboard.SECTIONS
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    vehicle = dashboard.owned_vehicle(vehicle_id, request.user, sections)
+    if vehicle is None:
+        return Response({
+            'error': 'Vehicle not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    return Response(dashboard.build(vehicle, sections, request), status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def document_upload(request, kind, pk):
+    
+    model = DOCUMENT_MODELS.get(kind)
+    if model is None:
+        return Response({
+            'error': f'Unknown document type: {kind}'
+        }, status=status.HTTP_404_NOT_FOUND)
+    instance = get_object_or_404(model, pk=pk, vehicle__owner=request.user)
+    
+    # Must be in place before request.data is first read
+    request.upload_handlers = [DocumentUploadHandler(request)]
+    
+    serializer = DocumentUploadSerializer(data=request.data)
+    if serializer.is_valid():
+        stored, created = attach_document(instance, serializer.validated_data['document'])
+        return Response({
+            'message': 'Document uploaded successfully',
+            'document': stored.file.url,
+            'sha256': stored.sha256,
+            'deduplicated': not created
+        }, status=status.HTTP_200_OK)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+# Detail endpoints take ?fields= and ?expand=, see fieldsets.py
+@api_view(['GET'])
+@authentication_classes([DriverTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def driver_trip_detail(request, trip_id):
+    
+    fieldset = fieldsets.Fieldset.from_request(request)
+    trips = fieldsets.optimize(Trip.objects.filter(driver=request.user), TripDetailSerializer, fieldset)
+    trip = get_object_or_404(trips, pk=trip_id)
+    return Response(TripDetailSerializer(trip, fieldset=fieldset, context={'request': request}).data,
+                    status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def vehicle_maintenance_log_detail(request, vehicle_id, log_id):
+    
+    fieldset = fieldsets.Fieldset.from_request(request)
+    logs = fieldsets.optimize(MaintenanceLog.objects.filter(vehicle_id=vehicle_id, vehicle__owner=request.user),
+                              MaintenanceLogDetailSerializer, fieldset)
+    log = get_object_or_404(logs, pk=log_id)
+    return Response(MaintenanceLogDetailSerializer(log, fieldset=fieldset, context={'request': request}).data,
+                    status=status.HTTP_200_OK)
+
+# Trip track as JSON, encoded polyline or a binary frame, see tracks.py
+@api_view(['GET'])
+@renderer_classes([FastJSONRenderer, TrackPolylineRenderer, TrackBinaryRenderer])
+@authentication_classes([DriverTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def driver_trip_track(request, trip_id):
+    
+    trip = get_object_or_404(Trip, pk=trip_id, driver=request.user)
+    return Response(tracks.track_data(request, trip), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@renderer_classes([FastJSONRenderer, TrackPolylineRenderer, TrackBinaryRenderer])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def vehicle_trip_track(request, vehicle_id, trip_id):
+    
+    trip = get_object_or_404(Trip, pk=trip_id, vehicle_id=vehicle_id, vehicle__owner=request.user)
+    return Response(tracks.track_data(request, trip), status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@authentication_classes([DriverTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def trip_end(request, trip_id):
+    
+    trip = get_object_or_404(Trip, pk=trip_id, driver=request.user)
+    if trip.status != 'ongoing':
+        return Response({
+            'error': 'Only an ongoing trip can be ended'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = TripEndSerializer(data=request.data)
+    if serializer.is_valid():
+        if not trip.end_trip(serializer.validated_data['end_lat'], serializer.validated_data['end_lng']):
+            # Ended by a concurrent request since it was loaded
+            return Response({
+                'error': 'Only an ongoing trip can be ended'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'message': 'Trip completed',
+            'trip_id': trip.id,
+            'distance_km': trip.distance_km
+        }, status=status.HTTP_200_OK)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['POST'])
+@authentication_classes([DriverTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def trip_locations(request, trip_id):
+    
+    trip = get_object_or_404(Trip.objects.select_related('vehicle'), pk=trip_id, driver=request.user)
+    if trip.status != 'ongoing':
+        return Response({
+            'error': 'Locations can only be added to an ongoing trip'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = TripLocationBatchSerializer(data=request.data)
+    if serializer.is_valid():
+        points = serializer.validated_data['points']
+        metrics.INGEST_BATCH_SIZE.observe(len(points))
+        locations = TripLocation.objects.bulk_create([
+            TripLocation(trip=trip, latitude=lat, longitude=lng, timestamp=timestamp)
+            for lat, lng, timestamp in points
+        ], batch_size=500)
+        TripSummary.record(trip, points)
+        events = geofencing.process_locations(trip, locations)
+        return Response({
+            'message': 'Locations recorded',
+            'count': len(locations),
+            'geofence_events': ReminderSerializer(events, many=True).data
+        }, status=status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+# Insurances, inspections and licenses expiring within ?days= (default
+# COMPLIANCE_WINDOW_DAYS), expired ones included unless ?include_expired=false
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def car_owner_compliance(request):
+    
+    try:
+        days = int(request.GET.get('days', settings.COMPLIANCE_WINDOW_DAYS))
+    except ValueError:
+        days = -1
+    if not 0 <= days <= settings.COMPLIANCE_MAX_WINDOW_DAYS:
+        return Response({
+            'error': f'days must be a whole number between 0 and {settings.COMPLIANCE_MAX_WINDOW_DAYS}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    include_expired = request.GET.get('include_expired', 'true').lower() not in ('false', '0', 'no')
+    items = compliance.expiring(request.user, days, include_expired)
+    return Response(compliance_item_fast.serialize(items, request), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def car_owner_compliance_summary(request):
+    
+    return Response(compliance.summary(request.user.pk), status=status.HTTP_200_OK)
+
+# Fuel, maintenance and parts costs per month and per vehicle for
+# ?from=YYYY-MM to ?to=YYYY-MM inclusive (default the last twelve months),
+# one vehicle with ?vehicle=
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def car_owner_costs(request):
+    
+    default_start, default_end = costs.default_range()
+    start = costs.parse_month(request.GET['from']) if 'from' in request.GET else default_start
+    end = costs.parse_month(request.GET['to']) if 'to' in request.GET else default_end
+    if start is None or end is None:
+        return Response({'error': 'from and to must be months as YYYY-MM'}, status=status.HTTP_400_BAD_REQUEST)
+    months = (end.year - start.year) * 12 + end.month - start.month + 1
+    if not 1 <= months <= settings.COST_REPORT_MAX_MONTHS:
+        return Response({
+            'error': f'to must not be before from, and the range at most {settings.COST_REPORT_MAX_MONTHS} months'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    vehicle_id = request.GET.get('vehicle')
+    if vehicle_id is not None:
+        if not vehicle_id.isdigit() or not Vehicle.objects.filter(pk=vehicle_id, owner=request.user).exists():
+            return Response({'error': 'Vehicle not found'}, status=status.HTTP_404_NOT_FOUND)
+        vehicle_id = int(vehicle_id)
+    return Response(costs.report(request.user, start, end, vehicle_id), status=status.HTTP_200_OK)
+
+# Delta sync, ?token= from the previous response, none for a full sync
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def car_owner_sync(request):
+    
+    return Response(sync.changes(request.user, request.GET.get('token'), request), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@authentication_classes([DriverTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def driver_sync(request):
+    
+    return Response(sync.changes(request.user, request.GET.get('token'), request), status=status.HTTP_200_OK)
+
+# Sums the stored trip summaries, raw locations are never read
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def driver_driving_report(request, driver_id):
+    
+    summaries = TripSummary.objects.filter(trip__driver_id=driver_id, trip__vehicle__owner=request.user)
+    try:
+        start = parse_date(request.GET.get('from', ''))
+        end = parse_date(request.GET.get('to', ''))
+    except ValueError:
+        return Response({
+            'error': 'from and to must be valid dates as YYYY-MM-DD'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if start:
+        summaries = summaries.filter(trip__started_at__date__gte=start)
+    if end:
+        summaries = summaries.filter(trip__started_at__date__lte=end)
+    
+    totals = summaries.aggregate(
+        trips=Count('pk'),
+        distance_km=Sum('tracked_distance_km'),
+        moving_seconds=Sum('moving_seconds'),
+        idle_seconds=Sum('idle_seconds'),
+        stops=Sum('stop_count'),
+        harsh_accelerations=Sum('harsh_acceleration_count'),
+        harsh_brakings=Sum('harsh_braking_count'),
+        max_speed_kmh=Max('max_speed_kmh'),
+    )
+    if not totals['trips']:
+        return Response({
+            'error': 'No trips found for this driver'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    distance = totals['distance_km'] or 0.0
+    per_100_km = 100 / distance if distance else 0.0
+    totals.update({
+        'driver_id': driver_id,
+        'from': start,
+        'to': end,
+        'average_speed_kmh': round(distance / totals['moving_seconds'] * 3600, 2) if totals['moving_seconds'] else 0.0,
+        'harsh_accelerations_per_100_km': round(totals['harsh_accelerations'] * per_100_km, 2),
+        'harsh_brakings_per_100_km': round(totals['harsh_brakings'] * per_100_km, 2),
+    })
+    return Response(totals, status=status.HTTP_200_OK)
+
+# The owner's drivers ranked by score, ?limit= rows from ?offset=
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def car_owner_leaderboard(request):
+    
+    try:
+        limit = int(request.GET.get('limit', settings.LEADERBOARD_DEFAULT_SIZE))
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        limit = offset = -1
+    if not 1 <= limit <= settings.LEADERBOARD_MAX_SIZE or offset < 0:
+        return Response({
+            'error': f'limit must be between 1 and {settings.LEADERBOARD_MAX_SIZE} and offset not negative'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    count, results = scoring.ranking(request.user.pk, offset, limit)
+    return Response({'count': count, 'results': results}, status=status.HTTP_200_OK)
+
+# The driver's score and rank with every owner whose vehicles they drove
+@api_view(['GET'])
+@authentication_classes([DriverTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def driver_scores(request):
+    
+    data = []
+    for score in DriverScore.objects.filter(driver=request.user).select_related('owner').order_by('owner_id'):
+        ranked, ranks = scoring.ranks(score.owner_id, [request.user.pk])
+        data.append({
+            'owner_id': score.owner_id,
+            'owner': score.owner.username,
+            'score': score.score,
+            'rank': ranks[request.user.pk],
+            'ranked_drivers': ranked,
+            **{name: getattr(score, name) for name in scoring.TOTAL_FIELDS},
+            'updated_at': score.updated_at,
+        })
+    return Response(data, status=status.HTTP_200_OK)
+
+@api_view(['GET', 'POST'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def car_owner_geofences(request):
+    
+    if request.method == 'GET':
+        geofences = Geofence.objects.filter(owner=request.user).order_by('id')
+        return Response(GeofenceSerializer(geofences, many=True).data, status=status.HTTP_200_OK)
+    
+    serializer = GeofenceSerializer(data=request.data)
+    if serializer.is_valid():
+        serializer.save(owner=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['PUT', 'DELETE'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def car_owner_geofence_detail(request, pk):
+    
+    geofence = get_object_or_404(Geofence, pk=pk, owner=request.user)
+    if request.method == 'DELETE':
+        geofence.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    serializer = GeofenceSerializer(geofence, data=request.data, partial=True)
+    if serializer.is_valid():
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+# Moves drivers between the owner's vehicles in one transaction, drivers
+# left on a vehicle given to someone else are unassigned
+@api_view(['POST'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def car_owner_driver_assignments(request):
+    
+    serializer = DriverAssignmentBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    changes = {item['driver']: item['vehicle'] for item in serializer.validated_data['assignments']}
+    try:
+        result = assignments.reassign(request.user, changes)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except IntegrityError:
+        # A driver took one of the vehicles concurrently, nothing was applied
+        return Response({
+            'error': 'A vehicle was assigned concurrently, retry the request'
+        }, status=status.HTTP_409_CONFLICT)
+    return Response(result, status=status.HTTP_200_OK)
+
+# Nearest available mechanics for ?latitude=&longitude=, optionally with ?speciality=
+@api_view(['GET'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def dispatch_candidates(request):
+    
+    serializer = DispatchRequestSerializer(data={'vehicle': 0, **request.GET.dict()})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    ranked = dispatch.candidates(data['latitude'], data['longitude'], data['speciality'])
+    return Response(NearbyMechanicSerializer([
+        {'mechanic_id': mechanic.pk, 'username': mechanic.username, 'speciality': mechanic.speciality,
+         'distance_km': distance, 'location': mechanic.location}
+        for distance, mechanic in ranked
+    ], many=True).data, status=status.HTTP_200_OK)
+
+def _dispatch_data(pk):
+    return DispatchSerializer(Dispatch.objects.select_related('vehicle', 'mechanic').get(pk=pk)).data
+
+# Claims the nearest available mechanic for a breakdown of one of the owner's vehicles
+@api_view(['POST'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def dispatch_create(request):
+    
+    serializer = DispatchRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = dict(serializer.validated_data)
+    vehicle = Vehicle.objects.filter(pk=data.pop('vehicle'), owner=request.user).first()
+    if vehicle is None:
+        return Response({'error': 'Vehicle not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    assigned = dispatch.dispatch(vehicle, **data)
+    if assigned is None:
+        return Response({
+            'error': 'No mechanic is available nearby'
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(_dispatch_data(assigned.pk), status=status.HTTP_201_CREATED)
+
+# Several breakdowns at once, each result is a dispatch or an error in request order
+@api_view(['POST'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def dispatch_bulk(request):
+    
+    serializer = DispatchBulkSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    incidents = [dict(incident) for incident in serializer.validated_data['incidents']]
+    vehicles = Vehicle.objects.filter(owner=request.user).in_bulk({incident['vehicle'] for incident in incidents})
+    missing = sorted({incident['vehicle'] for incident in incidents} - set(vehicles))
+    if missing:
+        return Response({
+            'error': f'Vehicles not found: {", ".join(map(str, missing))}'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    for incident in incidents:
+        incident['vehicle'] = vehicles[incident['vehicle']]
+    assigned = dispatch.dispatch_many(incidents)
+    found = Dispatch.objects.select_related('vehicle', 'mechanic').in_bulk(
+        [item.pk for item in assigned if item is not None])
+    results = [
+        DispatchSerializer(found[item.pk]).data if item is not None else {'error': 'No mechanic is available nearby'}
+        for item in assigned
+    ]
+    return Response({
+        'assigned': sum(item is not None for item in assigned),
+        'results': results,
+    }, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@authentication_classes([CarOwnerTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def dispatch_cancel(request, pk):
+    
+    if not dispatch.release(pk, 'cancelled', vehicle__owner=request.user):
+        return Response({'error': 'No open dispatch found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(_dispatch_data(pk), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@authentication_classes([MechanicTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def mechanic_dispatches(request):
+    
+    dispatches = (Dispatch.objects.filter(mechanic=request.user).select_related('vehicle', 'mechanic')
+                  .order_by('-id')[:50])
+    return Response(DispatchSerializer(dispatches, many=True).data, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@authentication_classes([MechanicTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def mechanic_dispatch_complete(request, pk):
+    
+    if not dispatch.release(pk, 'completed', mechanic=request.user):
+        return Response({'error': 'No open dispatch found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(_dispatch_data(pk), status=status.HTTP_200_OK)
+
+# Served like media files, authorized by the signature in the URLs the
+# vehicle endpoints hand out rather than a token
+@require_GET
+def vehicle_image_variant(request, pk, variant):
+    
+    if variant not in settings.VEHICLE_IMAGE_VARIANTS:
+        raise Http404('Unknown image variant')
+    requested = request.GET.get('v')
+    if not thumbnails.check_signature(pk, requested, request.GET.get('sig')):
+        raise Http404('Unknown image')
+    vehicle = get_object_or_404(Vehicle.objects.only('image'), pk=pk)
+    if not vehicle.image:
+        raise Http404('Vehicle has no image')
+    
+    try:
+        image = thumbnails.open_variant(vehicle.image.name, variant)
+    except TimeoutError:
+        response = HttpResponse('Image is still being resized', status=503, content_type='text/plain')
+        response['Retry-After'] = '1'
+        return response
+    except thumbnails.RENDER_ERRORS:
+        raise Http404('Vehicle image cannot be read')
+    response = FileResponse(image, content_type='image/jpeg')
+    
+    # Versioned URLs never change content, anything else must revalidate
+    if requested == thumbnails.image_version(vehicle.image.name):
+        patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+@require_GET
+def metrics_view(request):
+    
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    
+    return HttpResponse(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')